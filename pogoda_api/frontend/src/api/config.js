@@ -5,6 +5,13 @@ export const API_BASE_URL = "http://127.0.0.1:8000/api/pogoda";
 export const ENDPOINTS = {
     CURRENT: "/",
     REFRESH: "/refresh/",
-    HISTORY: (city) => `/history/${encodeURIComponent(city)}/`,
-    FORECAST: (city) => `/forecast/${encodeURIComponent(city)}/`,
+    STREAM: "/stream/",
+    HISTORY: (city, params = {}) => {
+        const query = new URLSearchParams(params).toString();
+        return `/history/${encodeURIComponent(city)}/${query ? `?${query}` : ''}`;
+    },
+    FORECAST: (city, params = {}) => {
+        const query = new URLSearchParams(params).toString();
+        return `/forecast/${encodeURIComponent(city)}/${query ? `?${query}` : ''}`;
+    },
 };
\ No newline at end of file
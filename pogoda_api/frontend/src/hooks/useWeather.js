@@ -12,9 +12,32 @@ const fetchData = async (endpoint) => {
     return response.json();
 };
 
-// --- POPRAWIONY HOOK ---
-// Używamy endpointu REFRESH, aby przy wejściu na stronę główną
-// wymusić pobranie danych z zewnętrznego API (OpenMeteo).
+// Odpowiedzi ?format=columnar mają jedną tablicę na zmienną ({ time: [...], temperature: [...] }).
+// Wykresy (recharts) potrzebują listy obiektów - zamieniamy dopiero po stronie klienta.
+const columnsToRows = (columns) => {
+    const keys = Object.keys(columns || {});
+    if (keys.length === 0) return [];
+    return columns[keys[0]].map((_, i) =>
+        Object.fromEntries(keys.map((key) => [key, columns[key][i]]))
+    );
+};
+
+const concatColumns = (a, b) =>
+    Object.fromEntries(Object.keys(a).map((key) => [key, [...a[key], ...(b[key] || [])]]));
+
+// Podmienia w liście odczyty miast z `updates` (zdarzenie `update` strumienia).
+const mergeReadings = (current, updates) => {
+    const byCity = new Map(current.map((reading) => [reading.city_name, reading]));
+    updates.forEach((reading) => byCity.set(reading.city_name, reading));
+    return [...byCity.values()];
+};
+
+// Bieżąca pogoda ze strumienia SSE (/api/pogoda/stream/) zamiast odpytywania
+// co X ms: serwer wysyła `snapshot` (cała lista) po połączeniu, a potem `update`
+// (tylko zmienione miasta) po każdym zapisie nowych danych. Strumień sam
+// uruchamia odświeżanie nieaktualnych danych - jak endpoint REFRESH.
+// Bez EventSource (stare przeglądarki) albo gdy serwer odmówi strumienia
+// (501 pod WSGI) wracamy do odpytywania REFRESH.
 export const useCurrentWeather = (refreshInterval = 300000) => {
     const [data, setData] = useState([]);
     const [loading, setLoading] = useState(true);
@@ -24,8 +47,6 @@ export const useCurrentWeather = (refreshInterval = 300000) => {
         setLoading(true);
         setError(null);
         try {
-            // ZMIANA: ENDPOINTS.CURRENT -> ENDPOINTS.REFRESH
-            // Dzięki temu dane są odświeżane przy każdym załadowaniu strony głównej
             const result = await fetchData(ENDPOINTS.REFRESH);
             setData(result || []);
         } catch (err) {
@@ -36,12 +57,45 @@ export const useCurrentWeather = (refreshInterval = 300000) => {
     }, []);
 
     useEffect(() => {
-        fetchWeather();
-        if (refreshInterval) {
-            // Automatyczne odświeżanie co X ms (domyślnie 5 min)
-            const interval = setInterval(fetchWeather, refreshInterval);
-            return () => clearInterval(interval);
+        let source = null;
+        let interval = null;
+
+        const startPolling = () => {
+            fetchWeather();
+            if (refreshInterval) {
+                interval = setInterval(fetchWeather, refreshInterval);
+            }
+        };
+
+        if (typeof EventSource === 'undefined') {
+            startPolling();
+        } else {
+            // Po zerwaniu połączenia EventSource łączy się ponownie sam
+            // i dostaje nowy snapshot. Zamyka się (CLOSED) tylko wtedy, gdy
+            // serwer odpowie błędem zamiast strumienia.
+            source = new EventSource(`${API_BASE_URL}${ENDPOINTS.STREAM}`);
+            source.addEventListener('snapshot', (event) => {
+                setData(JSON.parse(event.data));
+                setError(null);
+                setLoading(false);
+            });
+            source.addEventListener('update', (event) => {
+                const updates = JSON.parse(event.data);
+                setData((current) => mergeReadings(current, updates));
+            });
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    source.close();
+                    source = null;
+                    startPolling();
+                }
+            };
         }
+
+        return () => {
+            if (source) source.close();
+            if (interval) clearInterval(interval);
+        };
     }, [fetchWeather, refreshInterval]);
 
     return { data, loading, error, refetch: fetchWeather };
@@ -61,8 +115,20 @@ export const useCityHistory = (city) => {
             setLoading(true);
             setError(null);
             try {
-                const result = await fetchData(ENDPOINTS.HISTORY(city));
-                setHistoryData(result || { city_name: city, history: [] });
+                // Historia jest stronicowana kursorem - pobieramy kolejne strony
+                // z ostatnich 30 dni, dopóki API zwraca next_cursor.
+                const from = new Date(Date.now() - 30 * 24 * 60 * 60 * 1000).toISOString().slice(0, 10);
+                const format = 'columnar';
+                let result = await fetchData(ENDPOINTS.HISTORY(city, { from, format }));
+                let cursor = result?.next_cursor;
+                while (result && cursor) {
+                    const page = await fetchData(ENDPOINTS.HISTORY(city, { from, cursor, format }));
+                    result = { ...result, history: concatColumns(result.history, page.history) };
+                    cursor = page.next_cursor;
+                }
+                setHistoryData(result
+                    ? { ...result, history: columnsToRows(result.history) }
+                    : { city_name: city, history: [] });
             } catch (err) {
                 setError(err.message);
             } finally {
@@ -87,8 +153,10 @@ export const useCityForecast = (city) => {
         setLoading(true);
         setError(null);
         try {
-            const result = await fetchData(ENDPOINTS.FORECAST(selectedCity));
-            setForecastData(result || { hourly: [], recommendation: null });
+            const result = await fetchData(ENDPOINTS.FORECAST(selectedCity, { format: 'columnar' }));
+            setForecastData(result
+                ? { ...result, hourly: columnsToRows(result.hourly) }
+                : { hourly: [], recommendation: null });
         } catch (err) {
             setError(err.message);
         } finally {
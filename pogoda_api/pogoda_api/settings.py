@@ -50,6 +50,36 @@ CORS_ALLOWED_ORIGINS = [
 
 ]
 
+# Szybka ścieżka serializacji list pogody (.values() + orjson), patrz pogoda_app/fastpath.py
+POGODA_FAST_SERIALIZATION = False
+
+# Pula połączeń HTTPS do Open-Meteo (wspólna dla procesu), patrz pogoda_app/clients.py:
+# liczba hostów z własną pulą i liczba połączeń na host.
+POGODA_OPENMETEO_POOL_CONNECTIONS = 4
+POGODA_OPENMETEO_POOL_MAXSIZE = 16
+
+# Cache odpowiedzi Open-Meteo, patrz pogoda_app/http_cache.py. BACKEND: "memory"
+# (osobno w każdym procesie), "filesystem" (LOCATION to katalog), "sqlite"
+# (plik w trybie WAL, wspólny dla workerów i schedulera) albo None (wyłączony).
+POGODA_UPSTREAM_CACHE = {
+    "BACKEND": "sqlite",
+    "LOCATION": BASE_DIR / ".openmeteo_cache.sqlite3",
+}
+
+# Liczba shardów miast dzielonych między workery run_scheduler (pogoda_app/sharding.py).
+# Musi być taka sama we wszystkich workerach; kilka razy więcej niż workerów.
+POGODA_INGEST_SHARDS = 64
+
+# Asynchroniczne widoki prognozy, odświeżania i pobierania historii (pogoda_app/async_views.py).
+# Włączać przy uruchomieniu pod serwerem ASGI (pogoda_api/asgi.py).
+POGODA_ASYNC_VIEWS = False
+
+# Nagłówki świeżości danych z /api/pogoda/refresh/ muszą być widoczne dla frontendu
+CORS_EXPOSE_HEADERS = [
+    "X-Data-Age",
+    "X-Data-Stale",
+]
+
 
 
 
@@ -0,0 +1,171 @@
+# pogoda_app/async_views.py
+"""
+Asynchroniczne (ASGI) wersje endpointów, które czekają na Open-Meteo:
+prognoza, odświeżanie bieżącej pogody i pobieranie historii miasta.
+
+Pod serwerem ASGI czekanie na zewnętrzne API nie zajmuje wątku - kilka
+procesów obsłuży setki równoczesnych zapytań o prognozę. Zapytania HTTP idą
+przez asynchroniczną sesję niquests (clients.py), a zapytania do bazy przez
+async ORM Django (upsert w transakcji - przez sync_to_async).
+
+Widoki podpina ustawienie POGODA_ASYNC_VIEWS = True (patrz urls.py). Zwracają
+te same dane co widoki DRF z views.py, bez przeglądarkowego API DRF.
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .conditional import conditional_get, forecast_etag, forecast_last_modified, seconds_to_next_hour
+from .fastpath import CURRENT_WEATHER_VALUES, OrjsonRenderer, fast_path_enabled
+from .models import City
+from .renderers import COLUMNAR_RENDERERS, wants_columnar
+from .utils import afetch_and_save_last_30_days, afetch_hourly_forecast, alatest_weather_age, \
+    cities_due_for_refresh, generate_weather_recommendation, refresh_weather_in_background, \
+    WEATHER_FRESHNESS_SECONDS
+from .views import get_latest_weather_queryset, parse_forecast_hours, serialize_latest_weather
+
+logger = logging.getLogger(__name__)
+
+
+async def aserialize_latest_weather():
+    """Asynchroniczny odpowiednik views.serialize_latest_weather."""
+    if fast_path_enabled():
+        return await CURRENT_WEATHER_VALUES.aserialize(get_latest_weather_queryset())
+    return await sync_to_async(serialize_latest_weather)()
+
+
+class AsyncAPIView(View):
+    """
+    Bazowy widok asynchroniczny: negocjacja formatu odpowiedzi jak w DRF
+    (JSON, `?format=columnar`, `?format=msgpack`) i renderowanie danych.
+    """
+    http_method_names = ["get", "head", "options"]
+    columnar_formats = False
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True  # jak APIView.as_view
+        return view
+
+    def get_renderers(self):
+        renderers = [OrjsonRenderer() if fast_path_enabled() else JSONRenderer()]
+        if self.columnar_formats:
+            renderers += [renderer() for renderer in COLUMNAR_RENDERERS]
+        return renderers
+
+    async def dispatch(self, request, *args, **kwargs):
+        renderers = self.get_renderers()
+        try:
+            request.accepted_renderer, request.accepted_media_type = \
+                DefaultContentNegotiation().select_renderer(Request(request), renderers)
+        except Http404:  # nieznany ?format= - jak w DRF
+            request.accepted_renderer, request.accepted_media_type = renderers[0], renderers[0].media_type
+            return self.not_found(request)
+        except exceptions.NotAcceptable as e:
+            request.accepted_renderer, request.accepted_media_type = renderers[0], renderers[0].media_type
+            return self.render(request, {"detail": str(e.detail)}, status=e.status_code)
+
+        return await super().dispatch(request, *args, **kwargs)
+
+    def render(self, request, data, status=status.HTTP_200_OK):
+        renderer = request.accepted_renderer
+        content_type = request.accepted_media_type
+        if renderer.charset:
+            content_type = f"{content_type}; charset={renderer.charset}"
+        return HttpResponse(
+            renderer.render(data, request.accepted_media_type, {}),
+            status=status,
+            content_type=content_type,
+        )
+
+    async def get_city(self, city_name):
+        return await City.objects.filter(name__iexact=city_name).afirst()
+
+    def not_found(self, request):
+        return self.render(request, {"detail": str(exceptions.NotFound().detail)}, status=status.HTTP_404_NOT_FOUND)
+
+
+class AsyncHourlyForecastAPI(AsyncAPIView):
+    """Asynchroniczna wersja HourlyForecastAPI (prognoza + rekomendacja)."""
+    columnar_formats = True
+
+    @conditional_get(forecast_etag, forecast_last_modified, max_age=seconds_to_next_hour)
+    async def get(self, request, city_name):
+        city = await self.get_city(city_name)
+        if city is None:
+            return self.not_found(request)
+
+        hours_param = request.GET.get("hours", 48)
+        hours = parse_forecast_hours(hours_param)
+        if hours is None:
+            return self.render(
+                request,
+                {"error": f"Niepoprawny parametr 'hours': {hours_param}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            forecast = await afetch_hourly_forecast(city, hours=hours)
+            return self.render(request, {
+                "city": city.name,
+                "hours": hours,
+                "hourly": forecast.columns() if wants_columnar(request) else forecast.rows(),
+                "recommendation": generate_weather_recommendation(forecast),
+            })
+        except Exception as e:
+            return self.render(
+                request,
+                {"error": f"Błąd pobierania prognozy: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class AsyncRefreshWeatherAPI(AsyncAPIView):
+    """Asynchroniczna wersja RefreshWeatherAPI (stale-while-revalidate)."""
+
+    async def get(self, request):
+        age = await alatest_weather_age()
+        stale = age is None or age >= WEATHER_FRESHNESS_SECONDS
+
+        if stale and await cities_due_for_refresh().aexists():
+            try:
+                refresh_weather_in_background()
+            except Exception as e:
+                logger.error("Nie udało się uruchomić odświeżania pogody w tle: %s", e)
+
+        response = self.render(request, await aserialize_latest_weather())
+        if age is not None:
+            response["X-Data-Age"] = str(int(age))
+        response["X-Data-Stale"] = "true" if stale else "false"
+        return response
+
+
+class AsyncFetchCityHistoryAPI(AsyncAPIView):
+    """Asynchroniczna wersja FetchCityHistoryAPI."""
+
+    async def get(self, request, city_name):
+        city = await self.get_city(city_name)
+        if city is None:
+            return self.not_found(request)
+
+        try:
+            result = await afetch_and_save_last_30_days(city)
+            return self.render(request, {
+                "message": f"Pomyślnie pobrano historię (30 dni) dla miasta: {city.name}",
+                "inserted": result.inserted if result else 0,
+                "updated": result.updated if result else 0,
+            })
+        except Exception as e:
+            return self.render(
+                request,
+                {"error": f"Wystąpił błąd: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
@@ -0,0 +1,106 @@
+# pogoda_app/cache.py
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """
+    Ograniczony rozmiarem (LRU) i czasem życia (TTL) cache w pamięci procesu,
+    bezpieczny dla wątków.
+
+    `maxsize` ogranicza liczbę wpisów (None - bez limitu). Z `sizeof` (funkcja
+    wartość -> liczba bajtów) i `maxbytes` limit dotyczy też łącznego rozmiaru
+    wartości; wartość większa niż `maxbytes` nie jest zapamiętywana.
+
+    `get_or_compute` skleja równoczesne chybienia dla tego samego klucza:
+    tylko pierwszy wątek wywołuje `compute`, pozostałe czekają na jego wynik.
+    """
+
+    def __init__(self, maxsize=128, ttl=3600, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.currbytes = 0
+        self._data = OrderedDict()  # klucz -> (czas wygaśnięcia, wartość, rozmiar)
+        self._pending = {}  # klucz -> Future dla trwającego obliczenia
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.currbytes = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get_or_compute(self, key, compute):
+        missing = object()
+        with self._lock:
+            value = self._get(key, missing)
+            if value is not missing:
+                return value
+
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._pending[key] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._set(key, value)
+            del self._pending[key]
+        future.set_result(value)
+        return value
+
+    def _get(self, key, default):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._pop(key)
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def _set(self, key, value):
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        if key in self._data:
+            self._pop(key)
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+
+        self._data[key] = (time.monotonic() + self.ttl, value, size)
+        self.currbytes += size
+        while (self.maxsize is not None and len(self._data) > self.maxsize) or \
+                (self.maxbytes is not None and self.currbytes > self.maxbytes):
+            self._pop(next(iter(self._data)))
+
+    def _pop(self, key):
+        _, _, size = self._data.pop(key)
+        self.currbytes -= size
@@ -0,0 +1,236 @@
+# pogoda_app/clients.py
+"""
+Wspólny dla procesu klient HTTP do Open-Meteo.
+
+Bieżąca pogoda, prognoza i archiwum ERA5 korzystają z jednej sesji `requests`
+z pulą połączeń HTTPS (keep-alive), więc kolejne zapytania do tego samego
+hosta nie płacą za nowe połączenie TCP i handshake TLS. Sesja tworzona jest
+leniwie przy pierwszym użyciu i osobno w każdym procesie (także po fork()).
+
+Rozmiary puli: ustawienia POGODA_OPENMETEO_POOL_CONNECTIONS (liczba hostów,
+dla których trzymamy pule) i POGODA_OPENMETEO_POOL_MAXSIZE (połączenia na
+host - nie mniej niż równoległość pobierania historii).
+Odpowiedzi mogą być cache'owane (POGODA_UPSTREAM_CACHE, patrz http_cache.py).
+
+Widoki asynchroniczne (ASGI) dostają osobną sesję niquests na każdą pętlę
+zdarzeń (`async_session()` / `async_client()`) - z tym samym cache.
+"""
+import asyncio
+import logging
+import os
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import openmeteo_requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from .http_cache import AsyncCachingSession, CachingSession, create_upstream_cache
+
+logger = logging.getLogger(__name__)
+
+OPENMETEO_POOL_CONNECTIONS = 4
+OPENMETEO_POOL_MAXSIZE = 16
+
+# Ponawianie przy błędach połączenia i odpowiedziach 5xx (jak retry_requests).
+OPENMETEO_RETRIES = 5
+OPENMETEO_BACKOFF_FACTOR = 0.2
+
+
+class ConnectionStats:
+    """Liczniki zapytań i nowo otwartych połączeń per host (bezpieczne dla wątków)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}  # host -> [zapytania, połączenia]
+
+    def _counters(self, host):
+        return self._hosts.setdefault(host, [0, 0])
+
+    def request_sent(self, host):
+        with self._lock:
+            self._counters(host)[0] += 1
+
+    def connection_opened(self, host):
+        with self._lock:
+            self._counters(host)[1] += 1
+
+    def reset(self):
+        with self._lock:
+            self._hosts.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                host: {
+                    "requests": requests_sent,
+                    "connections": connections,
+                    "reused": max(requests_sent - connections, 0),
+                }
+                for host, (requests_sent, connections) in self._hosts.items()
+            }
+
+
+connection_stats = ConnectionStats()
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self, *args, **kwargs):
+        connection_stats.connection_opened(self.host)
+        return super()._new_conn(*args, **kwargs)
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self, *args, **kwargs):
+        connection_stats.connection_opened(self.host)
+        return super()._new_conn(*args, **kwargs)
+
+
+class _CountingAdapter(HTTPAdapter):
+    """HTTPAdapter zliczający zapytania i nowe połączenia (connection_stats)."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        connection_stats.request_sent(urlsplit(request.url).hostname)
+        return super().send(request, *args, **kwargs)
+
+
+class OpenMeteoClients:
+    """Leniwie tworzona, bezpieczna dla wątków sesja i klient FlatBuffers Open-Meteo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()  # pętla zdarzeń -> (sesja, klient)
+
+    def _ensure(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+
+            pool_connections = getattr(settings, "POGODA_OPENMETEO_POOL_CONNECTIONS", OPENMETEO_POOL_CONNECTIONS)
+            pool_maxsize = getattr(settings, "POGODA_OPENMETEO_POOL_MAXSIZE", OPENMETEO_POOL_MAXSIZE)
+
+            session = CachingSession(create_upstream_cache())
+            self._async_clients = weakref.WeakKeyDictionary()
+            adapter = _CountingAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                max_retries=Retry(
+                    total=OPENMETEO_RETRIES,
+                    backoff_factor=OPENMETEO_BACKOFF_FACTOR,
+                    status_forcelist=(500, 502, 504),
+                    allowed_methods=None,
+                ),
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            # Sesja z procesu rodzica (przed fork()) nie jest zamykana -
+            # jej gniazda należą też do rodzica.
+            self._session = session
+            connection_stats.reset()
+            self._client = openmeteo_requests.Client(session=session)
+            self._pid = pid
+            logger.info(
+                f"🔌 Utworzono pulę połączeń Open-Meteo (pule: {pool_connections}, połączenia na host: {pool_maxsize})"
+            )
+
+    def _after_fork(self):
+        """
+        Wywoływane w procesie potomnym po fork(): sesja zostanie utworzona od
+        nowa, a blokada zastąpiona nową - w chwili fork() mógł ją trzymać inny
+        wątek rodzica, którego w dziecku już nie ma.
+        """
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def session(self):
+        """Sesja `requests` do zapytań JSON (archiwum ERA5)."""
+        self._ensure()
+        return self._session
+
+    def client(self):
+        """Klient openmeteo_requests (FlatBuffers) na tej samej sesji."""
+        self._ensure()
+        return self._client
+
+    def _ensure_async(self):
+        self._ensure()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.get(loop)
+            if clients is None:
+                session = AsyncCachingSession(
+                    self._session.upstream_cache,
+                    pool_connections=getattr(settings, "POGODA_OPENMETEO_POOL_CONNECTIONS", OPENMETEO_POOL_CONNECTIONS),
+                    pool_maxsize=getattr(settings, "POGODA_OPENMETEO_POOL_MAXSIZE", OPENMETEO_POOL_MAXSIZE),
+                    retries=Retry(
+                        total=OPENMETEO_RETRIES,
+                        backoff_factor=OPENMETEO_BACKOFF_FACTOR,
+                        status_forcelist=(500, 502, 504),
+                        allowed_methods=None,
+                    ),
+                )
+                clients = (session, openmeteo_requests.AsyncClient(session=session))
+                self._async_clients[loop] = clients
+        return clients
+
+    def async_session(self):
+        """Asynchroniczna sesja niquests (archiwum ERA5) dla bieżącej pętli zdarzeń."""
+        return self._ensure_async()[0]
+
+    def async_client(self):
+        """Asynchroniczny klient openmeteo_requests dla bieżącej pętli zdarzeń."""
+        return self._ensure_async()[1]
+
+    def stats(self):
+        """
+        Statystyki puli per host: liczba zapytań, nowo otwartych połączeń
+        i zapytań obsłużonych na już otwartym połączeniu (reused).
+        """
+        if self._pid != os.getpid():
+            return {}
+        return connection_stats.snapshot()
+
+    def shared_cache(self):
+        """Czy odpowiedzi trafiają do cache widocznego dla innych procesów (filesystem / sqlite)."""
+        self._ensure()
+        upstream_cache = self._session.upstream_cache
+        return upstream_cache is not None and upstream_cache.backend.shared
+
+    def cache_stats(self):
+        """Trafienia / chybienia cache Open-Meteo per endpoint ({} bez cache)."""
+        if self._pid != os.getpid() or self._session.upstream_cache is None:
+            return {}
+        return self._session.upstream_cache.stats()
+
+    def log_stats(self):
+        for host, host_stats in self.stats().items():
+            logger.info(
+                f"🔌 {host}: zapytania {host_stats['requests']}, "
+                f"połączenia {host_stats['connections']}, ponownie użyte {host_stats['reused']}"
+            )
+        for name, counters in self.cache_stats().items():
+            if counters["hits"] or counters["misses"]:
+                logger.info(f"🗄️ Cache {name}: trafienia {counters['hits']}, chybienia {counters['misses']}")
+
+
+openmeteo_clients = OpenMeteoClients()
+
+if hasattr(os, "register_at_fork"):  # poza Windows
+    os.register_at_fork(after_in_child=openmeteo_clients._after_fork)
@@ -0,0 +1,148 @@
+# pogoda_app/compression.py
+"""
+Cache gotowych (wyrenderowanych i skompresowanych) odpowiedzi endpointów
+z ETagiem. Ciało odpowiedzi jest takie samo dla wszystkich klientów aż do
+kolejnego zapisu danych, więc serializacja i kompresja (gzip, brotli)
+wykonywane są raz na wersję danych, a kolejne zapytania dostają gotowe bajty
+w kodowaniu wybranym na podstawie nagłówka Accept-Encoding.
+
+Brotli wymaga pakietu brotli - bez niego dostępny jest tylko gzip.
+"""
+import gzip
+from collections import namedtuple
+
+from django.http import HttpResponse
+from django.utils.cache import has_vary_header, patch_vary_headers
+
+from .cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # brotli jest opcjonalny - bez niego zostaje gzip
+    brotli = None
+
+# Łączny rozmiar (wszystkie warianty kodowania) i czas życia zapamiętanych
+# odpowiedzi. Strona historii to kilkaset KB, więc limit liczony jest w bajtach,
+# a nie we wpisach. Klucz zawiera ETag (wersję danych), więc nieaktualne wpisy
+# po prostu przestają być trafiane.
+PRECOMPRESSED_CACHE_MAX_BYTES = 32 * 1024 * 1024
+PRECOMPRESSED_CACHE_TTL = 3600
+
+# Mniejszych odpowiedzi nie kompresujemy - nagłówki gzip/brotli zjadłyby zysk.
+PRECOMPRESS_MIN_SIZE = 200
+
+# Poziomy kompresji. Kompresja blokuje pierwsze zapytanie o daną wersję danych -
+# brotli 11 dla pełnej strony historii (5000 odczytów) to ~2 s, 9 to ~50 ms.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# Kolejność preferencji przy równych wagach q w Accept-Encoding.
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+CompressedEntry = namedtuple("CompressedEntry", ["content_type", "variants"])  # variants: kodowanie -> bajty
+
+
+def _entry_size(entry):
+    return sum(len(content) for content in entry.variants.values())
+
+
+_precompressed_cache = TTLCache(
+    maxsize=None, ttl=PRECOMPRESSED_CACHE_TTL, maxbytes=PRECOMPRESSED_CACHE_MAX_BYTES, sizeof=_entry_size
+)
+
+
+def _compress(content):
+    variants = {"identity": content}
+    if len(content) < PRECOMPRESS_MIN_SIZE:
+        return variants
+
+    variants["gzip"] = gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+    if brotli is not None:
+        variants["br"] = brotli.compress(content, quality=BROTLI_QUALITY)
+    return variants
+
+
+def negotiate_encoding(accept_encoding, available):
+    """
+    Wybiera kodowanie z `available` według nagłówka Accept-Encoding
+    (z uwzględnieniem wag q oraz '*'). Zwraca "identity", gdy żadne nie pasuje.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best, best_q = "identity", 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def request_encoding(request):
+    """Kodowanie, w którym ta odpowiedź zostanie wysłana (bez względu na jej rozmiar)."""
+    return negotiate_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""), ENCODINGS)
+
+
+def encoded_etag(request, etag):
+    """
+    ETag wariantu wybranego dla zapytania: "<etag>-gzip" / "<etag>-br".
+    Warianty różnią się bajtami, więc nie mogą dzielić silnego ETagu. Dla
+    odpowiedzi poniżej PRECOMPRESS_MIN_SIZE pod ETagiem z kodowaniem wysyłane
+    są bajty nieskompresowane - nadal zawsze te same dla danego ETagu.
+    """
+    encoding = request_encoding(request)
+    return etag if encoding == "identity" else f"{etag}-{encoding}"
+
+
+def precompressible(request):
+    """
+    Czy odpowiedź na zapytanie można współdzielić między klientami. Strona
+    przeglądarkowego API (BrowsableAPIRenderer) zawiera nazwę zalogowanego
+    użytkownika i token CSRF, więc HTML nigdy nie trafia do cache.
+    """
+    renderer = getattr(request, "accepted_renderer", None)
+    if renderer is None or renderer.format == "api":
+        return False
+    return not renderer.media_type.startswith("text/html")
+
+
+def precompressed_response(request, key, build_response):
+    """
+    Zwraca odpowiedź dla klucza `key` (ścieżka + ETag) z cache, a przy
+    chybieniu wywołuje `build_response()`, renderuje ją i zapamiętuje
+    wszystkie warianty kodowania. Odpowiedzi inne niż 200 oraz zależne od
+    ciasteczek (Vary: Cookie) nie są zapamiętywane.
+    """
+    entry = _precompressed_cache.get(key)
+    if entry is None:
+        response = build_response()
+        if response.status_code != 200 or response.streaming or has_vary_header(response, "Cookie"):
+            return response
+        if hasattr(response, "render"):
+            response.render()
+        entry = CompressedEntry(response["Content-Type"], _compress(response.content))
+        _precompressed_cache.set(key, entry)
+
+    encoding = request_encoding(request)
+    if encoding not in entry.variants:
+        encoding = "identity"
+    response = HttpResponse(entry.variants[encoding], content_type=entry.content_type)
+    if encoding != "identity":
+        response["Content-Encoding"] = encoding
+    response["Content-Length"] = str(len(response.content))
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
@@ -0,0 +1,194 @@
+# pogoda_app/conditional.py
+import hashlib
+from datetime import datetime, timedelta
+from functools import partial, wraps
+
+import pytz
+from asgiref.sync import iscoroutinefunction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .compression import encoded_etag, precompressed_response, precompressible
+from .models import City
+
+# Jak długo klient / proxy może używać odpowiedzi bez pytania serwera.
+# Dane bieżące i historia zmieniają się najwyżej co WEATHER_FRESHNESS_SECONDS.
+WEATHER_MAX_AGE = 300
+
+
+def conditional_get(etag_func=None, last_modified_func=None, max_age=None, precompress=False):
+    """
+    Dekorator metody `get` widoku: obsługuje If-None-Match / If-Modified-Since
+    (odpowiedź 304 bez budowania i serializacji danych) i ustawia Cache-Control.
+
+    `max_age` może być liczbą sekund albo funkcją (request, *args, **kwargs).
+    Format odpowiedzi zależy też od nagłówka Accept, stąd `Vary: Accept`.
+
+    Z `precompress=True` odpowiedź 200 jest renderowana i kompresowana raz na
+    ETag (patrz compression.py) - kolejne zapytania dostają gotowe bajty.
+    Każde kodowanie (identity / gzip / br) ma wtedy własny ETag.
+
+    Obsługuje też asynchroniczne metody `get` (bez `precompress`); funkcje
+    ETag / Last-Modified wywoływane są wtedy synchronicznie w pętli zdarzeń,
+    więc nie mogą odpytywać bazy.
+    """
+    def finish(response, request, *args, **kwargs):
+        if response.status_code in (200, 304):
+            seconds = max_age(request, *args, **kwargs) if callable(max_age) else max_age
+            if seconds is not None:
+                patch_cache_control(response, max_age=int(seconds))
+            patch_vary_headers(response, ("Accept", "Accept-Encoding") if precompress else ("Accept",))
+        return response
+
+    def decorator(view_method):
+        if iscoroutinefunction(view_method):
+            @wraps(view_method)
+            async def async_wrapper(self, request, *args, **kwargs):
+                conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(
+                    partial(view_method, self)
+                )
+                response = await conditional_view(request, *args, **kwargs)
+                return finish(response, request, *args, **kwargs)
+
+            return async_wrapper
+
+        def build_view(self, request, *args, **kwargs):
+            etag = etag_func(request, *args, **kwargs) if precompress and precompressible(request) else None
+            if etag is None:
+                return view_method(self, request, *args, **kwargs)
+
+            def build_response():
+                response = view_method(self, request, *args, **kwargs)
+                return self.finalize_response(request, response, *args, **kwargs)
+
+            return precompressed_response(request, (request.path, etag), build_response)
+
+        def variant_etag(request, *args, **kwargs):
+            etag = etag_func(request, *args, **kwargs)
+            if etag is None or not precompressible(request):
+                return etag
+            return encoded_etag(request, etag)
+
+        response_etag = variant_etag if precompress and etag_func else etag_func
+
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            conditional_view = condition(etag_func=response_etag, last_modified_func=last_modified_func)(
+                partial(build_view, self)
+            )
+            return finish(conditional_view(request, *args, **kwargs), request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _hash(*parts):
+    return hashlib.md5(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _representation(request):
+    # Parametry zapytania i wynegocjowany format (JSON / kolumnowy / MessagePack)
+    # - różne reprezentacje muszą mieć różne ETagi.
+    return f"{request.GET.urlencode()}|{getattr(request, 'accepted_media_type', '')}"
+
+
+# --- Lista bieżącej pogody ---
+
+def _latest_list_version(request):
+    # Wynik zapamiętujemy na obiekcie zapytania - ETag i Last-Modified
+    # korzystają z tego samego agregatu.
+    if not hasattr(request, "_latest_list_version"):
+        request._latest_list_version = City.objects.aggregate(
+            version=Sum("data_version"),
+            cities=Count("pk"),
+            updated_at=Max("data_updated_at"),
+        )
+    return request._latest_list_version
+
+
+def latest_list_etag(request, *args, **kwargs):
+    version = _latest_list_version(request)
+    return _hash("latest", version["version"], version["cities"], _representation(request))
+
+
+def latest_list_last_modified(request, *args, **kwargs):
+    return _latest_list_version(request)["updated_at"]
+
+
+# --- Historia miasta ---
+
+def _city_version(request, city_name):
+    if not hasattr(request, "_city_version"):
+        request._city_version = City.objects.filter(name__iexact=city_name).values(
+            "name", "data_version", "data_updated_at"
+        ).first()
+    return request._city_version
+
+
+def city_history_etag(request, city_name):
+    version = _city_version(request, city_name)
+    if version is None:
+        return None
+    return _hash("history", version["name"], version["data_version"], _representation(request))
+
+
+def city_history_last_modified(request, city_name):
+    version = _city_version(request, city_name)
+    return version["data_updated_at"] if version else None
+
+
+# --- Statystyki miasta ---
+
+def city_window_validators(resolve_window):
+    """
+    ETag i Last-Modified dla danych miasta z okna czasowego (statystyki).
+    Jak dla historii, ale z granicami okna z `resolve_window(request)`: domyślne
+    `to` przesuwa się z czasem, więc to samo zapytanie opisuje z czasem inne
+    przedziały. Przy niepoprawnych parametrach (ValueError) walidatorów nie ma -
+    widok zwraca wtedy 400.
+    """
+    def window(request):
+        try:
+            return resolve_window(request)
+        except ValueError:
+            return None
+
+    def etag(request, city_name):
+        version = _city_version(request, city_name)
+        bounds = window(request)
+        if version is None or bounds is None:
+            return None
+        return _hash("window", version["name"], version["data_version"], *bounds, _representation(request))
+
+    def last_modified(request, city_name):
+        version = _city_version(request, city_name)
+        bounds = window(request)
+        if version is None or bounds is None or version["data_updated_at"] is None:
+            return None
+        # Okno kończące się w przeszłości zmienia się tylko z danymi; bieżące - także z czasem.
+        return max(version["data_updated_at"], min(bounds[-1], timezone.now()))
+
+    return etag, last_modified
+
+
+# --- Prognoza godzinowa ---
+
+def _forecast_hour():
+    return datetime.now(pytz.timezone("Europe/Warsaw")).replace(minute=0, second=0, microsecond=0)
+
+
+def forecast_etag(request, city_name):
+    # Prognoza jest cache'owana per (miasto, pełna godzina, liczba godzin).
+    return _hash("forecast", city_name.lower(), _forecast_hour().isoformat(), _representation(request))
+
+
+def forecast_last_modified(request, city_name):
+    return _forecast_hour()
+
+
+def seconds_to_next_hour(request, *args, **kwargs):
+    next_hour = _forecast_hour() + timedelta(hours=1)
+    return (next_hour - datetime.now(pytz.timezone("Europe/Warsaw"))).total_seconds()
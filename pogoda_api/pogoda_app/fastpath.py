@@ -0,0 +1,175 @@
+# pogoda_app/fastpath.py
+"""
+Szybka ścieżka serializacji dla "gorących" endpointów list (bieżąca pogoda,
+historia miasta). Zamiast ModelSerializera DRF (obiekt modelu + pole po polu)
+odpowiedź budowana jest z krotek `.values_list()` według prekompilowanego
+mapowania pól, a renderowana przez orjson.
+
+Wynik jest bajt w bajt taki sam jak ze standardowej ścieżki DRF (sprawdza to
+komenda `benchmark_serialization`). Ścieżkę włącza ustawienie
+POGODA_FAST_SERIALIZATION = True.
+"""
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson jest opcjonalny - bez niego zostaje json z biblioteki standardowej
+    orjson = None
+
+# orjson.Fragment (orjson >= 3.9) pozwala wstawić gotowy tekst JSON - potrzebny
+# dla liczb, które orjson zapisuje inaczej niż moduł json (np. 1e-05 vs 0.00001).
+USE_ORJSON = orjson is not None and hasattr(orjson, "Fragment")
+
+
+def fast_path_enabled():
+    return getattr(settings, "POGODA_FAST_SERIALIZATION", False)
+
+
+# Znacznik konwersji daty z godziną - właściwa funkcja (z aktualną strefą
+# czasową) tworzona jest raz na serializację, a nie dla każdego wiersza.
+DATETIME = object()
+
+
+def datetime_converter(tz):
+    """To samo co DateTimeField.to_representation z DRF (ISO 8601, 'Z' dla UTC) w strefie `tz`."""
+    def to_representation(value):
+        value = value.astimezone(tz).isoformat()
+        if value.endswith("+00:00"):
+            value = value[:-6] + "Z"
+        return value
+    return to_representation
+
+
+def json_float(value):
+    """
+    float() jak w FloatField DRF. Liczby, które orjson zapisałby inaczej niż
+    moduł json (notacja wykładnicza, NaN, nieskończoność), zostają przekazane
+    jako gotowy fragment JSON, więc wynik jest identyczny z JSONRenderer.
+    """
+    value = float(value)
+    if value == 0.0 or 1e-4 <= abs(value) < 1e16:
+        return value
+    return orjson.Fragment(json.dumps(value))
+
+
+class ValuesSerializer:
+    """
+    Serializator oparty o krotki z `.values_list()`.
+
+    `fields` to sekwencja (klucz w odpowiedzi, lookup ORM, konwersja) - tak jak
+    `source` i `to_representation` pól DRF; konwersja DATETIME odpowiada
+    DateTimeField. None nie jest konwertowane.
+    """
+
+    def __init__(self, fields):
+        self.keys = tuple(key for key, _, _ in fields)
+        self.lookups = tuple(lookup for _, lookup, _ in fields)
+        self.converters = tuple(convert for _, _, convert in fields)
+
+    def serialize_rows(self, rows):
+        """Zamienia krotki na słowniki. Nadmiarowe kolumny na końcu krotek są pomijane."""
+        keys = self.keys
+        to_datetime = datetime_converter(timezone.get_current_timezone())
+        converters = tuple(to_datetime if convert is DATETIME else convert for convert in self.converters)
+        return [
+            {
+                key: None if value is None else convert(value)
+                for key, convert, value in zip(keys, converters, row)
+            }
+            for row in rows
+        ]
+
+    def serialize_columns(self, rows):
+        """
+        Jak serialize_rows, ale w układzie kolumnowym: {klucz: lista wartości}.
+        Liczby są zwykłymi floatami (bez fragmentów orjson) - ten format nie
+        musi być identyczny z JSONRenderer, a trafia też do MessagePack.
+        """
+        to_datetime = datetime_converter(timezone.get_current_timezone())
+        columns = list(zip(*rows)) or [()] * len(self.keys)
+        result = {}
+        for key, convert, column in zip(self.keys, self.converters, columns):
+            if convert is DATETIME:
+                convert = to_datetime
+            elif convert is json_float:
+                convert = float
+            result[key] = [None if value is None else convert(value) for value in column]
+        return result
+
+    def serialize(self, queryset):
+        return self.serialize_rows(queryset.values_list(*self.lookups))
+
+    async def aserialize(self, queryset):
+        """Jak serialize, ale z asynchronicznym odczytem z bazy (async ORM)."""
+        return self.serialize_rows([row async for row in queryset.values_list(*self.lookups)])
+
+
+# Konwersja liczb: z orjson - json_float, bez niego zwykły float.
+to_float = json_float if USE_ORJSON else float
+
+# Odpowiednik CurrentWeatherSerializer (queryset z get_latest_weather_queryset).
+CURRENT_WEATHER_VALUES = ValuesSerializer((
+    ("city_name", "city__name", str),
+    ("latitude", "city__latitude", to_float),
+    ("longitude", "city__longitude", to_float),
+    ("temperature", "temperature", to_float),
+    ("perceived_temperature", "annotated_perceived_temperature", to_float),
+    ("last_updated", "timestamp", DATETIME),
+    ("precipitation", "precipitation", to_float),
+    ("wind_speed", "wind_speed", to_float),
+    ("relative_humidity", "relative_humidity", to_float),
+))
+
+# Odpowiednik WeatherDetailSerializer (historia z adnotacją perceived_temperature).
+WEATHER_DETAIL_VALUES = ValuesSerializer((
+    ("temperature", "temperature", to_float),
+    ("perceived_temperature", "perceived_temperature", to_float),
+    ("timestamp", "timestamp", DATETIME),
+    ("precipitation", "precipitation", to_float),
+    ("wind_speed", "wind_speed", to_float),
+    ("relative_humidity", "relative_humidity", to_float),
+))
+
+
+class OrjsonRenderer(JSONRenderer):
+    """
+    JSONRenderer renderujący przez orjson, gdy jest zainstalowany. Gdy
+    zażądano wcięć (np. BrowsableAPIRenderer), wcięcia dodaje JSONRenderer.
+
+    Dane z ValuesSerializer dają wynik identyczny z JSONRenderer (patrz json_float).
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if not USE_ORJSON:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.encoder_class().default)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            # Moduł json nie zna orjson.Fragment - wcięcia dodajemy do już
+            # wyrenderowanego JSON-a (json.loads odtwarza liczby z fragmentów).
+            return super().render(json.loads(ret), accepted_media_type, renderer_context)
+
+        # Jak JSONRenderer: \u2028 i \u2029 zawsze escapowane.
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
+
+
+class FastPathMixin:
+    """Podmienia JSONRenderer na OrjsonRenderer, gdy szybka ścieżka jest włączona."""
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if not fast_path_enabled():
+            return renderers
+        return [
+            OrjsonRenderer() if type(renderer) is JSONRenderer else renderer
+            for renderer in renderers
+        ]
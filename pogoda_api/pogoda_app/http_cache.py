@@ -0,0 +1,360 @@
+# pogoda_app/http_cache.py
+"""
+Cache odpowiedzi Open-Meteo na poziomie HTTP (warstwa pod sesją z clients.py).
+
+- Backend wybierany ustawieniem POGODA_UPSTREAM_CACHE: "memory" (w procesie),
+  "filesystem" (katalog, zapis atomowy - bezpieczny dla wielu procesów),
+  "sqlite" (plik SQLite w trybie WAL - czytelnicy nie blokują zapisujących)
+  albo None (bez cache).
+- Klucz wpisu liczony jest ze współrzędnych zaokrąglonych do siatki modelu
+  danego endpointu, więc pobliskie punkty z tej samej komórki siatki
+  współdzielą wpis. Do Open-Meteo trafiają współrzędne oryginalne - API samo
+  wybiera komórkę siatki i poprawkę na wysokość punktu.
+- Czas życia wpisu zależy od endpointu (bieżąca pogoda, prognoza, archiwum).
+- Liczniki trafień i chybień per endpoint: `upstream_cache.stats()`.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import niquests
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.structures import CaseInsensitiveDict
+
+from .cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Reguła cache dla endpointu: nazwa (do statystyk), host i ścieżka, parametr,
+# który musi wystąpić w zapytaniu (lub None), czas życia w sekundach i krok
+# siatki modelu w stopniach. Pierwsza pasująca reguła wygrywa.
+CachePolicy = namedtuple("CachePolicy", ["name", "host", "path", "param", "ttl", "grid"])
+
+UPSTREAM_CACHE_POLICIES = (
+    # Bieżąca pogoda - krócej niż WEATHER_FRESHNESS_SECONDS, żeby odświeżanie
+    # nie dostawało danych z poprzedniego cyklu.
+    CachePolicy("current", "api.open-meteo.com", "/v1/forecast", "current", 60, 0.02),
+    # Prognoza godzinowa - modele Open-Meteo liczone są co godzinę, a klucz
+    # zawiera start_hour, więc wpis i tak dotyczy jednej godziny. Pełna godzina
+    # życia pozwala rozgrzać cache raz na godzinę (prewarm_forecasts).
+    CachePolicy("forecast", "api.open-meteo.com", "/v1/forecast", "hourly", 3600, 0.02),
+    # Reanaliza ERA5 (siatka 0.25°) - ostatnie dni bywają uzupełniane.
+    CachePolicy("archive", "archive-api.open-meteo.com", "/v1/era5", None, 6 * 3600, 0.25),
+)
+
+UPSTREAM_CACHE_MEMORY_SIZE = 1024
+
+# Co ile zapisów backendy trwałe usuwają wygasłe wpisy.
+UPSTREAM_CACHE_PURGE_EVERY = 500
+
+COORDINATE_PARAMS = ("latitude", "longitude")
+
+
+def snap_to_grid(value, grid):
+    """Zaokrągla współrzędną do najbliższego węzła siatki o kroku `grid` stopni."""
+    return round(round(float(value) / grid) * grid, 4)
+
+
+def normalize_params(params, grid):
+    """
+    Kopia parametrów ze współrzędnymi zaokrąglonymi do siatki. Obsługuje listy
+    współrzędnych rozdzielone przecinkami (zapytania wielolokalizacyjne).
+    """
+    normalized = dict(params or {})
+    for name in COORDINATE_PARAMS:
+        if name in normalized:
+            normalized[name] = ",".join(
+                str(snap_to_grid(value, grid)) for value in str(normalized[name]).split(",")
+            )
+    return normalized
+
+
+def cache_key(url, params):
+    query = "&".join(f"{name}={params[name]}" for name in sorted(params))
+    return hashlib.sha256(f"GET {url}?{query}".encode()).hexdigest()
+
+
+def _encode_entry(response):
+    header = json.dumps({"status": response.status_code, "content_type": response.headers.get("Content-Type")})
+    return header.encode() + b"\n" + response.content
+
+
+def _decode_entry(data, url, response_class=requests.Response):
+    header, _, content = data.partition(b"\n")
+    header = json.loads(header)
+
+    response = response_class()
+    response.status_code = header["status"]
+    response.reason = "OK"
+    response.url = url
+    response.headers = CaseInsensitiveDict({"Content-Type": header["content_type"] or ""})
+    response._content = content
+    response.from_cache = True
+    return response
+
+
+# --- Backendy: get(klucz) -> bajty lub None, set(klucz, bajty, ttl) ---
+
+class MemoryBackend:
+    """Cache w pamięci procesu (LRU); każdy wpis ma własny czas wygaśnięcia."""
+
+    shared = False  # inne procesy nie widzą wpisów
+
+    def __init__(self, maxsize=UPSTREAM_CACHE_MEMORY_SIZE):
+        max_ttl = max(policy.ttl for policy in UPSTREAM_CACHE_POLICIES)
+        self._cache = TTLCache(maxsize=maxsize, ttl=max_ttl)
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def set(self, key, data, ttl):
+        self._cache.set(key, (time.time() + ttl, data))
+
+
+class FileSystemBackend:
+    """
+    Jeden plik na wpis (czas wygaśnięcia w pierwszej linii). Zapis przez plik
+    tymczasowy i os.replace, więc równoległe procesy nie widzą połówek plików.
+    """
+
+    shared = True
+
+    def __init__(self, location):
+        self.location = location
+        self._writes = 0
+        os.makedirs(location, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.location, key[:2], key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                expires_at = float(f.readline())
+                if expires_at <= time.time():
+                    return None
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, data, ttl):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(f"{time.time() + ttl}\n".encode())
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._writes += 1
+        if self._writes % UPSTREAM_CACHE_PURGE_EVERY == 0:
+            self.purge()
+
+    def purge(self):
+        now = time.time()
+        for root, _, files in os.walk(self.location):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    with open(path, "rb") as f:
+                        expired = float(f.readline()) <= now
+                    if expired:
+                        os.remove(path)
+                except (OSError, ValueError):
+                    continue
+
+
+class SQLiteBackend:
+    """
+    Plik SQLite w trybie WAL: odczyty nie czekają na zapis, a równoległe zapisy
+    z kilku procesów czekają (busy_timeout) zamiast zwracać "database is locked".
+    Każdy wątek ma własne połączenie.
+    """
+
+    shared = True
+
+    def __init__(self, location):
+        self.location = location
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS upstream_cache ("
+            "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value BLOB NOT NULL)"
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.location, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM upstream_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, data, ttl):
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO upstream_cache (key, expires_at, value) VALUES (?, ?, ?)",
+            (key, time.time() + ttl, data),
+        )
+        self._writes += 1
+        if self._writes % UPSTREAM_CACHE_PURGE_EVERY == 0:
+            connection.execute("DELETE FROM upstream_cache WHERE expires_at <= ?", (time.time(),))
+
+
+BACKENDS = {
+    "memory": lambda location: MemoryBackend(),
+    "filesystem": FileSystemBackend,
+    "sqlite": SQLiteBackend,
+}
+
+
+class UpstreamCache:
+    """Reguły endpointów, backend i liczniki trafień / chybień."""
+
+    def __init__(self, backend, policies=UPSTREAM_CACHE_POLICIES):
+        self.backend = backend
+        self.policies = policies
+        self._lock = threading.Lock()
+        self._counters = {policy.name: {"hits": 0, "misses": 0} for policy in policies}
+
+    def policy_for(self, url, params):
+        parts = urlsplit(url)
+        for policy in self.policies:
+            if parts.hostname == policy.host and parts.path == policy.path \
+                    and (policy.param is None or policy.param in (params or {})):
+                return policy
+        return None
+
+    def _count(self, policy, counter):
+        with self._lock:
+            self._counters[policy.name][counter] += 1
+
+    def prepare(self, method, url, params):
+        """
+        Reguła i klucz (ze współrzędnych na siatce) dla zapytania - albo
+        (None, None), gdy zapytanie nie jest cache'owane. Parametry wysyłane
+        do API pozostają bez zmian.
+        """
+        policy = self.policy_for(url, params) if method.upper() == "GET" else None
+        if policy is None:
+            return None, None
+        return policy, cache_key(url, normalize_params(params, policy.grid))
+
+    def get(self, policy, key, url, response_class=requests.Response):
+        try:
+            data = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"⚠️ Błąd odczytu cache Open-Meteo ({policy.name}): {e}")
+            data = None
+
+        self._count(policy, "misses" if data is None else "hits")
+        return None if data is None else _decode_entry(data, url, response_class)
+
+    def set(self, policy, key, response):
+        try:
+            self.backend.set(key, _encode_entry(response), policy.ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ Błąd zapisu cache Open-Meteo ({policy.name}): {e}")
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._counters.items()}
+
+
+def create_upstream_cache():
+    """Tworzy cache według ustawienia POGODA_UPSTREAM_CACHE (None, gdy wyłączony)."""
+    config = getattr(settings, "POGODA_UPSTREAM_CACHE", None) or {}
+    backend_name = config.get("BACKEND")
+    if not backend_name:
+        return None
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Nieznany backend cache Open-Meteo: {backend_name}. Dozwolone: {', '.join(BACKENDS)}.")
+    return UpstreamCache(BACKENDS[backend_name](config.get("LOCATION")))
+
+
+class CachingSession(requests.Session):
+    """
+    Sesja `requests`, która zapytania GET do endpointów z UPSTREAM_CACHE_POLICIES
+    obsługuje z cache (klucz ze współrzędnych zaokrąglonych do siatki).
+    Zapisywane są tylko odpowiedzi 200.
+    """
+
+    def __init__(self, upstream_cache=None):
+        super().__init__()
+        self.upstream_cache = upstream_cache
+
+    def request(self, method, url, params=None, **kwargs):
+        if self.upstream_cache is None:
+            return super().request(method, url, params=params, **kwargs)
+
+        policy, key = self.upstream_cache.prepare(method, url, params)
+        if policy is None:
+            return super().request(method, url, params=params, **kwargs)
+
+        response = self.upstream_cache.get(policy, key, url)
+        if response is not None:
+            return response
+
+        response = super().request(method, url, params=params, **kwargs)
+        if response.status_code == 200:
+            self.upstream_cache.set(policy, key, response)
+        return response
+
+
+class AsyncCachingSession(niquests.AsyncSession):
+    """
+    Asynchroniczny odpowiednik CachingSession (niquests) - dla widoków ASGI.
+    Backendy są synchroniczne (plik i SQLite blokują na I/O dysku oraz na
+    blokadach bazy), więc odczyt / zapis wpisu wykonywany jest w puli wątków
+    przez sync_to_async(thread_sensitive=False), żeby nie wstrzymywać pętli.
+    """
+
+    def __init__(self, upstream_cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self.upstream_cache = upstream_cache
+
+    async def request(self, method, url, params=None, **kwargs):
+        if self.upstream_cache is None:
+            return await super().request(method, url, params=params, **kwargs)
+
+        policy, key = self.upstream_cache.prepare(method, url, params)
+        if policy is None:
+            return await super().request(method, url, params=params, **kwargs)
+
+        response = await sync_to_async(self.upstream_cache.get, thread_sensitive=False)(
+            policy, key, url, niquests.Response
+        )
+        if response is not None:
+            return response
+
+        response = await super().request(method, url, params=params, **kwargs)
+        if response.status_code == 200:
+            await sync_to_async(self.upstream_cache.set, thread_sensitive=False)(policy, key, response)
+        return response
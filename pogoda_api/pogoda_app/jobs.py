@@ -0,0 +1,263 @@
+# pogoda_app/jobs.py
+"""
+Kolejka zleceń pobierania historii (30 dni) dla wszystkich miast, oparta o bazę.
+
+enqueue_history_fetch() tworzy HistoryFetchJob i po jednym HistoryFetchTask
+na miasto - albo zwraca zlecenie, które już trwa. Zadania wykonuje
+process_history_tasks(): w procesie serwera zaraz po zleceniu (wątek w tle)
+oraz cyklicznie w run_scheduler, który podejmuje zadania porzucone przez
+proces, który padł.
+
+Zadanie przejmowane jest warunkowym UPDATE z dzierżawą (jak LeaseLock), więc
+nad jednym zleceniem może pracować kilka procesów. Dzierżawy pobieranych
+zadań odnawiane są co HISTORY_TASK_RENEW_SECONDS - wolne archiwum nie oddaje
+zadania innemu procesowi w trakcie pobierania. Jak w
+fetch_history_for_all_cities: zapytania do archiwum idą równolegle z puli
+wątków, a zapisy do bazy robi jeden wątek.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .clients import openmeteo_clients
+from .models import City, HistoryFetchJob, HistoryFetchTask
+from .utils import HISTORY_FETCH_CONCURRENCY, fetch_history_ranges, last_30_days_range, \
+    missing_history_ranges, save_history_rows
+
+logger = logging.getLogger(__name__)
+
+# Dzierżawa zadania - po tym czasie zadanie procesu, który padł, wraca do kolejki.
+HISTORY_TASK_LEASE_SECONDS = 300
+
+# Co ile sekund worker odnawia dzierżawy zadań, które właśnie pobiera.
+HISTORY_TASK_RENEW_SECONDS = HISTORY_TASK_LEASE_SECONDS / 3
+
+# Zadanie porzucone tyle razy (proces padał w trakcie) oznaczamy jako błąd.
+HISTORY_TASK_MAX_ATTEMPTS = 3
+
+Job = HistoryFetchJob.Status
+Task = HistoryFetchTask.Status
+
+# Pilnuje, żeby w jednym procesie działała najwyżej jedna pula w tle.
+_background_lock = threading.Lock()
+
+
+def enqueue_history_fetch():
+    """
+    Zleca pobranie historii dla wszystkich miast. Zwraca (zlecenie, czy_nowe) -
+    jeśli inne zlecenie jeszcze trwa, zwracane jest ono zamiast nowego.
+    """
+    with transaction.atomic():
+        active = HistoryFetchJob.objects.filter(status__in=[Job.QUEUED, Job.RUNNING]).order_by('created_at').first()
+        if active is not None:
+            return active, False
+
+        cities = list(City.objects.values_list('pk', flat=True))
+        job = HistoryFetchJob.objects.create(total=len(cities))
+        HistoryFetchTask.objects.bulk_create([HistoryFetchTask(job=job, city_id=city) for city in cities])
+
+    if not cities:
+        _finish_job_if_complete(job.pk)
+    logger.info(f"📋 Zlecono pobranie historii dla {len(cities)} miast (zlecenie {job.pk})")
+    return job, True
+
+
+def _claimable(now):
+    # Oczekujące albo przejęte przez proces, którego dzierżawa wygasła.
+    return Q(status=Task.PENDING) | Q(
+        status=Task.RUNNING, lease_expires_at__lte=now, attempts__lt=HISTORY_TASK_MAX_ATTEMPTS
+    )
+
+
+def _fail_abandoned_tasks():
+    """Oznacza jako błąd zadania porzucone HISTORY_TASK_MAX_ATTEMPTS razy."""
+    now = timezone.now()
+    abandoned = HistoryFetchTask.objects.filter(
+        status=Task.RUNNING, lease_expires_at__lte=now, attempts__gte=HISTORY_TASK_MAX_ATTEMPTS
+    )
+    job_ids = set(abandoned.values_list('job_id', flat=True))
+    abandoned.update(
+        status=Task.FAILED, message="Przekroczono limit prób", finished_at=now, lease_expires_at=None
+    )
+    for job_id in job_ids:
+        _finish_job_if_complete(job_id)
+
+
+def _claim_task(worker_id):
+    """Przejmuje najstarsze dostępne zadanie. Zwraca je (z miastem) lub None."""
+    now = timezone.now()
+    candidates = HistoryFetchTask.objects.filter(_claimable(now)).order_by('job__created_at', 'pk')
+    for task_id, job_id in candidates.values_list('pk', 'job_id')[:HISTORY_FETCH_CONCURRENCY]:
+        claimed = HistoryFetchTask.objects.filter(_claimable(now), pk=task_id).update(
+            status=Task.RUNNING,
+            worker=worker_id,
+            lease_expires_at=now + timedelta(seconds=HISTORY_TASK_LEASE_SECONDS),
+            attempts=F('attempts') + 1,
+            started_at=now,
+        )
+        if claimed:
+            HistoryFetchJob.objects.filter(pk=job_id, status=Job.QUEUED).update(status=Job.RUNNING, started_at=now)
+            return HistoryFetchTask.objects.select_related('city').get(pk=task_id)
+    return None
+
+
+def _renew_task_leases(worker_id, task_ids):
+    """
+    Przedłuża dzierżawy zadań `task_ids`, które nadal należą do `worker_id`.
+    Zwraca zbiór zadań, które w międzyczasie przejął inny worker.
+    """
+    held = HistoryFetchTask.objects.filter(pk__in=task_ids, worker=worker_id, status=Task.RUNNING)
+    held.update(lease_expires_at=timezone.now() + timedelta(seconds=HISTORY_TASK_LEASE_SECONDS))
+    return set(task_ids) - set(held.values_list('pk', flat=True))
+
+
+def _finish_task(task, worker_id, status, message, result=None):
+    HistoryFetchTask.objects.filter(pk=task.pk, worker=worker_id, status=Task.RUNNING).update(
+        status=status,
+        message=message[:500],
+        inserted=result.inserted if result else 0,
+        updated=result.updated if result else 0,
+        finished_at=timezone.now(),
+        lease_expires_at=None,
+    )
+    _finish_job_if_complete(task.job_id)
+
+
+def _finish_job_if_complete(job_id):
+    if not HistoryFetchTask.objects.filter(job_id=job_id, status__in=[Task.PENDING, Task.RUNNING]).exists():
+        finished = HistoryFetchJob.objects.filter(pk=job_id).exclude(status=Job.DONE).update(
+            status=Job.DONE, finished_at=timezone.now()
+        )
+        if finished:
+            logger.info(f"🏁 Zakończono zlecenie pobierania historii {job_id}")
+
+
+def process_history_tasks(concurrency=HISTORY_FETCH_CONCURRENCY):
+    """
+    Wykonuje zadania z kolejki, aż będzie pusta: najwyżej `concurrency`
+    miast pobieranych naraz. Zwraca liczbę wykonanych zadań.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    session = None
+    start_date, end_date = last_30_days_range()
+    processed = 0
+
+    _fail_abandoned_tasks()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+        lost = set()  # zadania, których dzierżawy nie udało się odnowić
+        renewed_at = time.monotonic()
+        while True:
+            while len(in_flight) < concurrency:
+                task = _claim_task(worker_id)
+                if task is None:
+                    break
+                ranges = missing_history_ranges([task.city], start_date, end_date)[task.city.pk]
+                if not ranges:
+                    _finish_task(task, worker_id, Task.DONE, "OK (historia kompletna)")
+                    processed += 1
+                    continue
+                session = session or openmeteo_clients.session()
+                in_flight[executor.submit(fetch_history_ranges, session, task.city, ranges)] = task
+
+            if not in_flight:
+                break
+
+            completed, _ = wait(in_flight, timeout=HISTORY_TASK_RENEW_SECONDS, return_when=FIRST_COMPLETED)
+            if time.monotonic() - renewed_at >= HISTORY_TASK_RENEW_SECONDS:
+                running = [task.pk for future, task in in_flight.items() if future not in completed]
+                lost.update(_renew_task_leases(worker_id, running))
+                renewed_at = time.monotonic()
+
+            for future in completed:
+                task = in_flight.pop(future)
+                processed += 1
+                if task.pk in lost:
+                    logger.warning(f"⚠️ Zadanie historii {task.city.name} przejął inny worker - pomijam zapis.")
+                    continue
+                try:
+                    rows = future.result()
+                    if not rows:
+                        logger.warning(f"Brak danych historycznych dla {task.city.name}")
+                        _finish_task(task, worker_id, Task.DONE, "Brak danych")
+                        continue
+                    result = save_history_rows(task.city, rows)
+                    _finish_task(
+                        task, worker_id, Task.DONE,
+                        f"OK (nowe: {result.inserted}, zaktualizowane: {result.updated})", result,
+                    )
+                except Exception as e:
+                    logger.error(f"❌ Błąd pobierania historii 30 dni dla {task.city.name}: {e}")
+                    _finish_task(task, worker_id, Task.FAILED, str(e))
+
+    if processed:
+        openmeteo_clients.log_stats()
+    return processed
+
+
+def _run_in_background():
+    try:
+        process_history_tasks()
+    except Exception as e:
+        logger.error("Błąd przetwarzania zleceń pobierania historii: %s", e)
+    finally:
+        connection.close()
+        _background_lock.release()
+
+
+def process_history_tasks_in_background():
+    """
+    Uruchamia process_history_tasks w osobnym wątku, o ile w tym procesie
+    nie działa już inna pula. Zwraca True, jeśli wystartowano nowy wątek.
+    """
+    if not _background_lock.acquire(blocking=False):
+        return False
+
+    try:
+        threading.Thread(target=_run_in_background, daemon=True).start()
+    except Exception:
+        _background_lock.release()
+        raise
+    return True
+
+
+def history_job_progress(job):
+    """
+    Postęp zlecenia: liczba zadań w każdym stanie, ułamek ukończonych
+    i szacowany czas do końca (tempo dotychczas ukończonych miast).
+    """
+    counts = dict.fromkeys(Task.values, 0)
+    counts.update(job.tasks.order_by().values_list('status').annotate(count=Count('pk')))
+    finished = counts[Task.DONE] + counts[Task.FAILED]
+
+    now = timezone.now()
+    elapsed = ((job.finished_at or now) - job.started_at).total_seconds() if job.started_at else None
+    if job.status == Job.DONE:
+        eta = 0
+    elif elapsed is not None and finished:
+        eta = round(elapsed / finished * (job.total - finished))
+    else:
+        eta = None
+
+    return {
+        "job_id": str(job.pk),
+        "status": job.status,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "total": job.total,
+        "counts": counts,
+        "progress": round(finished / job.total, 3) if job.total else 1.0,
+        "elapsed_seconds": round(elapsed) if elapsed is not None else None,
+        "eta_seconds": eta,
+    }
@@ -0,0 +1,73 @@
+# pogoda_app/locks.py
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IngestLock
+
+
+class LeaseLock:
+    """
+    Blokada międzyprocesowa oparta o tabelę IngestLock.
+
+    Przejęcie blokady to pojedynczy INSERT albo warunkowy UPDATE wygasłego
+    wiersza, więc tylko jeden proces może ją zdobyć. Blokada wygasa po `ttl`
+    sekundach, dzięki czemu proces, który padł, nie blokuje innych na zawsze.
+    """
+
+    def __init__(self, name, ttl=120):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self):
+        """Próbuje przejąć blokadę bez czekania. Zwraca True, jeśli się udało."""
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=self.ttl)
+
+        taken = IngestLock.objects.filter(name=self.name, expires_at__lte=now).update(
+            owner=self.owner,
+            expires_at=expires_at,
+        )
+        if taken:
+            return True
+
+        try:
+            with transaction.atomic():
+                IngestLock.objects.create(name=self.name, owner=self.owner, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        return True
+
+    def renew(self):
+        """
+        Przedłuża dzierżawę o kolejne `ttl` sekund, o ile blokada nadal należy
+        do tego właściciela. Zwraca False, gdy przejął ją już inny proces -
+        wtedy nie wolno zapisywać wyników, bo ten proces robi to samo.
+        """
+        return bool(IngestLock.objects.filter(name=self.name, owner=self.owner).update(
+            expires_at=timezone.now() + timedelta(seconds=self.ttl),
+        ))
+
+    def release(self):
+        """Zwalnia blokadę, o ile nadal należy do tego właściciela."""
+        IngestLock.objects.filter(name=self.name, owner=self.owner).delete()
+
+    def wait_released(self, timeout, poll_interval=0.5):
+        """
+        Czeka, aż blokada zostanie zwolniona lub wygaśnie (najwyżej `timeout`
+        sekund). Zwraca True, jeśli blokada jest już wolna.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if not IngestLock.objects.filter(name=self.name, expires_at__gt=timezone.now()).exists():
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
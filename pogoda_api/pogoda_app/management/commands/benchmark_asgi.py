@@ -0,0 +1,186 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import flatbuffers
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import path
+
+from pogoda_app import compression, utils
+from pogoda_app.async_views import AsyncHourlyForecastAPI
+from pogoda_app.cache import TTLCache
+from pogoda_app.models import City
+from pogoda_app.views import HourlyForecastAPI
+
+# Komenda podmienia ROOT_URLCONF na ten moduł: ten sam endpoint prognozy
+# w wersji synchronicznej (DRF) i asynchronicznej.
+urlpatterns = [
+    path("sync/forecast/<str:city_name>/", HourlyForecastAPI.as_view()),
+    path("async/forecast/<str:city_name>/", AsyncHourlyForecastAPI.as_view()),
+]
+
+
+def forecast_message(hours):
+    """Odpowiedź prognozy w formacie Open-Meteo (FlatBuffers z prefiksem długości) od bieżącej godziny."""
+    start = int(time.time()) // 3600 * 3600
+    builder = flatbuffers.Builder(1024)
+
+    variables = []
+    for base in (5.0, 0.0, 3.0, 70.0):  # temperatura, opady, wiatr, wilgotność
+        values = builder.CreateNumpyVector((base + np.arange(hours) % 6).astype(np.float32))
+        builder.StartObject(13)  # VariableWithValues
+        builder.PrependUOffsetTRelativeSlot(3, values, 0)
+        variables.append(builder.EndObject())
+
+    builder.StartVector(4, len(variables), 4)
+    for variable in reversed(variables):
+        builder.PrependUOffsetTRelative(variable)
+    variables_vector = builder.EndVector()
+
+    builder.StartObject(4)  # VariablesWithTime
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, start + hours * 3600, 0)
+    builder.PrependInt32Slot(2, 3600, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_vector, 0)
+    hourly = builder.EndObject()
+
+    builder.StartObject(15)  # WeatherApiResponse
+    builder.PrependInt32Slot(6, 3600, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly, 0)
+    builder.Finish(builder.EndObject())
+
+    body = bytes(builder.Output())
+    return len(body).to_bytes(4, "little") + body
+
+
+def start_stub_upstream(latency, hours):
+    """Serwer HTTP udający Open-Meteo: każda odpowiedź po `latency` sekundach."""
+    body = forecast_message(hours)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = (
+        "Porównuje przepustowość endpointu prognozy: synchroniczny widok DRF obsługiwany "
+        "przez pulę wątków (jak serwer WSGI) kontra widok asynchroniczny w jednej pętli "
+        "zdarzeń (ASGI). Open-Meteo zastępuje lokalny serwer z opóźnieniem --latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=400, help="Liczba zapytań w każdym wariancie.")
+        parser.add_argument("--threads", type=int, default=8, help="Liczba wątków serwera WSGI.")
+        parser.add_argument("--concurrency", type=int, default=100, help="Liczba równoczesnych zapytań (ASGI).")
+        parser.add_argument("--latency", type=float, default=200, help="Opóźnienie odpowiedzi Open-Meteo (ms).")
+        parser.add_argument("--hours", type=int, default=48, help="Liczba godzin prognozy.")
+
+    def handle(self, *args, **options):
+        # AsyncClient dekoduje ścieżkę jako latin-1 (jak WSGI), więc nazwa miasta
+        # z polskimi znakami nie trafiłaby do widoku asynchronicznego.
+        city = next((city for city in City.objects.order_by("name") if city.name.isascii()), None)
+        if city is None:
+            raise CommandError("Brak w bazie miasta o nazwie bez polskich znaków.")
+
+        server = start_stub_upstream(options["latency"] / 1000, options["hours"])
+        pool_size = max(options["threads"], options["concurrency"])
+
+        # Bez cache (prognozy, HTTP, gotowych odpowiedzi) - każde zapytanie idzie do "API".
+        with override_settings(
+            ROOT_URLCONF=__name__,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            POGODA_UPSTREAM_CACHE=None,
+            POGODA_OPENMETEO_POOL_MAXSIZE=pool_size,
+        ), mock.patch.object(utils, "FORECAST_URL", f"http://127.0.0.1:{server.server_port}/v1/forecast"), \
+                mock.patch.object(utils, "_forecast_cache", TTLCache(maxsize=0)), \
+                mock.patch.object(utils, "openmeteo_clients", utils.openmeteo_clients.__class__()), \
+                mock.patch.object(compression, "_compress", lambda content: {"identity": content}):
+            try:
+                sync_result = self._run_sync(city, options)
+                async_result = self._run_async(city, options)
+            finally:
+                server.shutdown()
+
+        self.stdout.write(
+            f"Open-Meteo: opóźnienie {options['latency']:.0f} ms, {options['requests']} zapytań o prognozę"
+        )
+        for name, (elapsed, latencies, errors) in (
+            (f"WSGI (synchroniczny, {options['threads']} wątków)", sync_result),
+            (f"ASGI (asynchroniczny, {options['concurrency']} równocześnie)", async_result),
+        ):
+            self.stdout.write(
+                f"{name}: {len(latencies) / elapsed:.1f} zapytań/s, "
+                f"p50 {statistics.median(latencies) * 1000:.0f} ms, "
+                f"p95 {self._percentile(latencies, 95) * 1000:.0f} ms, błędy: {errors}"
+            )
+
+    def _url(self, variant, city, index, options):
+        # Unikalny parametr - ETag (i cache gotowych odpowiedzi) różny dla każdego zapytania.
+        return f"/{variant}/forecast/{city.name}/?hours={options['hours']}&n={index}"
+
+    def _run_sync(self, city, options):
+        local = threading.local()
+
+        def call(index):
+            client = getattr(local, "client", None) or Client()
+            local.client = client
+            start = time.perf_counter()
+            response = client.get(self._url("sync", city, index, options))
+            return time.perf_counter() - start, response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+            results = list(executor.map(call, range(options["requests"])))
+        return self._summary(time.perf_counter() - start, results)
+
+    def _run_async(self, city, options):
+        async def run():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(options["concurrency"])
+
+            async def call(index):
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.get(self._url("async", city, index, options))
+                    return time.perf_counter() - start, response.status_code
+
+            return await asyncio.gather(*(call(index) for index in range(options["requests"])))
+
+        start = time.perf_counter()
+        results = asyncio.run(run())
+        return self._summary(time.perf_counter() - start, results)
+
+    @staticmethod
+    def _summary(elapsed, results):
+        latencies = [latency for latency, _ in results]
+        errors = sum(1 for _, status_code in results if status_code != 200)
+        return elapsed, latencies, errors
+
+    @staticmethod
+    def _percentile(values, percent):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
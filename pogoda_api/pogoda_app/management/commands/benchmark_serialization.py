@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from pogoda_app.fastpath import (
+    CURRENT_WEATHER_VALUES,
+    USE_ORJSON,
+    WEATHER_DETAIL_VALUES,
+    OrjsonRenderer,
+)
+from pogoda_app.models import WeatherData
+from pogoda_app.serializers import CurrentWeatherSerializer, WeatherDetailSerializer
+from pogoda_app.utils import perceived_temperature_expression
+from pogoda_app.views import get_latest_weather_queryset
+
+
+class Command(BaseCommand):
+    help = (
+        "Porównuje czas serializacji i renderowania list pogody: ModelSerializer DRF "
+        "+ JSONRenderer kontra szybka ścieżka (.values() + orjson). Sprawdza, czy "
+        "wynik jest identyczny bajt w bajt."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000, help="Liczba odczytów historii.")
+        parser.add_argument("--repeat", type=int, default=20, help="Liczba powtórzeń każdego wariantu.")
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        history = WeatherData.objects.annotate(
+            perceived_temperature=perceived_temperature_expression()
+        ).order_by("-timestamp", "-pk")[:options["rows"]]
+
+        scenarios = [
+            (
+                "lista bieżącej pogody",
+                lambda: JSONRenderer().render(CurrentWeatherSerializer(get_latest_weather_queryset(), many=True).data),
+                lambda: OrjsonRenderer().render(CURRENT_WEATHER_VALUES.serialize(get_latest_weather_queryset())),
+            ),
+            (
+                f"historia ({options['rows']} odczytów)",
+                lambda: JSONRenderer().render(WeatherDetailSerializer(history, many=True).data),
+                lambda: OrjsonRenderer().render(WEATHER_DETAIL_VALUES.serialize(history)),
+            ),
+        ]
+
+        if not USE_ORJSON:
+            self.stdout.write(self.style.WARNING("orjson (>= 3.9) nie jest zainstalowany - renderowanie przez json."))
+
+        for name, drf_path, fast_path in scenarios:
+            drf_body = drf_path()
+            fast_body = fast_path()
+            if drf_body != fast_body:
+                raise CommandError(f"{name}: szybka ścieżka zwraca inny wynik niż DRF!")
+
+            drf_time = self._measure(drf_path, repeat)
+            fast_time = self._measure(fast_path, repeat)
+            self.stdout.write(
+                f"{name}: DRF {drf_time * 1000:.2f} ms, szybka ścieżka {fast_time * 1000:.2f} ms "
+                f"(x{drf_time / fast_time:.1f}), {len(drf_body)} B, wynik identyczny"
+            )
+
+    @staticmethod
+    def _measure(func, repeat):
+        """Najlepszy czas z `repeat` wywołań (w sekundach)."""
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pogoda_app.utils import (
+    HOURLY_ROLLUP_RETENTION_DAYS,
+    RAW_RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+    compact_old_readings,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Usuwa stare surowe odczyty pogody (zostają po nich agregaty godzinowe "
+        "i dzienne) oraz stare agregaty godzinowe, paczkami."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=RAW_RETENTION_DAYS,
+            help="Wiek (w dniach), po którym usuwane są surowe odczyty.",
+        )
+        parser.add_argument(
+            "--hourly-days", type=int, default=HOURLY_ROLLUP_RETENTION_DAYS,
+            help="Wiek (w dniach), po którym usuwane są agregaty godzinowe.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=RETENTION_BATCH_SIZE,
+            help="Liczba wierszy usuwanych w jednej transakcji.",
+        )
+        parser.add_argument(
+            "--pause", type=float, default=0.0,
+            help="Przerwa (w sekundach) między paczkami.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            report = compact_old_readings(
+                days=options["days"],
+                hourly_days=options["hourly_days"],
+                batch_size=options["batch_size"],
+                pause=options["pause"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Usunięto {report['readings']} odczytów i {report['hourly_rollups']} agregatów godzinowych."
+        ))
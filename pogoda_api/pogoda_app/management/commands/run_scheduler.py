@@ -1,36 +1,209 @@
 import logging
+import time
+from datetime import datetime, timedelta
 
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
 
-from pogoda_app.utils import fetch_and_save_weather_data
+from pogoda_app.jobs import process_history_tasks
+from pogoda_app.sharding import SHARD_HEARTBEAT_SECONDS, ShardLeases
+from pogoda_app.utils import compact_old_readings, fetch_and_save_weather_data, fetch_history_for_all_cities, \
+    prewarm_forecasts
 
 
 logger = logging.getLogger(__name__)
 
+# Bieżąca pogoda: miasta podzielone na WEATHER_BATCHES stałych paczek, każda
+# pobierana co WEATHER_INTERVAL_MINUTES - kolejne paczki przesunięte o równą
+# część interwału, więc zapytania do Open-Meteo rozkładają się w czasie.
+WEATHER_INTERVAL_MINUTES = 30
+WEATHER_BATCHES = 6
+WEATHER_JITTER_SECONDS = 30
+
+# Prognozy: Open-Meteo przelicza modele co godzinę - wspólny cache Open-Meteo
+# (wpis prognozy żyje godzinę) rozgrzewamy chwilę po pełnej godzinie, zanim
+# użytkownicy zapytają o nowe okno prognozy.
+FORECAST_PREWARM_MINUTE = 2
+FORECAST_PREWARM_JITTER_SECONDS = 60
+
+# Nocne uzupełnianie historii (30 dni) i retencja - poza godzinami ruchu.
+HISTORY_BACKFILL_TIME = (2, 30)
+HISTORY_BACKFILL_JITTER_SECONDS = 600
+RETENTION_TIME = (3, 15)
+RETENTION_JITTER_SECONDS = 300
+# Przerwa między paczkami usuwanych wierszy - retencja nie blokuje zapisów.
+RETENTION_PAUSE_SECONDS = 0.05
+
+# Zlecenia pobierania historii z API wykonuje proces serwera; scheduler co
+# chwilę dokańcza zadania, których nikt nie wykonuje (np. serwer zrestartowano).
+HISTORY_JOBS_INTERVAL_SECONDS = 60
+
+# Wątki per rodzaj zadania - długie zadanie nocne nie zabiera wątków pobieraniu,
+# a heartbeat shardów ma własny wątek i nie czeka na żadne zadanie.
+EXECUTOR_WORKERS = {
+    "ingest": 2,
+    "forecast": 1,
+    "maintenance": 1,
+    "coordination": 1,
+    "history": 1,
+}
+
+
+def timed_job(name, func, *args, **kwargs):
+    """Uruchamia zadanie z logowaniem czasu trwania i świeżym połączeniem z bazą."""
+    close_old_connections()
+    started = time.monotonic()
+    logger.info(f"▶️ {name}: start")
+    try:
+        return func(*args, **kwargs)
+    finally:
+        logger.info(f"⏱️ {name}: koniec po {time.monotonic() - started:.1f} s")
+        close_old_connections()
+
+
+def fetch_owned_shards(leases, **kwargs):
+    """Bieżąca pogoda dla miast z shardów dzierżawionych w chwili uruchomienia."""
+    return fetch_and_save_weather_data(shards=leases.owned(), **kwargs)
+
+
+def prewarm_owned_shards(leases):
+    return prewarm_forecasts(shards=leases.owned())
+
+
+def run_if_leader(leases, func, *args, **kwargs):
+    """Zadania dla całej bazy uruchamia tylko jeden worker - właściciel shardu 0."""
+    if not leases.is_leader():
+        logger.info(f"⏭️ {func.__name__}: pomijam - zadanie uruchamia worker-lider.")
+        return None
+    return func(*args, **kwargs)
+
+
+def drain_history_jobs():
+    """Zaległe zadania zleceń historii - bez logowania startu co minutę, gdy kolejka jest pusta."""
+    close_old_connections()
+    try:
+        processed = process_history_tasks()
+        if processed:
+            logger.info(f"📚 Zlecenia historii: wykonano {processed} zaległych zadań")
+    finally:
+        close_old_connections()
+
+
+def log_job_event(event):
+    if event.code == EVENT_JOB_ERROR:
+        logger.error(f"❌ Zadanie {event.job_id} zakończone błędem: {event.exception}")
+    elif event.code == EVENT_JOB_MAX_INSTANCES:
+        logger.warning(f"⏭️ Zadanie {event.job_id} pominięte - poprzednie uruchomienie jeszcze trwa.")
+    elif event.code == EVENT_JOB_MISSED:
+        logger.warning(f"⌛ Zadanie {event.job_id} pominięte - spóźnienie ponad limit ({event.scheduled_run_time}).")
+
 
 class Command(BaseCommand):
-    help = "Uruchamia scheduler, który cyklicznie pobiera dane pogodowe."
+    help = (
+        "Uruchamia scheduler: bieżąca pogoda paczkami miast, rozgrzewanie cache "
+        "prognoz, nocne uzupełnianie historii i retencja odczytów. Można uruchomić "
+        "kilka schedulerów (także na różnych serwerach) - miasta dzielą między "
+        "siebie przez dzierżawy shardów (pogoda_app/sharding.py)."
+    )
 
     def handle(self, *args, **options):
 
-        scheduler = BlockingScheduler(timezone=settings.TIME_ZONE)
+        scheduler = BlockingScheduler(
+            timezone=settings.TIME_ZONE,
+            executors={name: ThreadPoolExecutor(workers) for name, workers in EXECUTOR_WORKERS.items()},
+            # Zaległe uruchomienia (np. po uśpieniu procesu) sklejamy w jedno
+            # i nigdy nie uruchamiamy zadania, gdy poprzednie jeszcze trwa.
+            job_defaults={"coalesce": True, "max_instances": 1},
+        )
+        scheduler.add_listener(log_job_event, EVENT_JOB_ERROR | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+
+        leases = ShardLeases()
+        leases.heartbeat()
+        scheduler.add_job(
+            leases.heartbeat,
+            trigger=IntervalTrigger(seconds=SHARD_HEARTBEAT_SECONDS),
+            executor="coordination",
+            misfire_grace_time=SHARD_HEARTBEAT_SECONDS,
+            id="shard_heartbeat_job",
+            name=f"Heartbeat i dzierżawy shardów (co {SHARD_HEARTBEAT_SECONDS} s)",
+            replace_existing=True,
+        )
+
+        now = datetime.now(scheduler.timezone)
+        batch_offset = WEATHER_INTERVAL_MINUTES * 60 / WEATHER_BATCHES
+        for batch in range(WEATHER_BATCHES):
+            scheduler.add_job(
+                timed_job,
+                args=(f"Pogoda, paczka {batch + 1}/{WEATHER_BATCHES}", fetch_owned_shards, leases),
+                kwargs={"batch": batch, "batches": WEATHER_BATCHES},
+                trigger=IntervalTrigger(
+                    minutes=WEATHER_INTERVAL_MINUTES,
+                    start_date=now + timedelta(seconds=batch_offset * (batch + 1)),
+                    jitter=WEATHER_JITTER_SECONDS,
+                ),
+                executor="ingest",
+                misfire_grace_time=int(batch_offset),
+                id=f"fetch_weather_batch_{batch}",
+                name=f"Pobieranie pogody - paczka {batch + 1}/{WEATHER_BATCHES} (co {WEATHER_INTERVAL_MINUTES} min)",
+                replace_existing=True,
+            )
 
+        scheduler.add_job(
+            timed_job,
+            args=("Rozgrzewanie cache prognoz", prewarm_owned_shards, leases),
+            trigger=CronTrigger(minute=FORECAST_PREWARM_MINUTE, jitter=FORECAST_PREWARM_JITTER_SECONDS),
+            executor="forecast",
+            misfire_grace_time=15 * 60,
+            id="prewarm_forecasts_job",
+            name=f"Rozgrzewanie cache prognoz (co godzinę, :{FORECAST_PREWARM_MINUTE:02d})",
+            replace_existing=True,
+        )
 
         scheduler.add_job(
-            fetch_and_save_weather_data,
-            trigger=IntervalTrigger(minutes=30),
-            id="fetch_weather_job",
-            name="Pobieranie pogody co 30 minut",
+            timed_job,
+            args=("Uzupełnianie historii", run_if_leader, leases, fetch_history_for_all_cities),
+            trigger=CronTrigger(
+                hour=HISTORY_BACKFILL_TIME[0], minute=HISTORY_BACKFILL_TIME[1], jitter=HISTORY_BACKFILL_JITTER_SECONDS
+            ),
+            executor="maintenance",
+            misfire_grace_time=2 * 3600,
+            id="history_backfill_job",
+            name=f"Uzupełnianie historii 30 dni (codziennie {HISTORY_BACKFILL_TIME[0]:02d}:{HISTORY_BACKFILL_TIME[1]:02d})",
             replace_existing=True,
         )
 
+        scheduler.add_job(
+            drain_history_jobs,
+            trigger=IntervalTrigger(seconds=HISTORY_JOBS_INTERVAL_SECONDS),
+            executor="history",
+            misfire_grace_time=HISTORY_JOBS_INTERVAL_SECONDS,
+            id="history_jobs_job",
+            name=f"Zlecenia pobierania historii - zaległe zadania (co {HISTORY_JOBS_INTERVAL_SECONDS} s)",
+            replace_existing=True,
+        )
 
+        scheduler.add_job(
+            timed_job,
+            args=("Kompaktowanie starych odczytów", run_if_leader, leases, compact_old_readings),
+            kwargs={"pause": RETENTION_PAUSE_SECONDS},
+            trigger=CronTrigger(hour=RETENTION_TIME[0], minute=RETENTION_TIME[1], jitter=RETENTION_JITTER_SECONDS),
+            executor="maintenance",
+            misfire_grace_time=2 * 3600,
+            id="compact_readings_job",
+            name=f"Kompaktowanie starych odczytów (codziennie {RETENTION_TIME[0]:02d}:{RETENTION_TIME[1]:02d})",
+            replace_existing=True,
+        )
 
         try:
-            fetch_and_save_weather_data()
+            timed_job("Pogoda, wszystkie shardy workera", fetch_owned_shards, leases)
             scheduler.start()
         except KeyboardInterrupt:
-            scheduler.shutdown()
\ No newline at end of file
+            scheduler.shutdown()
+        finally:
+            leases.release()
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:35
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_readings(apps, schema_editor):
+    """Zostawia najnowszy wiersz dla każdej pary (miasto, timestamp)."""
+    WeatherData = apps.get_model('pogoda_app', 'WeatherData')
+    duplicates = (
+        WeatherData.objects.values('city', 'timestamp')
+        .annotate(count=Count('id'), keep_id=Max('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        WeatherData.objects.filter(
+            city=duplicate['city'],
+            timestamp=duplicate['timestamp'],
+        ).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pogoda_app', '0007_delete_historicalweatherdata'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_readings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='weatherdata',
+            constraint=models.UniqueConstraint(fields=('city', 'timestamp'), name='unique_city_timestamp'),
+        ),
+    ]
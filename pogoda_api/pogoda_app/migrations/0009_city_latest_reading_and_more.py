@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_latest_readings(apps, schema_editor):
+    """Ustawia wskaźnik na najnowszy odczyt dla istniejących miast."""
+    City = apps.get_model('pogoda_app', 'City')
+    WeatherData = apps.get_model('pogoda_app', 'WeatherData')
+    for city in City.objects.all():
+        city.latest_reading = (
+            WeatherData.objects.filter(city=city).order_by('-timestamp').first()
+        )
+        city.save(update_fields=['latest_reading'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pogoda_app', '0008_weatherdata_unique_city_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='latest_reading',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='pogoda_app.weatherdata'),
+        ),
+        migrations.AddIndex(
+            model_name='weatherdata',
+            index=models.Index(fields=['city', '-timestamp'], name='pogoda_data_city_ts_desc'),
+        ),
+        migrations.RunPython(fill_latest_readings, migrations.RunPython.noop),
+    ]
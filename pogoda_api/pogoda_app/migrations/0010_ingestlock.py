@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pogoda_app', '0009_city_latest_reading_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestLock',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('owner', models.CharField(max_length=200)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+    ]
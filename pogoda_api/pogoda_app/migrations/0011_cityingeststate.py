@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pogoda_app', '0010_ingestlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityIngestState',
+            fields=[
+                ('city', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ingest_state', serialize=False, to='pogoda_app.city')),
+                ('last_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('last_success_at', models.DateTimeField(blank=True, null=True)),
+                ('error_count', models.PositiveIntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, default='', max_length=500)),
+                ('retry_after', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pogoda_app', '0011_cityingeststate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='data_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='data_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
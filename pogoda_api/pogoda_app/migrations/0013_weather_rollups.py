@@ -0,0 +1,90 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:41
+
+import django.db.models.deletion
+from zoneinfo import ZoneInfo
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Max, Min, Sum
+from django.db.models.functions import Trunc
+
+
+def build_rollups(apps, schema_editor):
+    """Liczy agregaty godzinowe i dzienne dla odczytów zapisanych przed migracją."""
+    WeatherData = apps.get_model('pogoda_app', 'WeatherData')
+    for model_name, kind in (('HourlyWeatherRollup', 'hour'), ('DailyWeatherRollup', 'day')):
+        Rollup = apps.get_model('pogoda_app', model_name)
+        aggregates = (
+            WeatherData.objects
+            .annotate(bucket=Trunc('timestamp', kind, tzinfo=ZoneInfo('Europe/Warsaw')))
+            .order_by()
+            .values('city_id', 'bucket')
+            .annotate(
+                readings_count=Count('id'),
+                temperature_min=Min('temperature'),
+                temperature_mean=Avg('temperature'),
+                temperature_max=Max('temperature'),
+                precipitation_sum=Sum('precipitation'),
+                wind_speed_mean=Avg('wind_speed'),
+                wind_speed_max=Max('wind_speed'),
+                relative_humidity_mean=Avg('relative_humidity'),
+            )
+        )
+        Rollup.objects.bulk_create(
+            [Rollup(bucket_start=row.pop('bucket'), **row) for row in aggregates],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pogoda_app', '0012_city_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyWeatherRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('readings_count', models.PositiveIntegerField()),
+                ('temperature_min', models.FloatField()),
+                ('temperature_mean', models.FloatField()),
+                ('temperature_max', models.FloatField()),
+                ('precipitation_sum', models.FloatField(blank=True, null=True)),
+                ('wind_speed_mean', models.FloatField(blank=True, null=True)),
+                ('wind_speed_max', models.FloatField(blank=True, null=True)),
+                ('relative_humidity_mean', models.FloatField(blank=True, null=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pogoda_app.city')),
+            ],
+            options={
+                'db_table': 'pogoda_rollup_daily',
+                'ordering': ['bucket_start'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('city', 'bucket_start'), name='unique_daily_rollup')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyWeatherRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('readings_count', models.PositiveIntegerField()),
+                ('temperature_min', models.FloatField()),
+                ('temperature_mean', models.FloatField()),
+                ('temperature_max', models.FloatField()),
+                ('precipitation_sum', models.FloatField(blank=True, null=True)),
+                ('wind_speed_mean', models.FloatField(blank=True, null=True)),
+                ('wind_speed_max', models.FloatField(blank=True, null=True)),
+                ('relative_humidity_mean', models.FloatField(blank=True, null=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pogoda_app.city')),
+            ],
+            options={
+                'db_table': 'pogoda_rollup_hourly',
+                'ordering': ['bucket_start'],
+                'abstract': False,
+                'constraints': [models.UniqueConstraint(fields=('city', 'bucket_start'), name='unique_hourly_rollup')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pogoda_app', '0013_weather_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestShard',
+            fields=[
+                ('number', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('owner', models.CharField(blank=True, default='', max_length=200)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IngestWorker',
+            fields=[
+                ('worker_id', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('started_at', models.DateTimeField()),
+                ('heartbeat_at', models.DateTimeField()),
+            ],
+        ),
+    ]
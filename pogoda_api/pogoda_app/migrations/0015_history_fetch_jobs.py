@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:12
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pogoda_app', '0014_ingest_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryFetchJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'W kolejce'), ('running', 'W trakcie'), ('done', 'Zakończone')], default='queued', max_length=10)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HistoryFetchTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Oczekuje'), ('running', 'W trakcie'), ('done', 'Gotowe'), ('failed', 'Błąd')], default='pending', max_length=10)),
+                ('worker', models.CharField(blank=True, default='', max_length=200)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('inserted', models.PositiveIntegerField(default=0)),
+                ('updated', models.PositiveIntegerField(default=0)),
+                ('message', models.CharField(blank=True, default='', max_length=500)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pogoda_app.city')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='pogoda_app.historyfetchjob')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'lease_expires_at'], name='history_task_status_lease')],
+                'constraints': [models.UniqueConstraint(fields=('job', 'city'), name='unique_history_task_job_city')],
+            },
+        ),
+    ]
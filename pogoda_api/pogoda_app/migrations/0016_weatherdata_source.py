@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:25
+
+from datetime import time
+from zoneinfo import ZoneInfo
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Max, Min, Sum
+from django.db.models.functions import Trunc
+
+WARSAW = ZoneInfo('Europe/Warsaw')
+
+
+def mark_history_rows(apps, schema_editor):
+    """
+    Dzienne podsumowania z archiwum zapisywane są dokładnie o północy czasu
+    polskiego (utils._history_timestamp) - odczyty bieżące mają sekundy
+    i mikrosekundy chwili pobrania.
+    """
+    WeatherData = apps.get_model('pogoda_app', 'WeatherData')
+    history = [
+        pk
+        for pk, timestamp in WeatherData.objects.values_list('pk', 'timestamp').iterator()
+        if timestamp.astimezone(WARSAW).time() == time(0)
+    ]
+    for start in range(0, len(history), 500):
+        WeatherData.objects.filter(pk__in=history[start:start + 500]).update(source='history')
+
+
+def rebuild_rollups(apps, schema_editor):
+    """Agregaty liczone od nowa - tylko z odczytów bieżących."""
+    WeatherData = apps.get_model('pogoda_app', 'WeatherData')
+    for model_name, kind in (('HourlyWeatherRollup', 'hour'), ('DailyWeatherRollup', 'day')):
+        Rollup = apps.get_model('pogoda_app', model_name)
+        Rollup.objects.all().delete()
+        aggregates = (
+            WeatherData.objects
+            .filter(source='current')
+            .annotate(bucket=Trunc('timestamp', kind, tzinfo=WARSAW))
+            .order_by()
+            .values('city_id', 'bucket')
+            .annotate(
+                readings_count=Count('id'),
+                temperature_min=Min('temperature'),
+                temperature_mean=Avg('temperature'),
+                temperature_max=Max('temperature'),
+                precipitation_sum=Sum('precipitation'),
+                wind_speed_mean=Avg('wind_speed'),
+                wind_speed_max=Max('wind_speed'),
+                relative_humidity_mean=Avg('relative_humidity'),
+            )
+        )
+        Rollup.objects.bulk_create(
+            [Rollup(bucket_start=row.pop('bucket'), **row) for row in aggregates],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pogoda_app', '0015_history_fetch_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatherdata',
+            name='source',
+            field=models.CharField(choices=[('current', 'Bieżący'), ('history', 'Historia dzienna')], default='current', max_length=10),
+        ),
+        migrations.RunPython(mark_history_rows, migrations.RunPython.noop),
+        migrations.RunPython(rebuild_rollups, migrations.RunPython.noop),
+    ]
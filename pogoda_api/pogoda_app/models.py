@@ -1,5 +1,21 @@
 # pogoda/models.py
-from django.db import models
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+from django.db import models, transaction
+from django.db.models import Avg, Count, F, Max, Min, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .signals import weather_data_saved
+
+
+UpsertResult = namedtuple('UpsertResult', ['inserted', 'updated'])
+
+# Granice godzin i dni dla agregatów liczymy w czasie polskim.
+ROLLUP_TZ = ZoneInfo("Europe/Warsaw")
 
 
 class City(models.Model):
@@ -8,6 +24,22 @@ class City(models.Model):
     latitude = models.FloatField()
     longitude = models.FloatField()
 
+    # Wskaźnik na najnowszy odczyt, aktualizowany przy każdym zapisie
+    # (WeatherData.objects.upsert) - lista bieżącej pogody czyta po jednym
+    # wierszu na miasto zamiast przeszukiwać całą historię.
+    latest_reading = models.ForeignKey(
+        'WeatherData',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+
+    # Wersja danych miasta - zwiększana przy każdym zapisie odczytów. Służy
+    # do tanich walidatorów ETag / Last-Modified bez czytania historii.
+    data_version = models.PositiveIntegerField(default=0)
+    data_updated_at = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
         return self.name
 
@@ -15,12 +47,98 @@ class City(models.Model):
         verbose_name_plural = "Cities"
 
 
+class WeatherDataQuerySet(models.QuerySet):
+
+    UPSERT_FIELDS = ('temperature', 'precipitation', 'wind_speed', 'relative_humidity', 'source')
+
+    def upsert(self, readings, batch_size=500):
+        """
+        Zapisuje odczyty zbiorczo (INSERT ... ON CONFLICT DO UPDATE) po kluczu
+        (miasto, timestamp). Zwraca UpsertResult z liczbą nowych i nadpisanych wierszy.
+
+        Po zatwierdzeniu transakcji wysyła sygnał weather_data_saved.
+        """
+        # Ostatni odczyt dla danego klucza wygrywa - baza nie pozwala
+        # zaktualizować tego samego wiersza dwa razy w jednym zapytaniu.
+        unique_readings = list({(r.city_id, r.timestamp): r for r in readings}.values())
+        if not unique_readings:
+            return UpsertResult(0, 0)
+
+        with transaction.atomic(using=self.db):
+            updated = 0
+            for start in range(0, len(unique_readings), batch_size):
+                batch = unique_readings[start:start + batch_size]
+                keys = {(r.city_id, r.timestamp) for r in batch}
+                existing = self.filter(
+                    city_id__in={city_id for city_id, _ in keys},
+                    timestamp__in={timestamp for _, timestamp in keys},
+                ).values_list('city_id', 'timestamp')
+                updated += sum(1 for key in existing if key in keys)
+
+                self.bulk_create(
+                    batch,
+                    update_conflicts=True,
+                    unique_fields=['city', 'timestamp'],
+                    update_fields=self.UPSERT_FIELDS,
+                )
+
+            self._update_latest_readings(unique_readings)
+            HourlyWeatherRollup.objects.using(self.db).refresh_buckets(unique_readings)
+            DailyWeatherRollup.objects.using(self.db).refresh_buckets(unique_readings)
+            cities = {r.city_id for r in unique_readings}
+            City.objects.using(self.db).filter(
+                pk__in=cities
+            ).update(data_version=F('data_version') + 1, data_updated_at=timezone.now())
+
+            transaction.on_commit(
+                lambda: weather_data_saved.send_robust(sender=self.model, cities=cities),
+                using=self.db,
+            )
+
+        return UpsertResult(len(unique_readings) - updated, updated)
+
+    def _update_latest_readings(self, readings):
+        """Przestawia City.latest_reading, jeśli zapisano nowszy odczyt niż wskazywany."""
+        newest = {}
+        for r in readings:
+            if r.city_id not in newest or r.timestamp > newest[r.city_id]:
+                newest[r.city_id] = r.timestamp
+
+        cities = City.objects.using(self.db).filter(pk__in=newest).select_related('latest_reading')
+        stale = {
+            city.pk: newest[city.pk]
+            for city in cities
+            if city.latest_reading is None or city.latest_reading.timestamp <= newest[city.pk]
+        }
+        if not stale:
+            return
+
+        pointers = self.filter(
+            city_id__in=stale,
+            timestamp__in=set(stale.values()),
+        ).values_list('city_id', 'timestamp', 'id')
+
+        updated_cities = [
+            City(pk=city_id, latest_reading_id=reading_id)
+            for city_id, timestamp, reading_id in pointers
+            if stale[city_id] == timestamp
+        ]
+        City.objects.using(self.db).bulk_update(updated_cities, ['latest_reading'])
+
+
 class WeatherData(models.Model):
     """
     Przechowuje odczyty pogody:
     - Bieżące
     - Historyczne
     """
+
+    class Source(models.TextChoices):
+        # Chwilowy odczyt bieżącej pogody (co kilka-kilkadziesiąt minut).
+        CURRENT = 'current', 'Bieżący'
+        # Podsumowanie dnia z archiwum ERA5 (o północy; opady to suma dobowa).
+        HISTORY = 'history', 'Historia dzienna'
+
     city = models.ForeignKey(
         City,
         on_delete=models.CASCADE,
@@ -33,6 +151,9 @@ class WeatherData(models.Model):
     relative_humidity = models.FloatField(null=True, blank=True)
 
     timestamp = models.DateTimeField()
+    source = models.CharField(max_length=10, choices=Source.choices, default=Source.CURRENT)
+
+    objects = WeatherDataQuerySet.as_manager()
 
     def __str__(self):
         return (
@@ -42,4 +163,265 @@ class WeatherData(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
-        db_table = 'pogoda_data'
\ No newline at end of file
+        db_table = 'pogoda_data'
+        indexes = [
+            models.Index(fields=['city', '-timestamp'], name='pogoda_data_city_ts_desc'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['city', 'timestamp'],
+                name='unique_city_timestamp',
+            ),
+        ]
+
+
+class WeatherRollupQuerySet(models.QuerySet):
+
+    def refresh_buckets(self, readings):
+        """
+        Przelicza agregaty dla przedziałów czasu, do których trafiły `readings`
+        (tylko te przedziały - reszta tabeli zostaje bez zmian). Agregaty liczone
+        są od nowa z surowych odczytów, więc nadpisanie odczytu też jest uwzględnione.
+
+        Agregowane są tylko odczyty bieżące - dzienne podsumowania ERA5 mają
+        inną naturę (np. opady to suma dobowa, nie chwilowa wartość).
+        """
+        model = self.model
+        keys = {
+            (r.city_id, model.bucket_for(r.timestamp))
+            for r in readings
+            if r.source == WeatherData.Source.CURRENT
+        }
+        if not keys:
+            return
+
+        starts = [bucket_start for _, bucket_start in keys]
+        aggregates = (
+            WeatherData.objects.using(self.db)
+            .filter(
+                source=WeatherData.Source.CURRENT,
+                city_id__in={city_id for city_id, _ in keys},
+                timestamp__gte=min(starts),
+                timestamp__lt=max(starts) + model.BUCKET_SPAN,
+            )
+            .annotate(bucket=Trunc('timestamp', model.BUCKET, tzinfo=ROLLUP_TZ))
+            .order_by()
+            .values('city_id', 'bucket')
+            .annotate(
+                readings_count=Count('id'),
+                temperature_min=Min('temperature'),
+                temperature_mean=Avg('temperature'),
+                temperature_max=Max('temperature'),
+                precipitation_sum=Sum('precipitation'),
+                wind_speed_mean=Avg('wind_speed'),
+                wind_speed_max=Max('wind_speed'),
+                relative_humidity_mean=Avg('relative_humidity'),
+            )
+        )
+
+        rollups = [
+            model(bucket_start=row.pop('bucket'), **row)
+            for row in aggregates
+            if (row['city_id'], row['bucket']) in keys
+        ]
+        self.bulk_create(
+            rollups,
+            update_conflicts=True,
+            unique_fields=['city', 'bucket_start'],
+            update_fields=model.AGGREGATE_FIELDS,
+        )
+
+
+class WeatherRollup(models.Model):
+    """
+    Agregaty odczytów pogody w przedziałach czasu (min / średnia / max),
+    utrzymywane przy każdym zapisie WeatherData. Wykresy długich okresów
+    czytają kilkaset agregatów zamiast dziesiątek tysięcy surowych odczytów.
+    Liczone tylko z odczytów bieżących (WeatherData.Source.CURRENT).
+    """
+    AGGREGATE_FIELDS = (
+        'readings_count',
+        'temperature_min',
+        'temperature_mean',
+        'temperature_max',
+        'precipitation_sum',
+        'wind_speed_mean',
+        'wind_speed_max',
+        'relative_humidity_mean',
+    )
+
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='+')
+    bucket_start = models.DateTimeField()
+
+    readings_count = models.PositiveIntegerField()
+    temperature_min = models.FloatField()
+    temperature_mean = models.FloatField()
+    temperature_max = models.FloatField()
+    precipitation_sum = models.FloatField(null=True, blank=True)
+    wind_speed_mean = models.FloatField(null=True, blank=True)
+    wind_speed_max = models.FloatField(null=True, blank=True)
+    relative_humidity_mean = models.FloatField(null=True, blank=True)
+
+    objects = WeatherRollupQuerySet.as_manager()
+
+    @classmethod
+    def bucket_for(cls, timestamp):
+        """Początek przedziału (w czasie polskim), do którego należy `timestamp`."""
+        local = timestamp.astimezone(ROLLUP_TZ)
+        if cls.BUCKET == 'day':
+            return local.replace(hour=0, minute=0, second=0, microsecond=0)
+        return local.replace(minute=0, second=0, microsecond=0)
+
+    def __str__(self):
+        return f"{self.city_id} {self.bucket_start:%Y-%m-%d %H:%M}: {self.temperature_mean:.1f}°C"
+
+    class Meta:
+        abstract = True
+        ordering = ['bucket_start']
+
+
+class HourlyWeatherRollup(WeatherRollup):
+    BUCKET = 'hour'
+    BUCKET_SPAN = timedelta(hours=1)
+
+    class Meta(WeatherRollup.Meta):
+        db_table = 'pogoda_rollup_hourly'
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'bucket_start'], name='unique_hourly_rollup'),
+        ]
+
+
+class DailyWeatherRollup(WeatherRollup):
+    BUCKET = 'day'
+    BUCKET_SPAN = timedelta(days=1)
+
+    class Meta(WeatherRollup.Meta):
+        db_table = 'pogoda_rollup_daily'
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'bucket_start'], name='unique_daily_rollup'),
+        ]
+
+
+class CityIngestState(models.Model):
+    """
+    Rejestr pobierania bieżącej pogody dla pojedynczego miasta: kiedy ostatnio
+    próbowano, kiedy się udało i ile razy z rzędu był błąd. Na tej podstawie
+    pobierane są tylko miasta z nieaktualnymi danymi, a miasta z błędami
+    dostają rosnącą przerwę (`retry_after`).
+    """
+    city = models.OneToOneField(
+        City,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='ingest_state'
+    )
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    error_count = models.PositiveIntegerField(default=0)
+    last_error = models.CharField(max_length=500, blank=True, default='')
+    retry_after = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.city_id}: błędy {self.error_count}"
+
+
+class IngestLock(models.Model):
+    """
+    Blokada z dzierżawą (lease) współdzielona przez wszystkie procesy
+    (workery gunicorna, scheduler). Blokadę trzyma `owner` do `expires_at` -
+    po tym czasie może ją przejąć inny proces, nawet jeśli właściciel padł.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    owner = models.CharField(max_length=200)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} ({self.owner} do {self.expires_at.strftime('%H:%M:%S')})"
+
+
+class IngestWorker(models.Model):
+    """
+    Działający worker schedulera (run_scheduler). Wpis odświeżany jest przy
+    każdym heartbeacie - na podstawie żywych workerów shardy miast
+    (IngestShard) dzielone są między nich po równo.
+    """
+    worker_id = models.CharField(max_length=200, primary_key=True)
+    started_at = models.DateTimeField()
+    heartbeat_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.worker_id} (heartbeat {self.heartbeat_at.strftime('%H:%M:%S')})"
+
+
+class IngestShard(models.Model):
+    """
+    Shard miast (przydział miasta: sharding.city_shard) dzierżawiony przez
+    jednego workera do `expires_at`. Właściciel odnawia dzierżawę przy każdym
+    heartbeacie - shard workera, który padł, po wygaśnięciu przejmuje inny.
+    """
+    number = models.PositiveIntegerField(primary_key=True)
+    owner = models.CharField(max_length=200, blank=True, default='')
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Shard {self.number}: {self.owner or '-'}"
+
+
+class HistoryFetchJob(models.Model):
+    """
+    Zlecenie pobrania historii (30 dni) dla wszystkich miast
+    (/fetch-history-all/). Miasta przetwarzane są w tle (jobs.py) - stan
+    każdego z nich w HistoryFetchTask.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'W kolejce'
+        RUNNING = 'running', 'W trakcie'
+        DONE = 'done', 'Zakończone'
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    total = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.id} ({self.status}, miasta: {self.total})"
+
+
+class HistoryFetchTask(models.Model):
+    """
+    Pobranie historii jednego miasta w ramach zlecenia. Worker przejmuje
+    zadanie z dzierżawą (`worker`, `lease_expires_at`) - zadanie workera,
+    który padł, po wygaśnięciu dzierżawy może przejąć inny.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Oczekuje'
+        RUNNING = 'running', 'W trakcie'
+        DONE = 'done', 'Gotowe'
+        FAILED = 'failed', 'Błąd'
+
+    job = models.ForeignKey(HistoryFetchJob, on_delete=models.CASCADE, related_name='tasks')
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    worker = models.CharField(max_length=200, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    inserted = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    message = models.CharField(max_length=500, blank=True, default='')
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.job_id} / {self.city_id}: {self.status}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'city'], name='unique_history_task_job_city'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'lease_expires_at'], name='history_task_status_lease'),
+        ]
@@ -0,0 +1,115 @@
+# pogoda_app/pagination.py
+import base64
+from datetime import datetime
+
+import pytz
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+# Domyślna i maksymalna liczba odczytów na jedną stronę historii.
+HISTORY_DEFAULT_LIMIT = 1000
+HISTORY_MAX_LIMIT = 5000
+
+
+class InvalidHistoryParam(ValueError):
+    """Niepoprawny parametr stronicowania historii (from / to / limit / cursor)."""
+
+
+def encode_cursor(timestamp, pk):
+    """Koduje pozycję (timestamp, id) ostatniego odczytu strony do postaci tekstowej."""
+    raw = f"{timestamp.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Odkodowuje kursor do krotki (timestamp, id)."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp_str, pk_str = raw.rsplit("|", 1)
+        timestamp = datetime.fromisoformat(timestamp_str)
+        pk = int(pk_str)
+    except (ValueError, UnicodeError):
+        raise InvalidHistoryParam(f"Niepoprawny parametr 'cursor': {cursor}.")
+
+    if timezone.is_naive(timestamp):
+        raise InvalidHistoryParam(f"Niepoprawny parametr 'cursor': {cursor}.")
+    return timestamp, pk
+
+
+def parse_time_bound(name, value):
+    """
+    Parsuje granicę okna czasowego (data lub data z godziną).
+    Czas bez strefy traktujemy jako czas polski, tak jak zapisywane odczyty.
+    """
+    if value is None:
+        return None
+
+    # Poprawny format, ale nieistniejąca data / godzina (np. 2025-02-30,
+    # 25:00) to ValueError z parse_datetime / parse_date.
+    try:
+        parsed = parse_datetime(value)
+        parsed_date = parse_date(value) if parsed is None else None
+    except ValueError:
+        raise InvalidHistoryParam(f"Niepoprawny parametr '{name}': {value}.")
+
+    if parsed is None:
+        if parsed_date is None:
+            raise InvalidHistoryParam(f"Niepoprawny parametr '{name}': {value}.")
+        parsed = datetime.combine(parsed_date, datetime.min.time())
+
+    if timezone.is_naive(parsed):
+        parsed = pytz.timezone("Europe/Warsaw").localize(parsed)
+    return parsed
+
+
+def parse_limit(value):
+    """Parsuje parametr 'limit' (1..HISTORY_MAX_LIMIT)."""
+    if value is None:
+        return HISTORY_DEFAULT_LIMIT
+    try:
+        limit = int(value)
+        if limit <= 0:
+            raise ValueError
+    except ValueError:
+        raise InvalidHistoryParam(f"Niepoprawny parametr 'limit': {value}.")
+    return min(limit, HISTORY_MAX_LIMIT)
+
+
+def paginate_history(readings, query_params, values=None):
+    """
+    Stronicowanie kluczem (keyset) po (timestamp, id), od najnowszych.
+    Każda strona to jedno zapytanie z LIMIT korzystające z indeksu
+    (city, -timestamp), niezależnie od tego, jak długa jest historia.
+
+    Zwraca krotkę (lista odczytów, kursor następnej strony lub None).
+    Jeśli podano `values` (lookupy ORM), strona to krotki z `.values_list()`
+    z tymi polami (oraz timestamp i id na końcu) zamiast obiektów modelu.
+    """
+    time_from = parse_time_bound("from", query_params.get("from"))
+    time_to = parse_time_bound("to", query_params.get("to"))
+    limit = parse_limit(query_params.get("limit"))
+    cursor = query_params.get("cursor")
+
+    if time_from is not None:
+        readings = readings.filter(timestamp__gte=time_from)
+    if time_to is not None:
+        readings = readings.filter(timestamp__lte=time_to)
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        readings = readings.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk)
+        )
+
+    readings = readings.order_by("-timestamp", "-pk")
+    if values is not None:
+        readings = readings.values_list(*values, "timestamp", "pk")
+
+    page = list(readings[:limit + 1])
+    if len(page) <= limit:
+        return page, None
+
+    page = page[:limit]
+    if values is not None:
+        return page, encode_cursor(page[-1][-2], page[-1][-1])
+    return page, encode_cursor(page[-1].timestamp, page[-1].pk)
@@ -0,0 +1,68 @@
+# pogoda_app/renderers.py
+"""
+Kolumnowe formaty odpowiedzi dla prognozy i historii miasta.
+
+Zamiast listy słowników (każdy klucz powtórzony dla każdej godziny) seria
+danych jest zwracana jako jedna tablica na zmienną plus indeks czasu:
+
+    {"time": ["2025-01-01T12:00", ...], "temperature": [1.5, ...], ...}
+
+Format wybiera się parametrem `?format=columnar` (JSON) lub `?format=msgpack`
+(albo nagłówkiem Accept: application/msgpack). MessagePack wymaga pakietu
+msgpack - bez niego dostępny jest tylko wariant JSON.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+from rest_framework.renderers import BaseRenderer
+
+from .fastpath import OrjsonRenderer
+
+try:
+    import msgpack
+except ImportError:  # msgpack jest opcjonalny - bez niego zostaje ?format=columnar
+    msgpack = None
+
+
+def wants_columnar(request):
+    """Czy wynegocjowany renderer oczekuje danych kolumnowych."""
+    return getattr(getattr(request, "accepted_renderer", None), "columnar", False)
+
+
+class ColumnarJSONRenderer(OrjsonRenderer):
+    """JSON z danymi w układzie kolumnowym (`?format=columnar`)."""
+    format = "columnar"
+    columnar = True
+
+
+def _msgpack_default(value):
+    # To samo co JSONEncoder DRF dla typów, które mogą trafić do odpowiedzi.
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Nie można zapisać {type(value).__name__} w MessagePack")
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack z danymi w układzie kolumnowym (`?format=msgpack`)."""
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+    columnar = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_msgpack_default, use_bin_type=True)
+
+
+COLUMNAR_RENDERERS = (ColumnarJSONRenderer,) + ((MessagePackRenderer,) if msgpack is not None else ())
+
+
+class ColumnarFormatMixin:
+    """Dodaje kolumnowe renderery do domyślnych (JSON i przeglądarkowy DRF)."""
+
+    def get_renderers(self):
+        return super().get_renderers() + [renderer() for renderer in COLUMNAR_RENDERERS]
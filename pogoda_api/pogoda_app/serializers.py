@@ -1,14 +1,18 @@
 # pogoda_app/serializers.py
 from rest_framework import serializers
-from .models import WeatherData, City
+from .models import WeatherData, City, HourlyWeatherRollup, DailyWeatherRollup, HistoryFetchTask
 from .utils import calculate_perceived_temp
 
 
 class WeatherDetailSerializer(serializers.ModelSerializer):
+    # Liczona w bazie - patrz utils.perceived_temperature_expression.
+    perceived_temperature = serializers.FloatField(read_only=True)
+
     class Meta:
         model = WeatherData
         fields = (
             'temperature',
+            'perceived_temperature',
             'timestamp',
             'precipitation',
             'wind_speed',
@@ -28,6 +32,10 @@ class CurrentWeatherSerializer(serializers.ModelSerializer):
 
     def get_perceived_temperature(self, obj):
         """Kalkuluje odczuwalną temperaturę na podstawie pól modelu WeatherData."""
+        # Queryset z adnotacją (perceived_temperature_expression) - liczone w bazie.
+        if hasattr(obj, 'annotated_perceived_temperature'):
+            return obj.annotated_perceived_temperature
+
         temp = obj.temperature
         humidity = obj.relative_humidity
         wind = obj.wind_speed
@@ -59,10 +67,55 @@ class CurrentWeatherSerializer(serializers.ModelSerializer):
 class CityHistorySerializer(serializers.ModelSerializer):
     """
     Serializuje szczegóły miasta z historią pobraną z tabeli WeatherData.
+    Historia to jedna strona odczytów, ustawiona przez widok w `history_page`.
     """
-    history = WeatherDetailSerializer(many=True, read_only=True, source='weather_readings')
+    history = WeatherDetailSerializer(many=True, read_only=True, source='history_page')
     city_name = serializers.CharField(source='name')
 
     class Meta:
         model = City
-        fields = ('city_name', 'latitude', 'longitude', 'history')
\ No newline at end of file
+        fields = ('city_name', 'latitude', 'longitude', 'history')
+
+
+class HourlyRollupSerializer(serializers.ModelSerializer):
+    """
+    Serializuje agregaty odczytów z jednego przedziału czasu (godzina / dzień).
+    """
+    class Meta:
+        model = HourlyWeatherRollup
+        fields = (
+            'bucket_start',
+            'readings_count',
+            'temperature_min',
+            'temperature_mean',
+            'temperature_max',
+            'precipitation_sum',
+            'wind_speed_mean',
+            'wind_speed_max',
+            'relative_humidity_mean'
+        )
+
+
+class DailyRollupSerializer(HourlyRollupSerializer):
+    class Meta(HourlyRollupSerializer.Meta):
+        model = DailyWeatherRollup
+
+
+class HistoryFetchTaskSerializer(serializers.ModelSerializer):
+    """
+    Serializuje wynik pobierania historii dla jednego miasta w zleceniu.
+    """
+    city_name = serializers.CharField(source='city_id')
+
+    class Meta:
+        model = HistoryFetchTask
+        fields = (
+            'city_name',
+            'status',
+            'attempts',
+            'inserted',
+            'updated',
+            'message',
+            'started_at',
+            'finished_at',
+        )
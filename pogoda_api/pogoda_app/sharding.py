@@ -0,0 +1,135 @@
+# pogoda_app/sharding.py
+"""
+Podział pobierania bieżącej pogody między kilka workerów schedulera.
+
+Miasta przypisane są na stałe do POGODA_INGEST_SHARDS shardów (city_shard).
+Każdy worker (run_scheduler, na dowolnym serwerze) co SHARD_HEARTBEAT_SECONDS:
+- odświeża swój wpis IngestWorker i odnawia dzierżawy swoich shardów,
+- usuwa workery bez heartbeatu od WORKER_TIMEOUT_SECONDS,
+- wylicza równy udział shardów na żywego workera: nadmiarowe shardy zwalnia,
+  a brakujące przejmuje spośród wolnych lub wygasłych (warunkowy UPDATE,
+  jak LeaseLock - shard może przejąć tylko jeden worker).
+
+Nowy worker dostaje swój udział po dwóch heartbeatach, a shardy workera, który
+padł, przejmują pozostali po wygaśnięciu dzierżawy (SHARD_LEASE_SECONDS).
+Właściciel shardu 0 jest liderem - uruchamia zadania, które mają działać
+w jednym procesie (uzupełnianie historii, retencja).
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import IngestShard, IngestWorker
+
+logger = logging.getLogger(__name__)
+
+INGEST_SHARDS = 64
+
+# Heartbeat co SHARD_HEARTBEAT_SECONDS; dzierżawa shardu i wpis workera
+# wygasają po kilku pominiętych heartbeatach.
+SHARD_HEARTBEAT_SECONDS = 10
+SHARD_LEASE_SECONDS = 30
+WORKER_TIMEOUT_SECONDS = 30
+
+
+def shard_count():
+    return getattr(settings, "POGODA_INGEST_SHARDS", INGEST_SHARDS)
+
+
+def city_shard(city_name, shards=None):
+    """Numer shardu miasta - stały między procesami i serwerami (CRC32 nazwy)."""
+    return zlib.crc32(city_name.encode()) % (shards or shard_count())
+
+
+class ShardLeases:
+    """Dzierżawy shardów jednego workera schedulera."""
+
+    def __init__(self, shards=None, lease_seconds=SHARD_LEASE_SECONDS, worker_timeout=WORKER_TIMEOUT_SECONDS):
+        self.shards = shards or shard_count()
+        self.lease_seconds = lease_seconds
+        self.worker_timeout = worker_timeout
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._owned = frozenset()
+        self._valid_until = None
+
+    def owned(self):
+        """
+        Shardy tego workera. Pusty zbiór, jeśli dzierżawy mogły już wygasnąć
+        (np. heartbeat nie mógł połączyć się z bazą) - wtedy shardy mógł
+        przejąć inny worker.
+        """
+        with self._lock:
+            if self._valid_until is None or self._valid_until <= timezone.now():
+                return frozenset()
+            return self._owned
+
+    def is_leader(self):
+        return 0 in self.owned()
+
+    def _expired(self, now):
+        return Q(expires_at__isnull=True) | Q(expires_at__lte=now)
+
+    def heartbeat(self):
+        """Odnawia dzierżawy i wyrównuje liczbę shardów. Zwraca zbiór posiadanych shardów."""
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+
+        IngestWorker.objects.update_or_create(
+            worker_id=self.worker_id,
+            defaults={"heartbeat_at": now},
+            create_defaults={"started_at": now, "heartbeat_at": now},
+        )
+        IngestWorker.objects.filter(heartbeat_at__lt=now - timedelta(seconds=self.worker_timeout)).delete()
+        IngestShard.objects.bulk_create([IngestShard(number=n) for n in range(self.shards)], ignore_conflicts=True)
+
+        shards = IngestShard.objects.filter(number__lt=self.shards)
+        shards.filter(owner=self.worker_id).update(expires_at=expires_at)
+        owned = set(shards.filter(owner=self.worker_id).values_list("number", flat=True))
+
+        # Równy podział: pierwsze (shards % workery) workery według id dostają o jeden shard więcej.
+        workers = sorted(set(IngestWorker.objects.values_list("worker_id", flat=True)) | {self.worker_id})
+        position = workers.index(self.worker_id)
+        target = self.shards // len(workers) + (1 if position < self.shards % len(workers) else 0)
+
+        if len(owned) > target:
+            # Zostawiamy najniższe numery - lider (shard 0) nie zmienia się przy rebalansowaniu.
+            released = sorted(owned)[target:]
+            shards.filter(number__in=released, owner=self.worker_id).update(owner='', expires_at=None)
+            owned.difference_update(released)
+        elif len(owned) < target:
+            free = list(
+                shards.filter(self._expired(now)).order_by("number").values_list("number", flat=True)
+            )
+            for number in free:
+                if len(owned) >= target:
+                    break
+                if shards.filter(self._expired(now), number=number).update(owner=self.worker_id, expires_at=expires_at):
+                    owned.add(number)
+
+        with self._lock:
+            changed = owned != self._owned
+            self._owned = frozenset(owned)
+            self._valid_until = expires_at
+        if changed:
+            logger.info(
+                f"🧩 {self.worker_id}: shardy {len(owned)}/{self.shards} "
+                f"(workery: {len(workers)}{', lider' if 0 in owned else ''})"
+            )
+        return self._owned
+
+    def release(self):
+        """Zwalnia shardy i wyrejestrowuje workera (przy zamykaniu) - inni przejmą je od razu."""
+        IngestShard.objects.filter(owner=self.worker_id).update(owner='', expires_at=None)
+        IngestWorker.objects.filter(worker_id=self.worker_id).delete()
+        with self._lock:
+            self._owned = frozenset()
+            self._valid_until = None
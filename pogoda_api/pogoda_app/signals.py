@@ -0,0 +1,6 @@
+# pogoda_app/signals.py
+from django.dispatch import Signal
+
+# Wysyłany po zatwierdzeniu transakcji zapisu odczytów (WeatherData.objects.upsert).
+# Argument `cities`: zbiór nazw miast, których odczyty zapisano.
+weather_data_saved = Signal()
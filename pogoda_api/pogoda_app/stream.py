@@ -0,0 +1,221 @@
+# pogoda_app/stream.py
+"""
+Kanał Server-Sent Events z bieżącą pogodą (/api/pogoda/stream/).
+
+Zamiast odpytywania /api/pogoda/refresh/ przez każdą otwartą kartę klient
+trzyma jedno połączenie i dostaje zdarzenia:
+- `snapshot` - pełna lista najnowszych odczytów (zaraz po połączeniu),
+- `update` - odczyty tylko tych miast, które zmieniły się od poprzedniego zdarzenia.
+
+Jeden WeatherBroadcaster na proces rozsyła te same, raz zakodowane zdarzenia
+do wszystkich klientów - baza nie jest odpytywana per klient. Jego wątek
+sprawdza wersje danych miast (City.data_version) co SSE_POLL_SECONDS oraz
+od razu po zapisie odczytów w tym procesie (sygnał weather_data_saved), więc
+widzi też dane zapisane przez inne procesy (np. run_scheduler). Gdy dane są
+nieaktualne, uruchamia odświeżanie w tle - jak RefreshWeatherAPI.
+
+Strumień działa tylko pod serwerem ASGI - klient to kolejka asyncio w pętli
+zdarzeń. Pod WSGI każde połączenie zajmowałoby wątek serwera na cały czas
+jego trwania, więc endpoint odpowiada 501, a frontend wraca do odpytywania
+/api/pogoda/refresh/.
+"""
+import asyncio
+import logging
+import threading
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection
+from django.dispatch import receiver
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+
+from .fastpath import OrjsonRenderer
+from .models import City
+from .signals import weather_data_saved
+from .utils import cities_due_for_refresh, latest_weather_age, refresh_weather_in_background, \
+    WEATHER_FRESHNESS_SECONDS
+from .views import serialize_latest_weather
+
+logger = logging.getLogger(__name__)
+
+# Co ile sekund wątek rozgłaszający sprawdza, czy dane miast się zmieniły.
+SSE_POLL_SECONDS = 5
+
+# Co ile sekund bez zdarzeń wysyłamy komentarz podtrzymujący połączenie (proxy, load balancery).
+SSE_HEARTBEAT_SECONDS = 15
+
+# Po ilu milisekundach przeglądarka łączy się ponownie po zerwaniu połączenia.
+SSE_RETRY_MS = 10000
+
+# Zdarzenia czekające na wolnego klienta - po przepełnieniu kolejka jest
+# czyszczona, a klient dostaje aktualny snapshot zamiast zaległych zmian.
+SSE_QUEUE_SIZE = 16
+
+RETRY = f"retry: {SSE_RETRY_MS}\n\n".encode()
+HEARTBEAT = b": ping\n\n"
+
+_renderer = OrjsonRenderer()
+
+
+def encode_event(event, data):
+    """Zdarzenie SSE jako bajty (JSON w jednej linii `data:`)."""
+    return b"event: " + event.encode() + b"\ndata: " + _renderer.render(data) + b"\n\n"
+
+
+class _AsyncSubscriber:
+    """Klient pod ASGI: kolejka asyncio, do której wątek rozgłaszający wrzuca zdarzenia przez pętlę zdarzeń."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+
+    def push(self, event, snapshot):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event, snapshot)
+        except RuntimeError:  # pętla już zamknięta - klient i tak się rozłączył
+            pass
+
+    def _put(self, event, snapshot):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(snapshot)
+
+
+class WeatherBroadcaster:
+    """
+    Rozsyła zmiany bieżącej pogody do wszystkich klientów strumienia w procesie.
+
+    Wątek sprawdzający bazę działa tylko, gdy ktoś jest podłączony. Trzyma
+    ostatni snapshot w pamięci - nowy klient dostaje go od razu, bez zapytania.
+    """
+
+    def __init__(self, poll_seconds=SSE_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._subscribers = set()
+        self._thread = None
+        self._versions = None  # miasto -> City.data_version z ostatniego sprawdzenia
+        self._rows = {}  # miasto -> najnowszy odczyt (jak w /api/pogoda/)
+        self._snapshot = None  # zakodowane zdarzenie `snapshot`
+
+    def subscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._snapshot is not None:
+                subscriber.push(self._snapshot, self._snapshot)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="weather-broadcaster", daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def wake(self):
+        """Wymusza sprawdzenie danych bez czekania na kolejny cykl (np. po zapisie odczytów)."""
+        self._wakeup.set()
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        # Bez klientów nie odpytujemy bazy - następny klient uruchomi wątek od nowa.
+                        self._thread = None
+                        self._versions, self._rows, self._snapshot = None, {}, None
+                        return
+                try:
+                    self._check()
+                except Exception as e:
+                    logger.error(f"❌ Błąd sprawdzania danych dla strumienia SSE: {e}")
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+        finally:
+            connection.close()
+
+    def _check(self):
+        versions = dict(City.objects.values_list("name", "data_version"))
+        if versions != self._versions:
+            changed = [
+                name for name, version in versions.items()
+                if self._versions is None or self._versions.get(name) != version
+            ]
+            self._publish(versions, {row["city_name"]: row for row in serialize_latest_weather(cities=changed)})
+
+        age = latest_weather_age()
+        if (age is None or age >= WEATHER_FRESHNESS_SECONDS) and cities_due_for_refresh().exists():
+            refresh_weather_in_background()
+
+    def _publish(self, versions, rows):
+        first = self._versions is None
+        removed = not first and bool(self._versions.keys() - versions.keys())
+        # Zmiana wersji nie zawsze zmienia najnowszy odczyt (np. zapis historii).
+        updated = [row for name, row in rows.items() if self._rows.get(name) != row]
+
+        self._versions = versions
+        self._rows = {name: row for name, row in {**self._rows, **rows}.items() if name in versions}
+        snapshot = encode_event("snapshot", [self._rows[name] for name in sorted(self._rows)])
+
+        with self._lock:
+            self._snapshot = snapshot
+            if first or removed:
+                event = snapshot
+            elif updated:
+                event = encode_event("update", updated)
+            else:
+                return
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            subscriber.push(event, snapshot)
+        if not first:
+            logger.info(f"📡 SSE: zmiany {len(updated)} miast wysłane do {len(subscribers)} klientów")
+
+
+weather_broadcaster = WeatherBroadcaster()
+
+
+@receiver(weather_data_saved)
+def _wake_broadcaster(sender, **kwargs):
+    weather_broadcaster.wake()
+
+
+class WeatherStreamAPI(View):
+    """
+    Strumień Server-Sent Events bieżącej pogody (`text/event-stream`).
+
+    Po połączeniu: zdarzenie `snapshot` z listą jak z /api/pogoda/, potem
+    `update` z odczytami zmienionych miast po każdym zapisie nowych danych.
+    Pod WSGI zwraca 501 - klient powinien odpytywać /api/pogoda/refresh/.
+    """
+    http_method_names = ["get"]
+
+    def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse(
+                {"error": "Strumień wymaga serwera ASGI - użyj /api/pogoda/refresh/."},
+                status=501,
+            )
+
+        response = StreamingHttpResponse(self._events(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginx nie buforuje strumienia
+        return response
+
+    @staticmethod
+    async def _events():
+        subscriber = _AsyncSubscriber()
+        weather_broadcaster.subscribe(subscriber)
+        try:
+            yield RETRY
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber.queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT
+        finally:
+            weather_broadcaster.unsubscribe(subscriber)
@@ -1,3 +1,1426 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import compression, jobs, renderers, stream, utils
+from .async_views import AsyncHourlyForecastAPI, AsyncRefreshWeatherAPI
+from .cache import TTLCache
+from .clients import OpenMeteoClients, openmeteo_clients
+from .fastpath import OrjsonRenderer, USE_ORJSON, json_float
+from .http_cache import AsyncCachingSession, CachingSession, MemoryBackend, UpstreamCache
+from .locks import LeaseLock
+from .sharding import ShardLeases, city_shard
+from .models import City, CityIngestState, DailyWeatherRollup, HistoryFetchJob, HistoryFetchTask, HourlyWeatherRollup, \
+    IngestLock, IngestShard, IngestWorker, UpsertResult, WeatherData
+from .pagination import HISTORY_MAX_LIMIT, InvalidHistoryParam, decode_cursor, paginate_history, parse_limit, \
+    parse_time_bound
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+def reading(city, timestamp, temperature=10.0, **fields):
+    return WeatherData(
+        city=city,
+        timestamp=timestamp,
+        temperature=temperature,
+        precipitation=fields.get("precipitation", 0.0),
+        wind_speed=fields.get("wind_speed", 2.0),
+        relative_humidity=fields.get("relative_humidity", 60.0),
+        source=fields.get("source", WeatherData.Source.CURRENT),
+    )
+
+
+class WeatherDataUpsertTests(TestCase):
+
+    def setUp(self):
+        self.city = City.objects.create(name="Warszawa", latitude=52.23, longitude=21.01)
+
+    def test_counts_inserted_and_updated_rows(self):
+        first = WeatherData.objects.upsert([
+            reading(self.city, utc(2025, 1, 1, 12)),
+            reading(self.city, utc(2025, 1, 1, 13)),
+        ])
+        self.assertEqual(first, UpsertResult(inserted=2, updated=0))
+
+        second = WeatherData.objects.upsert([
+            reading(self.city, utc(2025, 1, 1, 13), temperature=-3.0),
+            reading(self.city, utc(2025, 1, 1, 14)),
+        ])
+        self.assertEqual(second, UpsertResult(inserted=1, updated=1))
+        self.assertEqual(WeatherData.objects.count(), 3)
+        self.assertEqual(WeatherData.objects.get(timestamp=utc(2025, 1, 1, 13)).temperature, -3.0)
+
+    def test_duplicate_keys_in_one_call_keep_last_reading(self):
+        result = WeatherData.objects.upsert([
+            reading(self.city, utc(2025, 1, 1, 12), temperature=1.0),
+            reading(self.city, utc(2025, 1, 1, 12), temperature=2.0),
+        ])
+        self.assertEqual(result, UpsertResult(inserted=1, updated=0))
+        self.assertEqual(WeatherData.objects.get().temperature, 2.0)
+
+    def test_updates_counted_across_batches(self):
+        timestamps = [utc(2025, 1, 1) + timedelta(hours=hour) for hour in range(7)]
+        WeatherData.objects.upsert([reading(self.city, ts) for ts in timestamps[:4]], batch_size=3)
+
+        result = WeatherData.objects.upsert([reading(self.city, ts) for ts in timestamps], batch_size=3)
+        self.assertEqual(result, UpsertResult(inserted=3, updated=4))
+
+    def test_empty_input(self):
+        self.assertEqual(WeatherData.objects.upsert([]), UpsertResult(0, 0))
+
+    def test_moves_latest_reading_pointer_and_bumps_version(self):
+        WeatherData.objects.upsert([reading(self.city, utc(2025, 1, 1, 12))])
+        WeatherData.objects.upsert([reading(self.city, utc(2025, 1, 1, 10))])  # starszy - wskaźnik bez zmian
+
+        self.city.refresh_from_db()
+        self.assertEqual(self.city.latest_reading.timestamp, utc(2025, 1, 1, 12))
+        self.assertEqual(self.city.data_version, 2)
+
+
+class LatestReadingTests(TestCase):
+
+    def setUp(self):
+        compression._precompressed_cache.clear()
+
+    def add_cities(self, names, hours):
+        for name in names:
+            city = City.objects.create(name=name, latitude=50.0, longitude=20.0)
+            WeatherData.objects.upsert([reading(city, utc(2025, 1, 1, hour), float(hour)) for hour in range(hours)])
+
+    def list_queries(self):
+        compression._precompressed_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/pogoda/")
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_latest_list_query_count_does_not_grow_with_data(self):
+        for fast in (False, True):
+            with self.subTest(fast=fast), override_settings(POGODA_FAST_SERIALIZATION=fast):
+                City.objects.all().delete()
+                self.add_cities(["Bytom", "Gliwice"], hours=2)
+                queries, rows = self.list_queries()
+
+                self.add_cities(["Sosnowiec", "Tychy", "Zabrze"], hours=24)
+                with self.assertNumQueries(queries):
+                    compression._precompressed_cache.clear()
+                    response = self.client.get("/api/pogoda/")
+
+                self.assertEqual(len(rows), 2)
+                self.assertEqual(
+                    [(row["city_name"], row["temperature"]) for row in response.json()],
+                    [("Bytom", 1.0), ("Gliwice", 1.0), ("Sosnowiec", 23.0), ("Tychy", 23.0), ("Zabrze", 23.0)],
+                )
+
+    def test_pointer_ignores_older_readings_and_follows_overwrites(self):
+        city = City.objects.create(name="Bytom", latitude=50.35, longitude=18.91)
+        WeatherData.objects.upsert([reading(city, utc(2025, 1, 1, 12), 1.0)])
+        pointer = City.objects.get(pk=city.pk).latest_reading_id
+
+        # Starsze odczyty (także w jednej paczce z wieloma godzinami) nie przestawiają wskaźnika.
+        WeatherData.objects.upsert([reading(city, utc(2025, 1, 1, hour), -5.0) for hour in (3, 7, 11)])
+        self.assertEqual(City.objects.get(pk=city.pk).latest_reading_id, pointer)
+
+        # Nadpisanie najnowszego odczytu zachowuje wskaźnik, a lista pokazuje nową wartość.
+        WeatherData.objects.upsert([reading(city, utc(2025, 1, 1, 12), 4.0)])
+        self.assertEqual(City.objects.get(pk=city.pk).latest_reading_id, pointer)
+        self.assertEqual(self.list_queries()[1][0]["temperature"], 4.0)
+
+        WeatherData.objects.upsert([reading(city, utc(2025, 1, 1, 13), 6.0)])
+        latest = City.objects.get(pk=city.pk).latest_reading
+        self.assertNotEqual(latest.pk, pointer)
+        self.assertEqual((latest.timestamp, latest.temperature), (utc(2025, 1, 1, 13), 6.0))
+
+
+class HistoryPaginationTests(TestCase):
+
+    def setUp(self):
+        compression._precompressed_cache.clear()
+        self.city = City.objects.create(name="Gdańsk", latitude=54.35, longitude=18.65)
+        self.timestamps = [utc(2025, 1, 1) + timedelta(hours=hour) for hour in range(10)]
+        WeatherData.objects.upsert([reading(self.city, ts) for ts in self.timestamps])
+
+    def paginate(self, **params):
+        return paginate_history(self.city.weather_readings.all(), params)
+
+    def test_pages_follow_cursor_newest_first(self):
+        seen = []
+        page, cursor = self.paginate(limit="4")
+        seen += page
+        while cursor:
+            page, cursor = self.paginate(limit="4", cursor=cursor)
+            seen += page
+
+        self.assertEqual([r.timestamp for r in seen], sorted(self.timestamps, reverse=True))
+
+    def test_values_pages_end_with_timestamp_and_pk(self):
+        page, cursor = paginate_history(self.city.weather_readings.all(), {"limit": "3"}, values=("temperature",))
+        self.assertEqual(len(page[0]), 3)
+        self.assertEqual(decode_cursor(cursor), (page[-1][-2], page[-1][-1]))
+
+    def test_time_window(self):
+        page, cursor = self.paginate(**{"from": "2025-01-01T03:00:00Z", "to": "2025-01-01T05:00:00Z"})
+        self.assertEqual([r.timestamp for r in page], self.timestamps[5:2:-1])
+        self.assertIsNone(cursor)
+
+    def test_naive_bounds_are_polish_time(self):
+        self.assertEqual(parse_time_bound("from", "2025-01-01"), utc(2024, 12, 31, 23))
+        self.assertEqual(parse_time_bound("from", "2025-07-01T12:00"), utc(2025, 7, 1, 10))
+
+    def test_invalid_cursor(self):
+        naive = base64.urlsafe_b64encode(b"2025-01-01T00:00:00|5").decode()
+        for cursor in ("not-a-cursor", "!!!", naive, base64.urlsafe_b64encode(b"2025-01-01T00:00:00+00:00|x").decode()):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidHistoryParam):
+                self.paginate(cursor=cursor)
+
+    def test_invalid_limit(self):
+        for limit in ("0", "-1", "abc"):
+            with self.subTest(limit=limit), self.assertRaises(InvalidHistoryParam):
+                self.paginate(limit=limit)
+        self.assertEqual(parse_limit(str(HISTORY_MAX_LIMIT + 1)), HISTORY_MAX_LIMIT)
+
+    def test_impossible_dates_are_invalid_params(self):
+        for value in ("2025-02-30", "2025-13-01", "2025-01-01T25:00", "2025-11-31", "yesterday"):
+            with self.subTest(value=value), self.assertRaises(InvalidHistoryParam):
+                parse_time_bound("from", value)
+
+    def test_history_endpoint_rejects_impossible_dates(self):
+        for query in ("from=2025-02-30", "to=2025-13-01", "from=2025-01-01T25:00", "cursor=garbage"):
+            with self.subTest(query=query):
+                response = self.client.get(f"/api/pogoda/history/{self.city.name}/?{query}")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+    def test_stats_endpoint_rejects_impossible_dates(self):
+        response = self.client.get(f"/api/pogoda/stats/{self.city.name}/?from=2025-11-31")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", response.json())
+
+
+class TTLCacheTests(SimpleTestCase):
+
+    def test_concurrent_misses_compute_once(self):
+        cache = TTLCache(maxsize=4, ttl=60)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "wynik"
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            first = executor.submit(cache.get_or_compute, "klucz", compute)
+            started.wait(5)
+            others = [executor.submit(cache.get_or_compute, "klucz", compute) for _ in range(4)]
+            release.set()
+            results = [first.result(5)] + [future.result(5) for future in others]
+
+        self.assertEqual(results, ["wynik"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get("klucz"), "wynik")
+
+    def test_error_reaches_waiters_and_is_not_cached(self):
+        cache = TTLCache(maxsize=4, ttl=60)
+        started, release = threading.Event(), threading.Event()
+
+        def failing():
+            started.set()
+            release.wait(5)
+            raise RuntimeError("API")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(cache.get_or_compute, "klucz", failing)
+            started.wait(5)
+            waiter = executor.submit(cache.get_or_compute, "klucz", lambda: "inny")
+            release.set()
+            for future in (first, waiter):
+                with self.assertRaises(RuntimeError):
+                    future.result(5)
+
+        self.assertEqual(cache.get_or_compute("klucz", lambda: "ponownie"), "ponownie")
+
+    def test_expired_entries_are_recomputed(self):
+        cache = TTLCache(maxsize=4, ttl=10)
+        with mock.patch("pogoda_app.cache.time.monotonic", return_value=100.0):
+            cache.set("klucz", 1)
+        with mock.patch("pogoda_app.cache.time.monotonic", return_value=109.0):
+            self.assertEqual(cache.get("klucz"), 1)
+        with mock.patch("pogoda_app.cache.time.monotonic", return_value=110.0):
+            self.assertIsNone(cache.get("klucz"))
+            self.assertEqual(cache.get_or_compute("klucz", lambda: 2), 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(len(cache), 2)
+
+    def test_byte_budget_evicts_oldest_entries(self):
+        cache = TTLCache(maxsize=None, ttl=60, maxbytes=10, sizeof=len)
+        cache.set("a", b"xxxx")
+        cache.set("b", b"xxxx")
+        cache.get("a")
+        cache.set("c", b"xxxx")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c"), cache.currbytes), (b"xxxx", b"xxxx", 8))
+
+        cache.set("a", b"x")
+        self.assertEqual(cache.currbytes, 5)
+        cache.set("huge", b"x" * 11)
+        self.assertIsNone(cache.get("huge"))
+        self.assertEqual(len(cache), 2)
+
+
+def current_response(temperature):
+    """Odpowiedź Open-Meteo z blokiem `current` (temperatura, opady, wiatr, wilgotność)."""
+    values = (temperature, 0.0, 2.0, 60.0)
+    current = mock.Mock()
+    current.Variables.side_effect = lambda index: mock.Mock(Value=mock.Mock(return_value=values[index]))
+    return mock.Mock(Current=mock.Mock(return_value=current))
+
+
+def forecast_response(start, columns, interval=3600, utc_offset=0):
+    """
+    Odpowiedź Open-Meteo z blokiem `hourly` od `start` (unix timestamp);
+    `columns` w kolejności utils.FORECAST_VARIABLES.
+    """
+    hourly = mock.Mock()
+    hourly.Time.return_value = start
+    hourly.Interval.return_value = interval
+    hourly.Variables.side_effect = lambda index: mock.Mock(
+        ValuesAsNumpy=mock.Mock(return_value=np.array(columns[index], dtype=np.float32))
+    )
+    return mock.Mock(Hourly=mock.Mock(return_value=hourly), UtcOffsetSeconds=mock.Mock(return_value=utc_offset))
+
+
+class LeaseLockTests(TestCase):
+
+    def test_only_one_owner_until_release(self):
+        first, second = LeaseLock("test"), LeaseLock("test")
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+
+        first.release()
+        self.assertTrue(second.acquire())
+
+    def test_expired_lease_can_be_taken_over_and_renew_detects_it(self):
+        first, second = LeaseLock("test"), LeaseLock("test")
+        self.assertTrue(first.acquire())
+        IngestLock.objects.filter(name="test").update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertTrue(second.acquire())
+        self.assertFalse(first.renew())
+        self.assertTrue(second.renew())
+
+        first.release()  # nie zwalnia cudzej blokady
+        self.assertEqual(IngestLock.objects.get(name="test").owner, second.owner)
+
+    def test_renew_extends_lease(self):
+        lock = LeaseLock("test", ttl=120)
+        lock.acquire()
+        IngestLock.objects.filter(name="test").update(expires_at=timezone.now() + timedelta(seconds=1))
+
+        self.assertTrue(lock.renew())
+        self.assertGreater(IngestLock.objects.get(name="test").expires_at, timezone.now() + timedelta(seconds=100))
+        self.assertFalse(LeaseLock("test").acquire())
+
+    def test_weather_fetch_stops_writing_after_losing_lease(self):
+        cities = [
+            City.objects.create(name=name, latitude=50.0 + index, longitude=20.0)
+            for index, name in enumerate(("Kielce", "Lublin", "Opole"))
+        ]
+        lock = LeaseLock(utils.WEATHER_LOCK_NAME)
+        lock.acquire()
+
+        def weather_api(url, params):
+            if weather_api.calls == 1:
+                # Pobieranie drugiej paczki trwa dłużej niż dzierżawa - blokadę przejmuje inny proces.
+                IngestLock.objects.filter(name=lock.name).update(owner="inny", expires_at=timezone.now())
+            weather_api.calls += 1
+            return [current_response(5.0)]
+        weather_api.calls = 0
+
+        client = mock.Mock(weather_api=weather_api)
+        with mock.patch.object(utils, "CURRENT_WEATHER_CHUNK_SIZE", 1), \
+                mock.patch.object(utils, "setup_openmeteo_client", return_value=client), \
+                self.assertLogs("pogoda_app.utils", "WARNING"):
+            utils._fetch_and_save_weather_data(cities, [lock])
+
+        self.assertEqual(weather_api.calls, 2)
+        self.assertEqual(list(WeatherData.objects.values_list("city_id", flat=True)), ["Kielce"])
+        self.assertEqual(list(CityIngestState.objects.values_list("city_id", flat=True)), ["Kielce"])
+
+
+class HistoryGapTests(TestCase):
+
+    def test_merge_dates_into_ranges(self):
+        days = [date(2025, 1, day) for day in (1, 2, 3, 6, 7, 12)]
+
+        self.assertEqual(utils._merge_dates_into_ranges([]), [])
+        self.assertEqual(
+            utils._merge_dates_into_ranges(days),
+            [(date(2025, 1, 1), date(2025, 1, 3)), (date(2025, 1, 6), date(2025, 1, 7)), (date(2025, 1, 12),) * 2],
+        )
+        # Przerwa 2 zapisanych dni (4-5.01) mieści się w max_gap_days=2, przerwa 4 dni (8-11.01) - nie.
+        self.assertEqual(
+            utils._merge_dates_into_ranges(days, max_gap_days=2),
+            [(date(2025, 1, 1), date(2025, 1, 7)), (date(2025, 1, 12),) * 2],
+        )
+
+    def test_missing_ranges_skip_stored_days_and_refresh_last_day(self):
+        city = City.objects.create(name="Toruń", latitude=53.01, longitude=18.6)
+        empty = City.objects.create(name="Radom", latitude=51.4, longitude=21.15)
+        start, end = date(2025, 1, 1), date(2025, 1, 30)
+        stored = [day for day in (start + timedelta(days=i) for i in range(30)) if day.day not in (5, 6, 20)]
+        WeatherData.objects.upsert([
+            reading(city, utils._history_timestamp(day), source=WeatherData.Source.HISTORY) for day in stored
+        ])
+
+        ranges = utils.missing_history_ranges([city, empty], start, end)
+
+        # 5-6.01 to jedna luka; 20.01 i ostatni dzień (zawsze odświeżany) są za daleko, by je skleić.
+        self.assertEqual(ranges[city.pk], [
+            (date(2025, 1, 5), date(2025, 1, 6)),
+            (date(2025, 1, 20), date(2025, 1, 20)),
+            (date(2025, 1, 30), date(2025, 1, 30)),
+        ])
+        self.assertEqual(ranges[empty.pk], [(start, end)])
+
+
+class HistoryForAllCitiesTests(TestCase):
+
+    def test_failing_city_does_not_stop_the_others(self):
+        names = ("Gdańsk", "Kielce", "Opole", "Zamość")
+        for name in names:
+            City.objects.create(name=name, latitude=50.0, longitude=20.0)
+
+        def missing(cities, start, end):
+            return {city.pk: [] if city.name == "Zamość" else [(start, end)] for city in cities}
+
+        def fetch(session, city, ranges):
+            if city.name == "Kielce":
+                raise ConnectionError("timeout")
+            if city.name == "Opole":
+                return []
+            first_day = ranges[0][0]
+            return [
+                (utils._history_timestamp(first_day + timedelta(days=day)), 3.0, 0.0, 2.0, 70.0) for day in range(2)
+            ]
+
+        with mock.patch.object(utils, "missing_history_ranges", side_effect=missing), \
+                mock.patch.object(utils, "fetch_history_ranges", side_effect=fetch) as fetch_ranges, \
+                mock.patch.object(utils.openmeteo_clients, "session"), \
+                self.assertLogs("pogoda_app.utils", "WARNING"):
+            report = utils.fetch_history_for_all_cities(concurrency=2)
+
+        self.assertEqual(fetch_ranges.call_count, 3)
+        self.assertEqual(sorted(report), [
+            "Gdańsk: OK (nowe: 2, zaktualizowane: 0)",
+            "Kielce: BŁĄD (timeout)",
+            "Opole: Brak danych",
+            "Zamość: OK (historia kompletna)",
+        ])
+        self.assertEqual(len(report), len(names))
+        self.assertEqual(
+            set(WeatherData.objects.values_list("city__name", "source")),
+            {("Gdańsk", WeatherData.Source.HISTORY)},
+        )
+
+
+class IngestStateTests(TestCase):
+
+    def setUp(self):
+        self.fresh = City.objects.create(name="Olsztyn", latitude=53.78, longitude=20.49)
+        self.stale = City.objects.create(name="Rzeszów", latitude=50.04, longitude=22.0)
+        self.failing = City.objects.create(name="Zakopane", latitude=49.3, longitude=19.95)
+        self.new = City.objects.create(name="Sopot", latitude=54.44, longitude=18.56)
+
+    def due(self):
+        return set(utils.cities_due_for_refresh().values_list("name", flat=True))
+
+    def test_only_stale_cities_without_pending_retry_are_due(self):
+        now = timezone.now()
+        CityIngestState.objects.create(city=self.fresh, last_success_at=now - timedelta(seconds=60))
+        CityIngestState.objects.create(city=self.stale, last_success_at=now - timedelta(hours=1))
+        CityIngestState.objects.create(city=self.failing, error_count=1, retry_after=now + timedelta(minutes=1))
+
+        self.assertEqual(self.due(), {"Rzeszów", "Sopot"})
+
+        CityIngestState.objects.filter(city=self.failing).update(retry_after=now - timedelta(seconds=1))
+        self.assertEqual(self.due(), {"Rzeszów", "Sopot", "Zakopane"})
+
+    def test_errors_back_off_exponentially_and_success_resets(self):
+        now = timezone.now()
+        delays = []
+        for _ in range(8):
+            utils._record_ingest_results(list(utils.cities_due_for_refresh()), {self.failing.pk: "timeout"}, now)
+            state = CityIngestState.objects.get(city=self.failing)
+            delays.append((state.retry_after - now).total_seconds())
+            CityIngestState.objects.filter(city=self.failing).update(retry_after=None)
+
+        self.assertEqual(delays, [60, 120, 240, 480, 960, 1920, 3600, 3600])
+        self.assertEqual(state.last_error, "timeout")
+        self.assertEqual(CityIngestState.objects.get(city=self.stale).last_success_at, now)
+
+        utils._record_ingest_results([City.objects.get(pk=self.failing.pk)], {}, now)
+        state = CityIngestState.objects.get(city=self.failing)
+        self.assertEqual((state.error_count, state.last_error, state.retry_after), (0, "", None))
+        self.assertNotIn("Zakopane", self.due())
+
+
+class CurrentWeatherChunkTests(TestCase):
+
+    def setUp(self):
+        names = ("Chełm", "Kalisz", "Legnica", "Płock", "Radom")
+        for index, name in enumerate(names):
+            City.objects.create(name=name, latitude=50.0 + index, longitude=20.0)
+        self.cities = list(City.objects.order_by("name"))
+
+    def fetch(self, weather_api):
+        client = mock.Mock(weather_api=mock.Mock(side_effect=weather_api))
+        with mock.patch.object(utils, "CURRENT_WEATHER_CHUNK_SIZE", 2), \
+                mock.patch.object(utils, "setup_openmeteo_client", return_value=client):
+            utils._fetch_and_save_weather_data(self.cities)
+        return client.weather_api
+
+    def test_one_request_per_chunk_with_responses_in_city_order(self):
+        def weather_api(url, params):
+            return [current_response(float(latitude)) for latitude in params["latitude"].split(",")]
+
+        weather_api = self.fetch(weather_api)
+
+        self.assertEqual(
+            [call.kwargs["params"]["latitude"] for call in weather_api.call_args_list],
+            ["50.0,51.0", "52.0,53.0", "54.0"],
+        )
+        self.assertEqual(
+            dict(WeatherData.objects.values_list("city__name", "temperature")),
+            {city.name: city.latitude for city in self.cities},
+        )
+        self.assertEqual(CityIngestState.objects.filter(error_count=0).count(), 5)
+
+    def test_missing_responses_are_recorded_as_errors(self):
+        def weather_api(url, params):
+            latitudes = params["latitude"].split(",")
+            return [current_response(float(latitude)) for latitude in latitudes[:1]]
+
+        with self.assertLogs("pogoda_app.utils", "ERROR") as logs:
+            self.fetch(weather_api)
+
+        saved = WeatherData.objects.order_by("city__name").values_list("city__name", flat=True)
+        self.assertEqual(list(saved), ["Chełm", "Legnica", "Radom"])
+        failed = CityIngestState.objects.filter(error_count=1).order_by("city__name")
+        self.assertEqual([state.city.name for state in failed], ["Kalisz", "Płock"])
+        self.assertEqual({state.last_error for state in failed}, {"Brak odpowiedzi API dla miasta"})
+        self.assertEqual(sum("API zwróciło 1 odpowiedzi dla 2 miast" in line for line in logs.output), 2)
+
+
+class RefreshWeatherTests(TestCase):
+
+    def setUp(self):
+        self.city = City.objects.create(name="Toruń", latitude=53.01, longitude=18.6)
+
+    def save_reading(self, age):
+        WeatherData.objects.upsert([reading(self.city, timezone.now() - timedelta(seconds=age))])
+
+    def refresh(self):
+        with mock.patch("pogoda_app.views.refresh_weather_in_background") as refresh:
+            response = self.client.get("/api/pogoda/refresh/")
+        self.assertEqual(response.status_code, 200)
+        return response, refresh
+
+    def test_fresh_data_is_served_without_refresh(self):
+        self.save_reading(60)
+
+        response, refresh = self.refresh()
+
+        refresh.assert_not_called()
+        self.assertEqual(response["X-Data-Stale"], "false")
+        self.assertAlmostEqual(int(response["X-Data-Age"]), 60, delta=5)
+        self.assertEqual(response.json()[0]["city_name"], "Toruń")
+
+    def test_stale_data_is_served_and_refreshed_in_background(self):
+        self.save_reading(utils.WEATHER_FRESHNESS_SECONDS + 60)
+
+        response, refresh = self.refresh()
+
+        refresh.assert_called_once_with()
+        self.assertEqual(response["X-Data-Stale"], "true")
+        self.assertGreaterEqual(int(response["X-Data-Age"]), utils.WEATHER_FRESHNESS_SECONDS + 60)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_no_refresh_while_every_city_waits_for_retry(self):
+        self.save_reading(utils.WEATHER_FRESHNESS_SECONDS + 60)
+        CityIngestState.objects.create(city=self.city, error_count=1, retry_after=timezone.now() + timedelta(minutes=1))
+
+        response, refresh = self.refresh()
+
+        refresh.assert_not_called()
+        self.assertEqual(response["X-Data-Stale"], "true")
+
+    def test_empty_database_is_stale_without_age(self):
+        response, refresh = self.refresh()
+
+        refresh.assert_called_once_with()
+        self.assertEqual(response["X-Data-Stale"], "true")
+        self.assertNotIn("X-Data-Age", response)
+        self.assertEqual(response.json(), [])
+
+    async def test_async_view_sets_same_headers(self):
+        await sync_to_async(self.save_reading)(utils.WEATHER_FRESHNESS_SECONDS + 60)
+
+        with mock.patch("pogoda_app.async_views.refresh_weather_in_background") as refresh:
+            response = await AsyncRefreshWeatherAPI.as_view()(AsyncRequestFactory().get("/api/pogoda/refresh/"))
+
+        refresh.assert_called_once_with()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Data-Stale"], "true")
+        self.assertGreaterEqual(int(response["X-Data-Age"]), utils.WEATHER_FRESHNESS_SECONDS + 60)
+        self.assertEqual(json.loads(response.content)[0]["city_name"], "Toruń")
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        compression._precompressed_cache.clear()
+        self.city = City.objects.create(name="Poznań", latitude=52.41, longitude=16.93)
+        WeatherData.objects.upsert([reading(self.city, utc(2025, 1, 1, 12))])
+        self.url = "/api/pogoda/history/Poznań/"
+
+    def test_matching_etag_returns_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("max-age=300", response["Cache-Control"])
+        self.assertIn("Accept", response["Vary"])
+
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        self.assertEqual(cached["ETag"], response["ETag"])
+
+    def test_if_modified_since_returns_304(self):
+        response = self.client.get(self.url)
+        cached = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_new_data_changes_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        WeatherData.objects.upsert([reading(self.city, utc(2025, 1, 1, 13))])
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()["history"]), 2)
+
+    def test_representations_have_different_etags(self):
+        etags = {
+            self.client.get(self.url)["ETag"],
+            self.client.get(self.url + "?limit=1")["ETag"],
+            self.client.get(self.url + "?format=columnar")["ETag"],
+        }
+        self.assertEqual(len(etags), 3)
+
+    def test_latest_list_etag_follows_any_city(self):
+        other = City.objects.create(name="Kalisz", latitude=51.76, longitude=18.09)
+        etag = self.client.get("/api/pogoda/")["ETag"]
+        self.assertEqual(self.client.get("/api/pogoda/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        WeatherData.objects.upsert([reading(other, utc(2025, 1, 1, 12))])
+        self.assertEqual(self.client.get("/api/pogoda/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unknown_city_has_no_etag(self):
+        response = self.client.get("/api/pogoda/history/Atlantyda/")
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header("ETag"))
+
+
+class RollupTests(TestCase):
+
+    def setUp(self):
+        compression._precompressed_cache.clear()
+        self.city = City.objects.create(name="Lublin", latitude=51.25, longitude=22.57)
+        self.url = "/api/pogoda/stats/Lublin/"
+
+    def test_history_rows_are_not_aggregated(self):
+        day = date(2025, 1, 10)
+        WeatherData.objects.upsert([
+            reading(self.city, utils._history_timestamp(day), 2.0, precipitation=12.0, source=WeatherData.Source.HISTORY),
+            reading(self.city, utc(2025, 1, 10, 9), 4.0, precipitation=0.5),
+            reading(self.city, utc(2025, 1, 10, 12), 6.0, precipitation=0.3),
+        ])
+
+        daily = DailyWeatherRollup.objects.get(city=self.city)
+        self.assertEqual(daily.readings_count, 2)
+        self.assertAlmostEqual(daily.precipitation_sum, 0.8)
+        self.assertEqual((daily.temperature_min, daily.temperature_max), (4.0, 6.0))
+        # Godzina północy ma tylko wiersz archiwalny - bez agregatu.
+        self.assertEqual(HourlyWeatherRollup.objects.filter(city=self.city).count(), 2)
+
+    def test_stats_etag_follows_resolved_window(self):
+        WeatherData.objects.upsert([reading(self.city, utc(2025, 1, 10, 9))])
+
+        with mock.patch("django.utils.timezone.now", return_value=utc(2025, 1, 10, 9, 30)):
+            etag = self.client.get(self.url + "?bucket=hour")["ETag"]
+            self.assertEqual(self.client.get(self.url + "?bucket=hour", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Dane bez zmian, ale domyślne `to` przeszło do kolejnej godziny.
+        with mock.patch("django.utils.timezone.now", return_value=utc(2025, 1, 10, 10, 5)):
+            response = self.client.get(self.url + "?bucket=hour", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_stats_rejects_unknown_bucket(self):
+        response = self.client.get(self.url + "?bucket=week")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header("ETag"))
+
+
+class CompactionTests(TestCase):
+
+    def setUp(self):
+        compression._precompressed_cache.clear()
+        self.city = City.objects.create(name="Opole", latitude=50.67, longitude=17.93)
+        self.old = timezone.now() - timedelta(days=200)
+        WeatherData.objects.upsert([
+            reading(self.city, self.old),
+            reading(self.city, self.old - timedelta(hours=1)),
+            reading(self.city, utils._history_timestamp(self.old.date()), source=WeatherData.Source.HISTORY),
+            reading(self.city, timezone.now() - timedelta(minutes=5)),
+        ])
+
+    def test_compaction_keeps_latest_and_archive_rows(self):
+        report = utils.compact_old_readings()
+
+        self.assertEqual(report["readings"], 2)
+        self.assertEqual(
+            list(self.city.weather_readings.values_list("source", flat=True).order_by("timestamp")),
+            [WeatherData.Source.HISTORY, WeatherData.Source.CURRENT],
+        )
+
+    def test_compaction_invalidates_etag(self):
+        url = "/api/pogoda/history/Opole/"
+        etag = self.client.get(url)["ETag"]
+        version = City.objects.get(pk=self.city.pk).data_version
+
+        utils.compact_old_readings()
+
+        self.assertEqual(City.objects.get(pk=self.city.pk).data_version, version + 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["history"]), 2)
+
+
+class PerceivedTemperatureTests(TestCase):
+
+    # (temperatura, wilgotność, wiatr) - po obu stronach każdego progu.
+    CASES = [
+        (-5.0, 80.0, 8.0), (9.9, 60.0, 3.1), (10.0, 60.0, 9.0), (5.0, 60.0, 3.0),
+        (20.0, 90.0, 12.0), (25.0, 90.0, 1.0), (30.0, 50.0, 1.0), (32.0, 85.0, 2.0),
+        (31.0, 70.0, 6.0), (2.0, None, None), (28.0, None, 1.0),
+    ]
+
+    def test_batch_expression_and_scalar_agree(self):
+        city = City.objects.create(name="Gdynia", latitude=54.52, longitude=18.53)
+        start = utc(2025, 7, 1)
+        WeatherData.objects.bulk_create([
+            WeatherData(
+                city=city, timestamp=start + timedelta(hours=i),
+                temperature=temp, relative_humidity=humidity, wind_speed=wind, precipitation=0.0,
+            )
+            for i, (temp, humidity, wind) in enumerate(self.CASES)
+        ])
+
+        scalar = [utils.calculate_perceived_temp(*case) for case in self.CASES]
+        temps, humidity, wind = zip(*self.CASES)
+        batch = utils.calculate_perceived_temp_batch(temps, humidity, wind).tolist()
+        in_db = list(city.weather_readings.order_by("timestamp").annotate(
+            perceived=utils.perceived_temperature_expression()
+        ).values_list("perceived", flat=True))
+
+        for expected, from_batch, from_db in zip(scalar, batch, in_db):
+            self.assertAlmostEqual(from_batch, expected)
+            self.assertAlmostEqual(from_db, expected)
+
+
+@skipUnless(USE_ORJSON, "orjson >= 3.9 nie jest zainstalowany")
+class OrjsonRendererTests(TestCase):
+
+    DATA = {"small": 1e-05, "big": 1e16, "regular": 12.5, "text": "linia\u2028"}
+
+    def test_indented_output_matches_json_renderer(self):
+        fragments = {key: json_float(value) if isinstance(value, float) else value for key, value in self.DATA.items()}
+        for indent in (None, 2):
+            context = {"indent": indent}
+            self.assertEqual(
+                OrjsonRenderer().render(fragments, "application/json", context),
+                JSONRenderer().render(self.DATA, "application/json", context),
+            )
+
+    @override_settings(POGODA_FAST_SERIALIZATION=True)
+    def test_indent_request_on_fast_path(self):
+        city = City.objects.create(name="Sopot", latitude=54.44, longitude=18.56)
+        WeatherData.objects.upsert([reading(city, utc(2025, 1, 1, 12), precipitation=1e-05)])
+
+        response = self.client.get("/api/pogoda/", HTTP_ACCEPT="application/json; indent=2")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'\n  {\n    "city_name": "Sopot"', response.content)
+        self.assertIn(b'"precipitation": 1e-05', response.content)
+
+
+class CompressionTests(TestCase):
+
+    def setUp(self):
+        compression._precompressed_cache.clear()
+        self.city = City.objects.create(name="Kraków", latitude=50.06, longitude=19.94)
+        WeatherData.objects.upsert([reading(self.city, utc(2025, 1, 1, hour)) for hour in range(10)])
+        self.url = "/api/pogoda/history/Kraków/"
+
+    def test_negotiate_encoding(self):
+        available = {"identity": b"", "gzip": b"", "br": b""}
+        negotiate = compression.negotiate_encoding
+        preferred = compression.ENCODINGS[0]
+
+        self.assertEqual(negotiate("", available), "identity")
+        self.assertEqual(negotiate("gzip", available), "gzip")
+        self.assertEqual(negotiate("gzip, deflate, br", available), preferred)
+        self.assertEqual(negotiate("GZIP;q=0.5, br;q=0.1", {"identity": b"", "gzip": b""}), "gzip")
+        self.assertEqual(negotiate("br;q=0, gzip;q=0", available), "identity")
+        self.assertEqual(negotiate("*", available), preferred)
+        self.assertEqual(negotiate("*;q=0.2, gzip;q=0.8", available), "gzip")
+        self.assertEqual(negotiate("gzip;q=abc, deflate", available), "identity")
+        self.assertEqual(negotiate("gzip", {"identity": b""}), "identity")
+
+    def test_each_coding_has_its_own_etag(self):
+        plain = self.client.get(self.url)
+        gzipped = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(gzipped["Content-Encoding"], "gzip")
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertEqual(gzipped["ETag"], plain["ETag"][:-1] + '-gzip"')
+        self.assertEqual(gzip.decompress(gzipped.content), plain.content)
+
+        # ETag wariantu gzip nie potwierdza wersji nieskompresowanej - i odwrotnie.
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=gzipped["ETag"]).status_code, 200)
+        cached = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=gzipped["ETag"])
+        self.assertEqual(cached.status_code, 304)
+        self.assertIn("Accept-Encoding", cached["Vary"])
+
+    def test_browsable_api_page_is_not_shared_between_users(self):
+        alice = User.objects.create_user("alice", password="haslo")
+        self.client.force_login(alice)
+        page = self.client.get("/api/pogoda/", HTTP_ACCEPT="text/html")
+        self.assertContains(page, "alice")
+
+        anonymous = self.client_class().get("/api/pogoda/", HTTP_ACCEPT="text/html")
+
+        self.assertEqual(anonymous.status_code, 200)
+        self.assertNotContains(anonymous, "alice")
+        self.assertNotEqual(anonymous.content, page.content)
+        self.assertEqual(len(compression._precompressed_cache), 0)
+
+    def test_cache_is_bounded_by_bytes(self):
+        self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        entry_size = compression._precompressed_cache.currbytes
+        self.assertGreater(entry_size, 0)
+
+        with mock.patch.object(compression._precompressed_cache, "maxbytes", entry_size):
+            self.client.get(self.url + "?limit=5")
+            self.assertEqual(len(compression._precompressed_cache), 1)
+            self.assertLessEqual(compression._precompressed_cache.currbytes, entry_size)
+
+
+class UpstreamCacheTests(SimpleTestCase):
+
+    URL = "https://api.open-meteo.com/v1/forecast"
+
+    def upstream_response(self):
+        return mock.Mock(status_code=200, content=b"{}", headers={"Content-Type": "application/json"})
+
+    def test_grid_snapping_only_affects_cache_key(self):
+        session = CachingSession(UpstreamCache(MemoryBackend()))
+        with mock.patch("requests.Session.request", return_value=self.upstream_response()) as upstream:
+            session.get(self.URL, params={"latitude": 52.2297, "longitude": 21.0122, "current": "temperature_2m"})
+            cached = session.get(
+                self.URL, params={"latitude": 52.225, "longitude": 21.015, "current": "temperature_2m"}
+            )
+
+        upstream.assert_called_once()
+        self.assertEqual(upstream.call_args.kwargs["params"]["latitude"], 52.2297)
+        self.assertEqual(upstream.call_args.kwargs["params"]["longitude"], 21.0122)
+        self.assertTrue(cached.from_cache)
+
+    async def test_async_session_keeps_backend_io_off_the_event_loop(self):
+        cache = UpstreamCache(MemoryBackend())
+        session = AsyncCachingSession(cache)
+        loop_thread = threading.get_ident()
+        backend_threads = []
+
+        def recording(method):
+            def call(*args, **kwargs):
+                backend_threads.append(threading.get_ident())
+                return method(*args, **kwargs)
+            return call
+
+        params = {"latitude": 52.2297, "longitude": 21.0122, "current": "temperature_2m"}
+        with mock.patch.object(cache, "get", recording(cache.get)), \
+                mock.patch.object(cache, "set", recording(cache.set)), \
+                mock.patch("niquests.AsyncSession.request", new_callable=mock.AsyncMock,
+                           return_value=self.upstream_response()) as upstream:
+            await session.request("GET", self.URL, params=params)
+            cached = await session.request("GET", self.URL, params=params)
+
+        upstream.assert_awaited_once()
+        self.assertTrue(cached.from_cache)
+        self.assertEqual(len(backend_threads), 3)
+        self.assertNotIn(loop_thread, backend_threads)
+
+
+@override_settings(POGODA_UPSTREAM_CACHE=None)
+class OpenMeteoClientsTests(SimpleTestCase):
+
+    def test_session_is_shared_within_process(self):
+        clients = OpenMeteoClients()
+        session = clients.session()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            sessions = list(pool.map(lambda _: clients.session(), range(8)))
+
+        self.assertTrue(all(other is session for other in sessions))
+        self.assertIs(clients.client(), clients.client())
+
+    def test_session_is_recreated_in_child_process(self):
+        clients = OpenMeteoClients()
+        session = clients.session()
+        clients._lock.acquire()  # trzymana przez inny wątek rodzica w chwili fork()
+
+        clients._after_fork()
+
+        self.assertIsNot(clients.session(), session)
+        self.assertIs(clients.session(), clients.session())
+
+    def test_session_is_recreated_when_pid_changes(self):
+        clients = OpenMeteoClients()
+        session = clients.session()
+
+        with mock.patch("pogoda_app.clients.os.getpid", return_value=os.getpid() + 1):
+            child_session = clients.session()
+
+        self.assertIsNot(child_session, session)
+
+    @skipUnless(hasattr(os, "register_at_fork"), "fork() niedostępny")
+    def test_fork_hook_is_registered(self):
+        lock = openmeteo_clients._lock
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if openmeteo_clients._pid is None and openmeteo_clients._lock is not lock else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class WeatherStreamTests(TestCase):
+
+    def test_stream_is_refused_under_wsgi(self):
+        response = self.client.get("/api/pogoda/stream/")
+
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(response.streaming)
+        self.assertIn("/api/pogoda/refresh/", response.json()["error"])
+
+    def save(self, city, hour, temperature):
+        with self.captureOnCommitCallbacks(execute=True):
+            WeatherData.objects.upsert([reading(city, utc(2025, 1, 1, hour), temperature=temperature)])
+
+    def test_saved_readings_wake_the_broadcaster(self):
+        city = City.objects.create(name="Lublin", latitude=51.25, longitude=22.57)
+
+        with mock.patch.object(stream.weather_broadcaster, "wake") as wake:
+            self.save(city, 12, 1.0)
+
+        wake.assert_called_once_with()
+
+    async def test_version_bump_reaches_subscriber_as_update(self):
+        lublin, opole = await sync_to_async(lambda: [
+            City.objects.create(name=name, latitude=50.0, longitude=20.0) for name in ("Lublin", "Opole")
+        ])()
+        await sync_to_async(self.save)(lublin, 12, 1.0)
+        await sync_to_async(self.save)(opole, 12, 2.0)
+
+        broadcaster = stream.WeatherBroadcaster()
+        subscriber = stream._AsyncSubscriber()
+        check = sync_to_async(broadcaster._check)
+        with mock.patch.object(stream.threading, "Thread"), \
+                mock.patch.object(stream, "refresh_weather_in_background"):
+            broadcaster.subscribe(subscriber)
+            await check()
+            snapshot = await asyncio.wait_for(subscriber.queue.get(), 1)
+
+            await sync_to_async(self.save)(opole, 13, 7.5)
+            await check()
+            update = await asyncio.wait_for(subscriber.queue.get(), 1)
+
+            await check()  # bez zmian wersji - bez zdarzenia
+            await asyncio.sleep(0)
+
+        self.assertTrue(snapshot.startswith(b"event: snapshot\n"))
+        self.assertEqual([row["city_name"] for row in self.event_data(snapshot)], ["Lublin", "Opole"])
+        self.assertTrue(update.startswith(b"event: update\n"))
+        self.assertEqual([(row["city_name"], row["temperature"]) for row in self.event_data(update)], [("Opole", 7.5)])
+        self.assertTrue(subscriber.queue.empty())
+
+    async def test_slow_subscriber_queue_is_bounded(self):
+        subscriber = stream._AsyncSubscriber()
+        snapshot = stream.encode_event("snapshot", [])
+
+        for index in range(stream.SSE_QUEUE_SIZE + 5):
+            subscriber.push(stream.encode_event("update", [index]), snapshot)
+        await asyncio.sleep(0)
+
+        events = [subscriber.queue.get_nowait() for _ in range(subscriber.queue.qsize())]
+        self.assertLessEqual(len(events), stream.SSE_QUEUE_SIZE)
+        # Po przepełnieniu zaległe zmiany zastępuje aktualny snapshot.
+        self.assertEqual(events[0], snapshot)
+        self.assertEqual(events[-1], stream.encode_event("update", [stream.SSE_QUEUE_SIZE + 4]))
+
+    @staticmethod
+    def event_data(event):
+        return json.loads(event.split(b"\ndata: ", 1)[1])
+
+
+class SchedulingTests(TestCase):
+
+    def test_city_batch_is_stable_and_ignores_other_cities(self):
+        names = ["Gdańsk", "Kraków", "Łódź", "Poznań", "Warszawa", "Wrocław"]
+        City.objects.bulk_create([City(name=name, latitude=50.0, longitude=20.0) for name in names])
+        before = {name: utils.city_batch(name, 6) for name in names}
+
+        City.objects.create(name="Białystok", latitude=53.13, longitude=23.16)
+        City.objects.filter(name="Łódź").delete()
+
+        self.assertEqual({name: utils.city_batch(name, 6) for name in names}, before)
+        self.assertTrue(all(0 <= batch < 6 for batch in before.values()))
+
+    def test_prewarm_fills_only_shared_cache(self):
+        City.objects.create(name="Gniezno", latitude=52.53, longitude=17.6)
+        utils._forecast_cache.clear()
+
+        with mock.patch.object(utils.openmeteo_clients, "shared_cache", return_value=False), \
+                mock.patch.object(utils, "_fetch_hourly_forecast_uncached") as fetch:
+            self.assertEqual(utils.prewarm_forecasts(), 0)
+        fetch.assert_not_called()
+
+        with mock.patch.object(utils.openmeteo_clients, "shared_cache", return_value=True), \
+                mock.patch.object(utils, "_fetch_hourly_forecast_uncached") as fetch:
+            self.assertEqual(utils.prewarm_forecasts(hours=24), 1)
+        self.assertEqual(fetch.call_args.args[2], 24)
+        self.assertEqual(len(utils._forecast_cache), 0)
+
+
+class ShardLeasesTests(TestCase):
+
+    def test_city_shard_is_stable(self):
+        self.assertEqual(city_shard("Warszawa", 64), zlib.crc32("Warszawa".encode()) % 64)
+        self.assertEqual(city_shard("Warszawa", 64), city_shard("Warszawa", 64))
+
+    def test_workers_split_shards_and_rebalance(self):
+        first, second = ShardLeases(shards=8), ShardLeases(shards=8)
+        self.assertEqual(first.heartbeat(), frozenset(range(8)))
+        self.assertTrue(first.is_leader())
+
+        # Nowy worker dostaje udział dopiero, gdy poprzedni odda nadmiarowe shardy.
+        self.assertEqual(second.heartbeat(), frozenset())
+        self.assertEqual(first.heartbeat(), frozenset(range(4)))
+        self.assertEqual(second.heartbeat(), frozenset(range(4, 8)))
+        self.assertTrue(first.is_leader())
+        self.assertFalse(second.is_leader())
+
+        # Worker bez heartbeatu wypada, a jego shardy przejmuje pozostały po wygaśnięciu dzierżawy.
+        expired = timezone.now() - timedelta(seconds=1)
+        IngestWorker.objects.filter(worker_id=second.worker_id).update(heartbeat_at=expired - timedelta(minutes=5))
+        IngestShard.objects.filter(owner=second.worker_id).update(expires_at=expired)
+        self.assertEqual(first.heartbeat(), frozenset(range(8)))
+
+    def test_release_hands_shards_over_immediately(self):
+        first, second = ShardLeases(shards=4), ShardLeases(shards=4)
+        first.heartbeat()
+        second.heartbeat()
+        first.release()
+
+        self.assertEqual(first.owned(), frozenset())
+        self.assertEqual(second.heartbeat(), frozenset(range(4)))
+
+
+class WeatherFetchExclusionTests(TestCase):
+
+    def setUp(self):
+        self.cities = [
+            City.objects.create(name=name, latitude=50.0 + index, longitude=20.0)
+            for index, name in enumerate(("Bydgoszcz", "Elbląg", "Tarnów"))
+        ]
+        self.shards = {city_shard(city.name) for city in self.cities}
+        self.assertEqual(len(self.shards), 3)
+
+    def fetch_client(self, during_fetch=None):
+        def weather_api(url, params):
+            weather_api.calls.append(params["latitude"])
+            if during_fetch is not None and len(weather_api.calls) == 1:
+                during_fetch()
+            return [current_response(5.0) for _ in params["latitude"].split(",")]
+        weather_api.calls = []
+        return mock.Mock(weather_api=weather_api)
+
+    def test_web_refresh_skips_cities_fetched_by_shard_worker(self):
+        web_client = self.fetch_client()
+        worker_client = self.fetch_client(during_fetch=lambda: utils.fetch_and_save_weather_data())
+
+        with mock.patch.object(utils, "CURRENT_WEATHER_CHUNK_SIZE", 1), \
+                mock.patch.object(utils, "setup_openmeteo_client", side_effect=[worker_client, web_client]):
+            utils.fetch_and_save_weather_data(shards=self.shards)
+
+        # Odświeżanie z serwera wystartowało w trakcie pobierania workera - wszystkie shardy były zajęte.
+        self.assertEqual(len(worker_client.weather_api.calls), 3)
+        self.assertEqual(web_client.weather_api.calls, [])
+        self.assertEqual(WeatherData.objects.count(), 3)
+        self.assertFalse(IngestLock.objects.exists())
+
+    def test_shard_worker_skips_shard_locked_by_web_refresh(self):
+        busy = self.cities[0]
+        web_lock = utils._shard_lock(city_shard(busy.name))
+        self.assertTrue(web_lock.acquire())
+        client = self.fetch_client()
+
+        with mock.patch.object(utils, "setup_openmeteo_client", return_value=client):
+            utils.fetch_and_save_weather_data(shards=self.shards)
+
+        self.assertEqual(
+            set(WeatherData.objects.values_list("city__name", flat=True)), {"Elbląg", "Tarnów"}
+        )
+        self.assertTrue(utils.cities_due_for_refresh().filter(pk=busy.pk).exists())
+        web_lock.release()
+
+
+class HistoryJobTests(TestCase):
+
+    def setUp(self):
+        for index, name in enumerate(("Legnica", "Płock", "Siedlce")):
+            City.objects.create(name=name, latitude=51.0 + index, longitude=19.0)
+
+    def run_tasks(self, fetch):
+        with mock.patch.object(jobs, "openmeteo_clients"), \
+                mock.patch.object(jobs, "missing_history_ranges",
+                                  side_effect=lambda cities, start, end: {city.pk: [(start, end)] for city in cities}), \
+                mock.patch.object(jobs, "fetch_history_ranges", side_effect=fetch), \
+                mock.patch.object(jobs, "save_history_rows", return_value=UpsertResult(30, 0)) as save:
+            processed = jobs.process_history_tasks(concurrency=2)
+        return processed, save
+
+    def test_enqueue_returns_active_job(self):
+        job, created = jobs.enqueue_history_fetch()
+        again, created_again = jobs.enqueue_history_fetch()
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.pk, job.pk)
+        self.assertEqual(job.tasks.count(), 3)
+
+    def test_task_is_claimed_once_and_reclaimed_after_lease(self):
+        jobs.enqueue_history_fetch()
+        first = jobs._claim_task("worker-a")
+        others = {jobs._claim_task("worker-b").pk, jobs._claim_task("worker-b").pk}
+
+        self.assertNotIn(first.pk, others)
+        self.assertIsNone(jobs._claim_task("worker-b"))
+        self.assertEqual(HistoryFetchJob.objects.get().status, HistoryFetchJob.Status.RUNNING)
+
+        HistoryFetchTask.objects.filter(pk=first.pk).update(lease_expires_at=timezone.now())
+        reclaimed = jobs._claim_task("worker-b")
+        self.assertEqual((reclaimed.pk, reclaimed.worker, reclaimed.attempts), (first.pk, "worker-b", 2))
+        self.assertEqual(jobs._renew_task_leases("worker-a", [first.pk]), {first.pk})
+        self.assertEqual(jobs._renew_task_leases("worker-b", [first.pk]), set())
+
+    def test_task_abandoned_too_often_fails(self):
+        job, _ = jobs.enqueue_history_fetch()
+        job.tasks.update(
+            status=HistoryFetchTask.Status.RUNNING, attempts=jobs.HISTORY_TASK_MAX_ATTEMPTS,
+            lease_expires_at=timezone.now(),
+        )
+
+        self.assertIsNone(jobs._claim_task("worker-a"))
+        jobs._fail_abandoned_tasks()
+
+        self.assertEqual(set(job.tasks.values_list("status", flat=True)), {HistoryFetchTask.Status.FAILED})
+        self.assertEqual(HistoryFetchJob.objects.get().status, HistoryFetchJob.Status.DONE)
+
+    def test_process_renews_leases_of_slow_fetches(self):
+        job, _ = jobs.enqueue_history_fetch()
+
+        def slow_fetch(session, city, ranges):
+            threading.Event().wait(0.2)
+            return ["wiersz"]
+
+        with mock.patch.object(jobs, "HISTORY_TASK_RENEW_SECONDS", 0.05), \
+                mock.patch.object(jobs, "_renew_task_leases", wraps=jobs._renew_task_leases) as renew:
+            processed, save = self.run_tasks(slow_fetch)
+
+        self.assertEqual(processed, 3)
+        self.assertEqual(save.call_count, 3)
+        self.assertTrue(renew.called)
+        self.assertEqual(set(job.tasks.values_list("status", flat=True)), {HistoryFetchTask.Status.DONE})
+        self.assertEqual(HistoryFetchJob.objects.get().status, HistoryFetchJob.Status.DONE)
+
+    def test_task_taken_over_during_fetch_is_not_saved(self):
+        job, _ = jobs.enqueue_history_fetch()
+        taken = job.tasks.get(city__name="Legnica")
+
+        renew = jobs._renew_task_leases
+
+        def take_over_then_renew(worker_id, task_ids):
+            # Dzierżawa wygasła w trakcie pobierania i zadanie przejął inny worker.
+            HistoryFetchTask.objects.filter(pk=taken.pk).update(worker="inny")
+            return renew(worker_id, task_ids)
+
+        def fetch(session, city, ranges):
+            threading.Event().wait(0.2 if city.pk == taken.city_id else 0)
+            return ["wiersz"]
+
+        with mock.patch.object(jobs, "HISTORY_TASK_RENEW_SECONDS", 0.05), \
+                mock.patch.object(jobs, "_renew_task_leases", side_effect=take_over_then_renew), \
+                self.assertLogs("pogoda_app.jobs", "WARNING"):
+            processed, save = self.run_tasks(fetch)
+
+        self.assertEqual(processed, 3)
+        self.assertNotIn(taken.city_id, [call.args[0].pk for call in save.call_args_list])
+
+    def test_get_reports_latest_job_without_enqueuing(self):
+        response = self.client.get("/fetch-history-all/")
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(HistoryFetchJob.objects.exists())
+
+        with mock.patch("pogoda_app.views.process_history_tasks_in_background"):
+            job_id = self.client.post("/fetch-history-all/").json()["job_id"]
+
+        response = self.client.get("/fetch-history-all/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["job_id"], response.json()["total"]), (job_id, 3))
+        self.assertEqual(HistoryFetchJob.objects.count(), 1)
+
+
+def to_columns(rows):
+    return {key: [row[key] for row in rows] for key in rows[0]}
+
+
+class ColumnarFormatTests(TestCase):
+
+    def setUp(self):
+        compression._precompressed_cache.clear()
+        city = City.objects.create(name="Kraków", latitude=50.06, longitude=19.94)
+        WeatherData.objects.upsert([
+            reading(city, utc(2025, 1, 1, hour), temperature=float(hour), wind_speed=hour * 2.0)
+            for hour in range(4)
+        ])
+
+    def test_columnar_history_matches_rows(self):
+        rows = self.client.get("/api/pogoda/history/Kraków/")
+        columnar = self.client.get("/api/pogoda/history/Kraków/?format=columnar")
+
+        self.assertEqual(columnar.status_code, 200)
+        self.assertEqual(columnar["Content-Type"], "application/json")
+        expected = rows.json()
+        expected["history"] = to_columns(expected["history"])
+        self.assertEqual(columnar.json(), expected)
+        self.assertNotEqual(columnar["ETag"], rows["ETag"])
+
+    @skipUnless(renderers.msgpack, "msgpack nie jest zainstalowany")
+    def test_msgpack_history_matches_columnar_json(self):
+        columnar = self.client.get("/api/pogoda/history/Kraków/?format=columnar")
+        by_format = self.client.get("/api/pogoda/history/Kraków/?format=msgpack")
+        by_accept = self.client.get("/api/pogoda/history/Kraków/", HTTP_ACCEPT="application/msgpack")
+
+        for response in (by_format, by_accept):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "application/msgpack")
+            self.assertEqual(renderers.msgpack.unpackb(response.content), columnar.json())
+
+        etags = {columnar["ETag"], by_format["ETag"], self.client.get("/api/pogoda/history/Kraków/")["ETag"]}
+        self.assertEqual(len(etags), 3)
+        self.assertIn("Accept", by_accept["Vary"])
+
+    @skipUnless(renderers.msgpack, "msgpack nie jest zainstalowany")
+    def test_forecast_formats_carry_same_hours(self):
+        start = int(datetime.now(dt_timezone.utc).replace(minute=0, second=0, microsecond=0).timestamp())
+        response = forecast_response(start, [[1.5, -2.0], [0.0, 0.3], [4.0, 1.0], [70.0, 90.0]])
+        forecast = utils._parse_forecast_response(response, datetime.fromtimestamp(start, dt_timezone.utc), 2)
+
+        with mock.patch("pogoda_app.views.fetch_hourly_forecast", return_value=forecast):
+            rows = self.client.get("/api/pogoda/forecast/Kraków/?hours=2")
+            columnar = self.client.get("/api/pogoda/forecast/Kraków/?hours=2&format=columnar")
+            packed = self.client.get("/api/pogoda/forecast/Kraków/?hours=2", HTTP_ACCEPT="application/msgpack")
+
+        self.assertEqual(columnar.json()["hourly"], to_columns(rows.json()["hourly"]))
+        self.assertEqual(renderers.msgpack.unpackb(packed.content)["hourly"], columnar.json()["hourly"])
+        self.assertEqual(len({rows["ETag"], columnar["ETag"], packed["ETag"]}), 3)
+
+
+class HourlyForecastTests(SimpleTestCase):
+
+    # Sześć godzin od 10:00 UTC; okno prognozy zaczyna się o 12:00.
+    COLUMNS = [
+        [1.0, 2.0, 5.0, float("nan"), 30.0, 8.0],  # temperature
+        [0.0, 0.0, 0.5, 0.0, 0.0, 0.0],  # precipitation
+        [1.0, 1.0, 6.0, 1.0, 1.0, 1.0],  # wind_speed
+        [50.0, 50.0, 60.0, 70.0, 80.0, 50.0],  # relative_humidity
+    ]
+
+    def parse(self, hours=3, utc_offset=3600):
+        start_time = utc(2025, 1, 1, 12)
+        response = forecast_response(int(start_time.timestamp()) - 7200, self.COLUMNS, utc_offset=utc_offset)
+        return utils._parse_forecast_response(response, start_time, hours)
+
+    def test_window_starts_at_requested_hour(self):
+        forecast = self.parse()
+
+        self.assertEqual(len(forecast), 3)
+        self.assertEqual(forecast.start, int(utc(2025, 1, 1, 12).timestamp()))
+        self.assertEqual(forecast.times(), ["2025-01-01T13:00", "2025-01-01T14:00", "2025-01-01T15:00"])
+        self.assertEqual(forecast.values["precipitation"].tolist(), [0.5, 0.0, 0.0])
+
+    def test_columns_replace_nan_and_add_perceived_temperature(self):
+        columns = self.parse().columns()
+
+        self.assertEqual(
+            list(columns),
+            ["time", "temperature", "precipitation", "wind_speed", "relative_humidity", "perceived_temperature"],
+        )
+        self.assertEqual(columns["temperature"], [5.0, None, 30.0])
+        self.assertEqual(columns["perceived_temperature"], [4.4, None, 31.5])
+        self.assertEqual(columns["perceived_temperature"][0], utils.calculate_perceived_temp(5.0, 60.0, 6.0))
+
+    def test_rows_match_columns(self):
+        forecast = self.parse()
+        columns = forecast.columns()
+        rows = forecast.rows()
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1], {key: values[1] for key, values in columns.items()})
+        self.assertEqual(rows[2]["time"], "2025-01-01T15:00")
+
+    def test_slicing_shifts_start_and_rejects_steps(self):
+        forecast = self.parse()
+        tail = forecast[1:]
+
+        self.assertEqual(len(tail), 2)
+        self.assertEqual(tail.start, forecast.start + 3600)
+        self.assertEqual(tail.times(), forecast.times()[1:])
+        self.assertEqual(tail.columns()["temperature"], [None, 30.0])
+        self.assertEqual(len(forecast[:12]), 3)
+        with self.assertRaises(TypeError):
+            forecast[::2]
+        with self.assertRaises(TypeError):
+            forecast[0]
+
+    async def test_async_fetch_parses_and_caches(self):
+        utils._forecast_cache.clear()
+        city = City(name="Sopot", latitude=54.44, longitude=18.56)
+        hour = datetime.now(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+        client = mock.Mock(weather_api=mock.AsyncMock(
+            return_value=[forecast_response(int(hour.timestamp()) - 7200, self.COLUMNS, utc_offset=0)]
+        ))
+
+        with mock.patch.object(utils.openmeteo_clients, "async_client", return_value=client):
+            forecast = await utils.afetch_hourly_forecast(city, hours=3)
+            cached = await utils.afetch_hourly_forecast(city, hours=3)
+
+        client.weather_api.assert_awaited_once()
+        self.assertIs(cached, forecast)
+        self.assertEqual(forecast.start, int(hour.timestamp()))
+        self.assertEqual(forecast.columns()["perceived_temperature"], [4.4, None, 31.5])
+        self.assertEqual(client.weather_api.call_args.kwargs["params"]["hourly"].split(","),
+                         [variable for _, variable in utils.FORECAST_VARIABLES])
+
+
+class AsyncForecastViewTests(TestCase):
+
+    def setUp(self):
+        City.objects.create(name="Warszawa", latitude=52.23, longitude=21.01)
+        utils._forecast_cache.clear()
+        self.factory = AsyncRequestFactory()
+        self.view = AsyncHourlyForecastAPI.as_view()
+
+    def forecast(self, hours=3):
+        start = int(datetime.now(dt_timezone.utc).replace(minute=0, second=0, microsecond=0).timestamp())
+        response = forecast_response(start, [[5.0] * hours, [0.0] * hours, [2.0] * hours, [60.0] * hours])
+        return utils._parse_forecast_response(response, datetime.fromtimestamp(start, dt_timezone.utc), hours)
+
+    async def get(self, city_name="Warszawa", query=None, headers=None):
+        request = self.factory.get(f"/api/pogoda/forecast/{city_name}/", query or {}, headers=headers)
+        return await self.view(request, city_name=city_name)
+
+    async def test_forecast_and_revalidation(self):
+        with mock.patch.object(utils, "_afetch_hourly_forecast_uncached", return_value=self.forecast()) as fetch:
+            response = await self.get(query={"hours": 3})
+            not_modified = await self.get(query={"hours": 3}, headers={"If-None-Match": response["ETag"]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(fetch.await_count, 1)
+        body = json.loads(response.content)
+        self.assertEqual(body["city"], "Warszawa")
+        self.assertEqual([row["temperature"] for row in body["hourly"]], [5.0, 5.0, 5.0])
+        self.assertIn("Accept", response["Vary"])
+        self.assertIn("max-age=", response["Cache-Control"])
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+        self.assertEqual(not_modified.content, b"")
+
+    async def test_unknown_city_and_format(self):
+        with mock.patch.object(utils, "_afetch_hourly_forecast_uncached") as fetch:
+            missing = await self.get("Atlantyda")
+            unknown_format = await self.get(query={"format": "xml"})
+
+        fetch.assert_not_called()
+        self.assertEqual(missing.status_code, 404)
+        self.assertIn("detail", json.loads(missing.content))
+        self.assertEqual(unknown_format.status_code, 404)
+
+    async def test_concurrent_requests_share_one_upstream_fetch(self):
+        forecast = self.forecast()
+        calls = []
+
+        async def fetch(city, start_time, hours):
+            calls.append(city.name)
+            await asyncio.sleep(0.01)
+            return forecast
+
+        with mock.patch.object(utils, "_afetch_hourly_forecast_uncached", side_effect=fetch):
+            responses = await asyncio.gather(*(self.get(query={"hours": 3}) for _ in range(5)))
+
+        self.assertEqual(calls, ["Warszawa"])
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len({response.content for response in responses}), 1)
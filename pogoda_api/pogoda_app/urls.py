@@ -1,20 +1,31 @@
 
+from django.conf import settings
 from django.urls import path
 
 
+from .async_views import AsyncFetchCityHistoryAPI, AsyncHourlyForecastAPI, AsyncRefreshWeatherAPI
+from .stream import WeatherStreamAPI
 from .views import (
     LatestWeatherListAPI,
     RefreshWeatherAPI,
     CityDetailAPI,
-    HourlyForecastAPI, FetchCityHistoryAPI, FetchAllHistoryAPI,
+    HourlyForecastAPI, FetchCityHistoryAPI, FetchAllHistoryAPI, HistoryFetchJobAPI, CityStatsAPI,
 )
 
+# Pod serwerem ASGI endpointy czekające na Open-Meteo obsługują widoki asynchroniczne.
+if getattr(settings, "POGODA_ASYNC_VIEWS", False):
+    RefreshWeatherAPI, FetchCityHistoryAPI, HourlyForecastAPI = \
+        AsyncRefreshWeatherAPI, AsyncFetchCityHistoryAPI, AsyncHourlyForecastAPI
+
 urlpatterns = [
 
     path('api/pogoda/', LatestWeatherListAPI.as_view(), name='api_weather_list'),
     path('api/pogoda/refresh/', RefreshWeatherAPI.as_view(), name='api_weather_refresh'),
+    path('api/pogoda/stream/', WeatherStreamAPI.as_view(), name='api_weather_stream'),
     path('api/pogoda/history/<str:city_name>/', CityDetailAPI.as_view(), name='api_city_detail'),
+    path('api/pogoda/stats/<str:city_name>/', CityStatsAPI.as_view(), name='api_city_stats'),
     path('fetch-history/<str:city_name>/', FetchCityHistoryAPI.as_view(), name='fetch-history'),
     path('api/pogoda/forecast/<str:city_name>/', HourlyForecastAPI.as_view(), name='api_forecast'),
     path('fetch-history-all/', FetchAllHistoryAPI.as_view(), name='fetch-history-all'),
+    path('fetch-history-all/<uuid:job_id>/', HistoryFetchJobAPI.as_view(), name='fetch-history-job'),
 ]
\ No newline at end of file
@@ -1,153 +1,589 @@
 
+import asyncio
+import hashlib
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, time
+from time import sleep
 
-import openmeteo_requests
+import numpy as np
 import pytz
-import requests
-import requests_cache
-from django.db import IntegrityError
-from retry_requests import retry
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, FloatField, Min, Q, Value, When
+from django.utils import timezone
 
-from .models import City, WeatherData
+from .cache import TTLCache
+from .clients import openmeteo_clients
+from .locks import LeaseLock
+from .models import City, CityIngestState, HourlyWeatherRollup, UpsertResult, WeatherData
+from .sharding import city_shard
 
 logger = logging.getLogger(__name__)
 
+# Maksymalna liczba miast w jednym zapytaniu wielolokalizacyjnym do Open-Meteo
+# (ogranicza długość URL-a i rozmiar pojedynczej odpowiedzi).
+CURRENT_WEATHER_CHUNK_SIZE = 100
+
+
+# Cache sparsowanych prognoz godzinowych: liczba wpisów (LRU) i czas życia w sekundach.
+FORECAST_CACHE_SIZE = 256
+FORECAST_CACHE_TTL = 3600
+
+_forecast_cache = TTLCache(maxsize=FORECAST_CACHE_SIZE, ttl=FORECAST_CACHE_TTL)
+
+# Liczba równoległych zapytań przy rozgrzewaniu cache prognoz (prewarm_forecasts).
+FORECAST_PREWARM_WORKERS = 4
+
+# Po ilu sekundach bieżące odczyty uznajemy za nieaktualne (5 minut).
+WEATHER_FRESHNESS_SECONDS = 300
+
+# Przerwa przed ponowieniem pobierania dla miasta z błędami: rośnie
+# wykładniczo od BASE (po pierwszym błędzie) do MAX sekund.
+WEATHER_RETRY_BASE_SECONDS = 60
+WEATHER_RETRY_MAX_SECONDS = 3600
+
+# Blokada między procesami dla pobierania bieżącej pogody: nazwa, czas
+# dzierżawy i maksymalny czas czekania na proces, który właśnie pobiera.
+WEATHER_LOCK_NAME = "fetch_weather"
+WEATHER_LOCK_TTL = 120
+WEATHER_LOCK_WAIT = 30
+
+# Pilnuje, żeby w jednym procesie działało najwyżej jedno odświeżanie w tle.
+_background_refresh_lock = threading.Lock()
+
+
+def _chunked(items, size):
+    """Dzieli listę na kolejne paczki o długości co najwyżej `size`."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
 
 def setup_openmeteo_client():
-    """Konfiguruje klienta Open-Meteo z mechanizmem cache i retry."""
-    cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-    return openmeteo_requests.Client(session=retry(cache_session, retries=5, backoff_factor=0.2))
+    """Zwraca wspólnego dla procesu klienta Open-Meteo (pula połączeń + retry, patrz clients.py)."""
+    return openmeteo_clients.client()
+
+
+def latest_weather_age():
+    """
+    Zwraca wiek (w sekundach) najstarszego z najnowszych odczytów miast lub
+    None, gdy baza jest pusta. Czyta tylko wskaźniki City.latest_reading
+    (jeden wiersz na miasto).
+    """
+    oldest = City.objects.aggregate(oldest=Min('latest_reading__timestamp'))['oldest']
+    if oldest is None:
+        return None
+    return (datetime.now(pytz.timezone("Europe/Warsaw")) - oldest).total_seconds()
+
+
+async def alatest_weather_age():
+    """Asynchroniczny odpowiednik latest_weather_age (async ORM)."""
+    oldest = (await City.objects.aaggregate(oldest=Min('latest_reading__timestamp')))['oldest']
+    if oldest is None:
+        return None
+    return (datetime.now(pytz.timezone("Europe/Warsaw")) - oldest).total_seconds()
+
+
+def cities_due_for_refresh():
+    """
+    Miasta, których bieżące dane trzeba pobrać: bez udanego pobrania w ciągu
+    ostatnich WEATHER_FRESHNESS_SECONDS i nie czekające na ponowienie po błędzie.
+    """
+    now = timezone.now()
+    fresh_after = now - timedelta(seconds=WEATHER_FRESHNESS_SECONDS)
+
+    return City.objects.filter(
+        Q(ingest_state__isnull=True)
+        | (
+            (Q(ingest_state__last_success_at__isnull=True) | Q(ingest_state__last_success_at__lt=fresh_after))
+            & (Q(ingest_state__retry_after__isnull=True) | Q(ingest_state__retry_after__lte=now))
+        )
+    ).select_related('ingest_state')
+
+
+def _record_ingest_results(cities, errors, attempted_at):
+    """
+    Aktualizuje rejestr CityIngestState po pobieraniu: miasta spoza `errors`
+    dostają nowy `last_success_at`, a miasta z błędem - wykładniczo rosnącą
+    przerwę przed kolejną próbą.
+    """
+    states = []
+    for city in cities:
+        try:
+            state = city.ingest_state
+        except CityIngestState.DoesNotExist:
+            state = CityIngestState(city=city)
+
+        state.last_attempt_at = attempted_at
+        if city.pk in errors:
+            state.error_count += 1
+            state.last_error = str(errors[city.pk])[:500]
+            delay = min(WEATHER_RETRY_BASE_SECONDS * 2 ** (state.error_count - 1), WEATHER_RETRY_MAX_SECONDS)
+            state.retry_after = attempted_at + timedelta(seconds=delay)
+        else:
+            state.last_success_at = attempted_at
+            state.error_count = 0
+            state.last_error = ''
+            state.retry_after = None
+        states.append(state)
+
+    CityIngestState.objects.bulk_create(
+        states,
+        update_conflicts=True,
+        unique_fields=['city'],
+        update_fields=['last_attempt_at', 'last_success_at', 'error_count', 'last_error', 'retry_after'],
+    )
+
+
+def _run_background_refresh():
+    try:
+        fetch_and_save_weather_data()
+    except Exception as e:
+        logger.error("Błąd odświeżania pogody w tle: %s", e)
+    finally:
+        connection.close()
+        _background_refresh_lock.release()
 
 
-def fetch_and_save_weather_data():
+def refresh_weather_in_background():
+    """
+    Uruchamia fetch_and_save_weather_data w osobnym wątku, o ile w tym procesie
+    nie trwa już inne odświeżanie. Zwraca True, jeśli wystartowano nowy wątek.
+    """
+    if not _background_refresh_lock.acquire(blocking=False):
+        return False
+
+    try:
+        threading.Thread(target=_run_background_refresh, daemon=True).start()
+    except Exception:
+        _background_refresh_lock.release()
+        raise
+    return True
+
+
+def city_batch(city_name, batches):
+    """
+    Numer paczki miasta (0 .. batches - 1) - stały między procesami i nie
+    zmienia się, gdy dochodzą lub znikają inne miasta. Skrót inny niż
+    w city_shard, więc paczki nie są powiązane z numerami shardów.
+    """
+    digest = hashlib.blake2b(city_name.encode(), digest_size=4).digest()
+    return int.from_bytes(digest, "big") % batches
+
+
+def fetch_and_save_weather_data(batch=None, batches=1, shards=None):
     """
     Pobiera dane pogodowe dla wszystkich miast z tabeli City i zapisuje je
-    jako nowe odczyty w tabeli WeatherData.
+    jako nowe odczyty w tabeli WeatherData. Z `batch` - tylko dla miast
+    z paczki o tym numerze (z `batches` paczek, patrz city_batch).
+
+    Pobierane są tylko miasta, których dane są nieaktualne (< 5 minut od
+    ostatniego udanego pobrania to dane świeże) - patrz CityIngestState.
+    Miasta, dla których pobieranie się nie udaje, są ponawiane z rosnącą przerwą.
+
+    Pobieranie chroni blokada w bazie (LeaseLock) - w danej chwili pobiera
+    tylko jeden proces serwera. Pozostałe czekają chwilę na jego koniec
+    i korzystają z zapisanych przez niego danych, zamiast powtarzać pobieranie.
 
-    ZMIANA: Sprawdza, czy dane w bazie są świeże (< 5 minut).
-    Jeśli tak, pomija pobieranie z zewnętrznego API.
+    Z `shards` (zbiór numerów shardów dzierżawionych przez worker schedulera,
+    patrz sharding.py) pobierane są tylko miasta z tych shardów - workery
+    pobierają równolegle, bez blokady globalnej.
+
+    Obie ścieżki biorą dodatkowo blokady shardów miast (_lock_city_shards):
+    miasto pobiera albo odświeżanie z serwera, albo worker schedulera -
+    shardy zajęte przez drugą stronę są pomijane.
     """
 
+    if shards is not None:
+        cities_to_fetch = _cities_to_refresh(batch, batches, shards)
+        if cities_to_fetch:
+            _fetch_locked_shards(cities_to_fetch)
+        return
+
     # --- 1. SPRAWDZENIE ŚWIEŻOŚCI DANYCH (CACHE LOGIC) ---
-    last_reading = WeatherData.objects.order_by('-timestamp').first()
+    if not _cities_to_refresh(batch, batches):
+        return
+
+    lock = LeaseLock(WEATHER_LOCK_NAME, ttl=WEATHER_LOCK_TTL)
+    if not lock.acquire():
+        logger.info("🔒 Inny proces pobiera już pogodę. Czekam na jego wynik...")
+        if not lock.wait_released(timeout=WEATHER_LOCK_WAIT):
+            logger.warning("⌛ Nie doczekano się końca pobierania w innym procesie.")
+        return
 
-    if last_reading:
-        # Pobieramy aktualny czas w tej samej strefie co dane w bazie
-        tz = pytz.timezone("Europe/Warsaw")
-        now = datetime.now(tz)
+    try:
+        # Sprawdzamy ponownie - inny proces mógł zapisać dane tuż przed nami.
+        cities_to_fetch = _cities_to_refresh(batch, batches)
+        if cities_to_fetch:
+            _fetch_locked_shards(cities_to_fetch, [lock])
+    finally:
+        lock.release()
 
-        # Obliczamy różnicę czasu
-        time_difference = now - last_reading.timestamp
 
-        # 300 sekund = 5 minut
-        if time_difference.total_seconds() < 300:
-            logger.info(f"⏳ Dane są świeże (sprzed {int(time_difference.total_seconds())}s). Pomijam zewnętrzne API.")
-            return  # <--- PRZERYWAMY FUNKCJĘ TUTAJ, nie wykonujemy requestu do OpenMeteo
-        else:
-            logger.info(f"🔄 Dane są przestarzałe (sprzed {int(time_difference.total_seconds())}s). Pobieram nowe...")
+def _shard_lock(shard):
+    return LeaseLock(f"{WEATHER_LOCK_NAME}:shard:{shard}", ttl=WEATHER_LOCK_TTL)
+
+
+def _lock_city_shards(cities):
+    """
+    Przejmuje (bez czekania) blokady shardów, do których należą `cities`.
+    Zwraca {numer shardu: blokada} - shardy zajęte przez inny proces pomijamy.
+    """
+    locks = {}
+    for shard in sorted({city_shard(city.name) for city in cities}):
+        lock = _shard_lock(shard)
+        if lock.acquire():
+            locks[shard] = lock
+    return locks
+
+
+def _fetch_locked_shards(cities, held_locks=()):
+    """
+    Pobiera te z `cities`, których shardy udało się zablokować (`held_locks` -
+    blokady już trzymane, odnawiane razem z blokadami shardów). Pod blokadami
+    świeżość sprawdzana jest ponownie - proces, który trzymał shard przed
+    nami, mógł właśnie zapisać dane.
+    """
+    shard_locks = _lock_city_shards(cities)
+    try:
+        due = set(cities_due_for_refresh().filter(pk__in=[city.pk for city in cities]).values_list("pk", flat=True))
+        cities_to_fetch = [city for city in cities if city_shard(city.name) in shard_locks and city.pk in due]
+        if cities_to_fetch:
+            _fetch_and_save_weather_data(cities_to_fetch, [*held_locks, *shard_locks.values()])
+        elif not shard_locks:
+            logger.info("🔒 Miasta do pobrania pobiera już inny proces.")
+    finally:
+        for lock in shard_locks.values():
+            lock.release()
+
+
+def _cities_to_refresh(batch=None, batches=1, shards=None):
+    """Zwraca listę miast (z paczki `batch`, ze `shards`) do pobrania i loguje stan świeżości danych."""
+    cities = list(cities_due_for_refresh())
+    scope = ""
+    if shards is not None:
+        cities = [city for city in cities if city_shard(city.name) in shards]
+        scope = f" w {len(shards)} shardach"
+    if batch is not None:
+        cities = [city for city in cities if city_batch(city.name, batches) == batch]
+        scope += f" (paczka {batch + 1}/{batches})"
+
+    if cities:
+        logger.info(f"🔄 Nieaktualne dane dla {len(cities)} miast{scope}. Pobieram nowe...")
     else:
-        logger.info("🆕 Pusta baza danych. Pobieram pierwsze dane...")
+        logger.info("⏳ Dane wszystkich miast są świeże (lub czekają na ponowienie). Pomijam zewnętrzne API.")
+    return cities
+
+
+def _lease_lost(locks):
+    """Odnawia dzierżawy `locks`. True, gdy którąś z blokad przejął inny proces."""
+    for lock in locks:
+        if not lock.renew():
+            logger.warning(
+                f"⚠️ Blokada {lock.name} wygasła i przejął ją inny proces - przerywam pobieranie bez zapisu."
+            )
+            return True
+    return False
 
-    # --- 2. SETUP KLIENTA I POBIERANIE (BEZ ZMIAN) ---
-    cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
 
-    cities_to_fetch = City.objects.all()
+def _fetch_and_save_weather_data(cities_to_fetch, locks=()):
+    """
+    Właściwe pobranie i zapis bieżącej pogody (wywoływane pod blokadami `locks`).
+
+    Dzierżawy blokad są odnawiane przed każdą paczką i przed jej zapisem -
+    wolne API nie wydłuży pobierania poza dzierżawę. Jeśli mimo to którąś
+    blokadę przejął inny proces, pobieranie kończy się bez zapisu kolejnych paczek.
+    """
+    # --- 2. KLIENT (wspólna pula połączeń) I POBIERANIE ---
+    openmeteo = setup_openmeteo_client()
+
     url = "https://api.open-meteo.com/v1/forecast"
     czas_pl = datetime.now(pytz.timezone("Europe/Warsaw"))
+    errors = {}
+    processed = []
 
     logger.info(f"--- Start pobierania bieżącej pogody: {czas_pl.strftime('%H:%M:%S')} ---")
 
-    for city_obj in cities_to_fetch:
+    # Open-Meteo przyjmuje listy współrzędnych rozdzielone przecinkami i zwraca
+    # jedną odpowiedź na lokalizację (w tej samej kolejności), więc zamiast
+    # jednego zapytania na miasto wysyłamy jedno zapytanie na paczkę miast.
+    for chunk in _chunked(cities_to_fetch, CURRENT_WEATHER_CHUNK_SIZE):
+        if _lease_lost(locks):
+            break
+        processed.extend(chunk)
+
         params = {
-            "latitude": city_obj.latitude,
-            "longitude": city_obj.longitude,
+            "latitude": ",".join(str(city_obj.latitude) for city_obj in chunk),
+            "longitude": ",".join(str(city_obj.longitude) for city_obj in chunk),
             "current": "temperature_2m,precipitation,windspeed_10m,relative_humidity_2m",
         }
 
         try:
             responses = openmeteo.weather_api(url, params=params)
-            response = responses[0]
-            current = response.Current()
-            temp = current.Variables(0).Value()
-            precipitation = current.Variables(1).Value()
-            wind_speed = current.Variables(2).Value()
-            relative_humidity = current.Variables(3).Value()
-
-            WeatherData.objects.create(
+        except Exception as e:
+            logger.error(f"  ❌ Błąd pobierania paczki {len(chunk)} miast: {e}")
+            errors.update((city_obj.pk, e) for city_obj in chunk)
+            continue
+
+        readings = []
+        for city_obj, response in zip(chunk, responses):
+            try:
+                current = response.Current()
+                temp = current.Variables(0).Value()
+                precipitation = current.Variables(1).Value()
+                wind_speed = current.Variables(2).Value()
+                relative_humidity = current.Variables(3).Value()
+            except Exception as e:
+                logger.error(f"  ❌ Błąd dla {city_obj.name}: {e}")
+                errors[city_obj.pk] = e
+                continue
+
+            readings.append(WeatherData(
                 city=city_obj,
                 temperature=temp,
                 precipitation=precipitation,
                 wind_speed=wind_speed,
                 relative_humidity=relative_humidity,
                 timestamp=czas_pl
-            )
+            ))
             logger.info(f"  ✅ {city_obj.name} | {temp:.1f}°C")
 
+        if len(responses) != len(chunk):
+            logger.error(f"  ❌ API zwróciło {len(responses)} odpowiedzi dla {len(chunk)} miast.")
+            errors.update(
+                (city_obj.pk, "Brak odpowiedzi API dla miasta") for city_obj in chunk[len(responses):]
+            )
+
+        if _lease_lost(locks):
+            del processed[-len(chunk):]
+            break
+
+        try:
+            result = WeatherData.objects.upsert(readings)
+            logger.info(f"  💾 Zapisano paczkę: nowe {result.inserted}, zaktualizowane {result.updated}")
         except Exception as e:
-            logger.error(f"  ❌ Błąd dla {city_obj.name}: {e}")
+            logger.error(f"  ❌ Błąd zapisu paczki {len(readings)} odczytów: {e}")
+            errors.update((reading.city_id, e) for reading in readings)
+
+    _record_ingest_results(processed, errors, czas_pl)
+    openmeteo_clients.log_stats()
+
+    logger.info(f"--- Koniec pobierania. Błędy: {len(errors)} z {len(processed)} miast. ---")
+
+
+# Zmienne prognozy (klucz w odpowiedzi, zmienna Open-Meteo) w kolejności
+# z zapytania (parametr "hourly") - to także kolejność kolumn po "time".
+FORECAST_VARIABLES = (
+    ("temperature", "temperature_2m"),
+    ("precipitation", "precipitation"),
+    ("wind_speed", "wind_speed_10m"),
+    ("relative_humidity", "relative_humidity_2m"),
+)
+
+# Open-Meteo podaje wartości z dokładnością do 0.1 - float32 z FlatBuffers
+# zaokrąglamy przy renderowaniu, żeby nie zwracać np. 1.2000000476837158.
+FORECAST_DECIMALS = 2
+
+
+class HourlyForecast:
+    """
+    Prognoza godzinowa w układzie kolumnowym.
+
+    Wartości to tablice NumPy będące widokami na bufor FlatBuffers odpowiedzi
+    Open-Meteo (bez kopiowania), a czas to początek, krok i liczba godzin.
+    Słowniki / listy powstają dopiero przy renderowaniu (`rows()`, `columns()`).
+    """
+
+    def __init__(self, start, interval, utc_offset, values):
+        self.start = start  # unix timestamp (UTC) pierwszej godziny
+        self.interval = interval  # krok w sekundach
+        self.utc_offset = utc_offset  # przesunięcie strefy czasowej prognozy
+        self.values = values  # klucz -> tablica NumPy
+
+    def __len__(self):
+        return min((len(column) for column in self.values.values()), default=0)
+
+    def __getitem__(self, index):
+        """Wycinek godzin (np. forecast[:12]) - także bez kopiowania."""
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError("HourlyForecast obsługuje tylko wycinki z krokiem 1")
+        first, _, _ = index.indices(len(self))
+        return HourlyForecast(
+            self.start + first * self.interval,
+            self.interval,
+            self.utc_offset,
+            {key: column[index] for key, column in self.values.items()},
+        )
+
+    def times(self):
+        """Czas lokalny godzin w formacie Open-Meteo ("2025-01-01T12:00")."""
+        seconds = self.start + self.utc_offset + np.arange(len(self), dtype=np.int64) * self.interval
+        return np.datetime_as_string(seconds.astype("datetime64[s]"), unit="m").tolist()
+
+    def columns(self):
+        """
+        Słownik {klucz: lista wartości}: "time", FORECAST_VARIABLES
+        i "perceived_temperature" (NaN -> None).
+        """
+        size = len(self)
+        columns = {"time": self.times()}
+        for key, column in self.values.items():
+            column = column[:size].astype(np.float64).round(FORECAST_DECIMALS)
+            columns[key] = [None if value != value else value for value in column.tolist()]
+        return columns
+
+    def rows(self):
+        """Lista słowników - jedna godzina na słownik."""
+        columns = self.columns()
+        keys = tuple(columns)
+        return [dict(zip(keys, row)) for row in zip(*columns.values())]
 
-    logger.info("--- Koniec pobierania. ---")
 
 def fetch_hourly_forecast(city, hours=48):
     """
     Pobiera prognozę godzinową dla danego miasta od aktualnej godziny.
-    Zwraca listę słowników z danymi godzinowymi.
+    Zwraca HourlyForecast (kolumny NumPy).
+
+    Prognozy trzymane są w cache procesu (klucz: miasto, pełna godzina, liczba
+    godzin) - Open-Meteo aktualizuje je co godzinę. Równoczesne zapytania
+    o to samo miasto kończą się jednym zapytaniem do API.
     """
+    start_time = datetime.now(pytz.timezone("Europe/Warsaw")).replace(minute=0, second=0, microsecond=0)
+
+    return _forecast_cache.get_or_compute(
+        (city.name, start_time, hours),
+        lambda: _fetch_hourly_forecast_uncached(city, start_time, hours),
+    )
+
 
+def prewarm_forecasts(hours=48, workers=FORECAST_PREWARM_WORKERS, shards=None):
+    """
+    Pobiera prognozy wszystkich miast (lub miast ze `shards`) na bieżącą
+    godzinę, zanim zapytają o nie użytkownicy. Zapełnia tylko wspólny cache
+    Open-Meteo (http_cache, wpis prognozy żyje godzinę), z którego korzystają
+    procesy serwera - cache procesu schedulera nikomu by się nie przydał.
+    Bez cache współdzielonego (backend "memory" lub brak) nic nie robi.
+    Zwraca liczbę pobranych prognoz.
+    """
+    if not openmeteo_clients.shared_cache():
+        logger.info("⏭️ Rozgrzewanie prognoz pominięte - cache Open-Meteo nie jest współdzielony przez procesy.")
+        return 0
 
+    cities = list(City.objects.all())
+    if shards is not None:
+        cities = [city for city in cities if city_shard(city.name) in shards]
     start_time = datetime.now(pytz.timezone("Europe/Warsaw")).replace(minute=0, second=0, microsecond=0)
-    end_time = start_time + timedelta(hours=hours)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_fetch_hourly_forecast_uncached, city, start_time, hours) for city in cities]
+    fetched = sum(1 for future in futures if future.exception() is None)
 
-    url = "https://api.open-meteo.com/v1/forecast"
+    logger.info(f"🔥 Rozgrzano cache prognoz: {fetched} z {len(cities)} miast")
+    return fetched
 
-    params = {
+
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+
+# Zapytania prognozy z widoków asynchronicznych w toku: (pętla, klucz cache) -> Task.
+_forecast_tasks = {}
+
+
+def _forecast_params(city, start_time, hours):
+    """Parametry zapytania prognozy godzinowej od `start_time` przez `hours` godzin."""
+    end_time = start_time + timedelta(hours=hours - 1)
+
+    # start_hour / end_hour (włącznie) ograniczają odpowiedź do żądanych godzin,
+    # zamiast pełnych dni od północy.
+    return {
         "latitude": city.latitude,
         "longitude": city.longitude,
-        "hourly": "temperature_2m,precipitation,wind_speed_10m,relative_humidity_2m",
+        "hourly": ",".join(variable for _, variable in FORECAST_VARIABLES),
         "timezone": "Europe/Warsaw",
-        "start_date": start_time.strftime("%Y-%m-%d"),  # Zmieniono 'start' na 'start_date' w zapytaniu API Open-Meteo
-        "end_date": end_time.strftime("%Y-%m-%d"),  # Zmieniono 'end' na 'end_date'
-        "time_start": start_time.strftime("%Y-%m-%dT%H:00"),  # Dodano precyzyjne limity godzinowe
-        "time_end": end_time.strftime("%Y-%m-%dT%H:00"),
+        "start_hour": start_time.strftime("%Y-%m-%dT%H:00"),
+        "end_hour": end_time.strftime("%Y-%m-%dT%H:00"),
     }
 
-    try:
-        r = requests.get(url, params=params, timeout=30)
-        r.raise_for_status()
-        data = r.json()
 
-        hourly = data.get("hourly", {})
-        times = hourly.get("time", [])
-        temperatures = hourly.get("temperature_2m", [])
-        precipitation = hourly.get("precipitation", [])
-        wind_speed = hourly.get("wind_speed_10m", [])
-        relative_humidity = hourly.get("relative_humidity_2m", [])
+def _parse_forecast_response(response, start_time, hours):
+    """Odpowiedź FlatBuffers -> HourlyForecast (widoki NumPy na okno godzin)."""
+    hourly = response.Hourly()
+    interval = hourly.Interval() or 3600
 
-        forecast_data = []
-        for i in range(len(times)):
-            if i >= hours:
-                break
+    # Gdyby API zwróciło godziny sprzed start_time, pomijamy je indeksem.
+    first = max(0, (int(start_time.timestamp()) - hourly.Time()) // interval)
+    window = slice(first, first + hours)
 
-            forecast_data.append({
-                "time": times[i],
-                "temperature": temperatures[i],
-                "precipitation": precipitation[i],
-                "wind_speed": wind_speed[i],
-                "relative_humidity": relative_humidity[i]
-            })
+    values = {}
+    for index, (key, _) in enumerate(FORECAST_VARIABLES):
+        column = hourly.Variables(index).ValuesAsNumpy()
+        values[key] = column[window] if isinstance(column, np.ndarray) else np.empty(0, dtype=np.float32)
 
-        return forecast_data
+    # Jedyna kolumna liczona, a nie widok na bufor - raz na prognozę, dla wszystkich godzin naraz.
+    size = min(len(column) for column in values.values())
+    values["perceived_temperature"] = calculate_perceived_temp_batch(
+        values["temperature"][:size], values["relative_humidity"][:size], values["wind_speed"][:size]
+    )
 
-    except requests.exceptions.RequestException as e:
-        logger.error("❌ Błąd żądania API dla prognozy dla %s: %s", city.name, e)
+    return HourlyForecast(hourly.Time() + first * interval, interval, response.UtcOffsetSeconds(), values)
 
+
+def _fetch_hourly_forecast_uncached(city, start_time, hours):
+    """Pobiera prognozę godzinową z Open-Meteo (FlatBuffers) z pominięciem cache."""
+    try:
+        response = setup_openmeteo_client().weather_api(
+            FORECAST_URL, params=_forecast_params(city, start_time, hours)
+        )[0]
+        return _parse_forecast_response(response, start_time, hours)
+
+    except Exception as e:
+        logger.error("❌ Błąd pobierania prognozy dla %s: %s", city.name, e)
         raise Exception(f"Błąd API: {e}")
+
+
+async def afetch_hourly_forecast(city, hours=48):
+    """
+    Asynchroniczny odpowiednik fetch_hourly_forecast (widoki ASGI) - ten sam
+    cache procesu. Równoczesne chybienia dla tego samego klucza w jednej pętli
+    zdarzeń czekają na jedno zapytanie do API.
+    """
+    start_time = datetime.now(pytz.timezone("Europe/Warsaw")).replace(minute=0, second=0, microsecond=0)
+    key = (city.name, start_time, hours)
+
+    forecast = _forecast_cache.get(key)
+    if forecast is not None:
+        return forecast
+
+    task_key = (asyncio.get_running_loop(), key)
+    task = _forecast_tasks.get(task_key)
+    if task is None:
+        task = asyncio.ensure_future(_afetch_hourly_forecast_uncached(city, start_time, hours))
+        _forecast_tasks[task_key] = task
+        task.add_done_callback(lambda _: _forecast_tasks.pop(task_key, None))
+
+    forecast = await asyncio.shield(task)
+    _forecast_cache.set(key, forecast)
+    return forecast
+
+
+async def _afetch_hourly_forecast_uncached(city, start_time, hours):
+    try:
+        responses = await openmeteo_clients.async_client().weather_api(
+            FORECAST_URL, params=_forecast_params(city, start_time, hours)
+        )
+        return _parse_forecast_response(responses[0], start_time, hours)
+
     except Exception as e:
-        logger.error("❌ Nieoczekiwany błąd pobierania prognozy dla %s: %s", city.name, e)
-        raise e
+        logger.error("❌ Błąd pobierania prognozy dla %s: %s", city.name, e)
+        raise Exception(f"Błąd API: {e}")
+
+
+# Progi uproszczonej temperatury odczuwalnej (wspólne dla wszystkich wariantów).
+WIND_CHILL_MAX_TEMP = 10
+WIND_CHILL_MIN_WIND = 3
+WIND_CHILL_FACTOR = 0.2
+HEAT_INDEX_MIN_TEMP = 25
+HEAT_INDEX_MIN_HUMIDITY = 50
+
 
 def calculate_perceived_temp(temp, humidity, wind_speed):
     """
@@ -156,43 +592,94 @@ def calculate_perceived_temp(temp, humidity, wind_speed):
     1. Jeśli temp jest poniżej 10C, używa prostego Wind Chill (wiatr obniża temp.)
     2. Jeśli temp jest powyżej 25C, używa prostego Heat Index (wilgotność podnosi temp.)
     3. W przeciwnym razie zwraca temperaturę powietrza.
+
+    Wersje zbiorcze: perceived_temperature_expression (w bazie, jako adnotacja
+    querysetu) oraz calculate_perceived_temp_batch (NumPy).
     """
     if temp is None:
         return None
 
     # Uproszczona korekta na zimno (Wind Chill):
-    if temp < 10 and  wind_speed > 3:
+    if temp < WIND_CHILL_MAX_TEMP and wind_speed is not None and wind_speed > WIND_CHILL_MIN_WIND:
         # Uproszczona formuła: obniżenie temp. jest proporcjonalne do prędkości wiatru
-        wind_factor = (wind_speed - 3) * 0.2
+        wind_factor = (wind_speed - WIND_CHILL_MIN_WIND) * WIND_CHILL_FACTOR
         return temp - wind_factor
 
     # Uproszczona korekta na gorąco (Heat Index): wilgotność podnosi temperaturę powyżej 25°C
-    if temp > 25 and  humidity > 50:
+    if temp > HEAT_INDEX_MIN_TEMP and humidity is not None and humidity > HEAT_INDEX_MIN_HUMIDITY:
         # Uproszczona formuła: podniesienie temp. proporcjonalne do wilgotności
-        humidity_factor = (humidity - 50) / 10 * 0.5
+        humidity_factor = (humidity - HEAT_INDEX_MIN_HUMIDITY) / 10 * 0.5
         return temp + humidity_factor
 
     return temp
 
 
+def perceived_temperature_expression(prefix=""):
+    """
+    Te same reguły co calculate_perceived_temp, jako wyrażenie Case/When do
+    adnotacji querysetu - baza liczy temperaturę odczuwalną dla wszystkich
+    wierszy naraz. `prefix` pozwala wskazać pola przez relację (np. "latest_reading__").
+    """
+    temp = F(f"{prefix}temperature")
+    humidity = F(f"{prefix}relative_humidity")
+    wind = F(f"{prefix}wind_speed")
+
+    return Case(
+        When(
+            **{f"{prefix}temperature__lt": WIND_CHILL_MAX_TEMP, f"{prefix}wind_speed__gt": WIND_CHILL_MIN_WIND},
+            then=temp - (wind - Value(WIND_CHILL_MIN_WIND)) * Value(WIND_CHILL_FACTOR),
+        ),
+        When(
+            **{
+                f"{prefix}temperature__gt": HEAT_INDEX_MIN_TEMP,
+                f"{prefix}relative_humidity__gt": HEAT_INDEX_MIN_HUMIDITY,
+            },
+            then=temp + (humidity - Value(HEAT_INDEX_MIN_HUMIDITY)) / Value(10.0) * Value(0.5),
+        ),
+        default=temp,
+        output_field=FloatField(),
+    )
+
+
+def calculate_perceived_temp_batch(temps, humidity, wind_speed):
+    """
+    Wektorowa (NumPy) wersja calculate_perceived_temp dla całych tablic
+    odczytów. Brakujące wartości (None / NaN) wiatru i wilgotności nie
+    uruchamiają korekty; brak temperatury daje NaN.
+    """
+    temps = np.asarray(temps, dtype=float)
+    humidity = np.asarray(humidity, dtype=float)
+    wind_speed = np.asarray(wind_speed, dtype=float)
+
+    with np.errstate(invalid="ignore"):
+        wind_chill = (temps < WIND_CHILL_MAX_TEMP) & (wind_speed > WIND_CHILL_MIN_WIND)
+        heat_index = ~wind_chill & (temps > HEAT_INDEX_MIN_TEMP) & (humidity > HEAT_INDEX_MIN_HUMIDITY)
+
+    perceived = temps.copy()
+    perceived[wind_chill] = temps[wind_chill] - (wind_speed[wind_chill] - WIND_CHILL_MIN_WIND) * WIND_CHILL_FACTOR
+    perceived[heat_index] = temps[heat_index] + (humidity[heat_index] - HEAT_INDEX_MIN_HUMIDITY) / 10 * 0.5
+    return perceived
+
+
 def generate_weather_recommendation(hourly_data):
     """
-    Analizuje dane godzinowe i zwraca tekstową rekomendację (string).
+    Analizuje prognozę godzinową (HourlyForecast) i zwraca tekstową rekomendację (string).
     Bierzemy pod uwagę np. pierwsze 12 godzin prognozy.
     """
-    if not hourly_data:
+    if not len(hourly_data):
         return "Brak danych do wygenerowania rekomendacji."
 
     # Analizujemy np. najbliższe 12 godzin (lub mniej, jeśli danych jest mniej)
     check_range = hourly_data[:12]
+    values = check_range.values
 
-    will_rain = any(h['precipitation'] > 0.0 for h in check_range)
+    will_rain = bool((values["precipitation"] > 0.0).any())
     # Przyjmijmy, że silny wiatr to > 10 m/s (~36 km/h)
-    strong_wind = any(h['wind_speed'] > 10.0 for h in check_range)
+    strong_wind = bool((values["wind_speed"] > 10.0).any())
 
-    temps = [h['temperature'] for h in check_range]
-    min_temp = min(temps) if temps else 0
-    max_temp = max(temps) if temps else 0
+    temps = values["temperature"]
+    min_temp = float(np.nanmin(temps)) if len(temps) else 0
+    max_temp = float(np.nanmax(temps)) if len(temps) else 0
 
     recs = []
 
@@ -215,18 +702,23 @@ def generate_weather_recommendation(hourly_data):
     return " ".join(recs)
 
 
-def fetch_and_save_last_30_days(city):
-    """
-    Pobiera dane dzienne z ostatnich 30 dni i zapisuje je do tabeli WeatherData.
-    Ponieważ WeatherData wymaga czasu, ustawiamy godzinę na 12:00 dla każdego dnia.
-    """
-    # Zakres dat: od wczoraj do 30 dni wstecz
-    end_date = datetime.now().date() - timedelta(days=1)
-    start_date = end_date - timedelta(days=29)
+HISTORY_ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/era5"
+
+# Ile zapytań do archiwum ERA5 może być w locie jednocześnie przy masowym
+# pobieraniu historii (nie więcej niż POGODA_OPENMETEO_POOL_MAXSIZE).
+HISTORY_FETCH_CONCURRENCY = 8
+
+# Ile ostatnich dni okna historii pobieramy ponownie mimo że są w bazie
+# (dane ERA5 z ostatniej doby bywają niepełne).
+HISTORY_REFRESH_DAYS = 1
+
+# Luki oddzielone najwyżej tyloma zapisanymi dniami łączymy w jedno zapytanie.
+HISTORY_MERGE_GAP_DAYS = 2
 
-    url = "https://archive-api.open-meteo.com/v1/era5"
 
-    params = {
+def _history_params(city, start_date, end_date):
+    """Buduje parametry zapytania do archiwum ERA5 dla danego miasta i zakresu dat."""
+    return {
         "latitude": city.latitude,
         "longitude": city.longitude,
         "start_date": start_date.strftime("%Y-%m-%d"),
@@ -236,77 +728,326 @@ def fetch_and_save_last_30_days(city):
         "timezone": "Europe/Warsaw"
     }
 
-    try:
-        r = requests.get(url, params=params, timeout=30)
+
+def last_30_days_range():
+    """Zakres dat: od wczoraj do 30 dni wstecz."""
+    end_date = datetime.now().date() - timedelta(days=1)
+    start_date = end_date - timedelta(days=29)
+    return start_date, end_date
+
+
+def _history_timestamp(date_obj):
+    """Dzienny odczyt historyczny zapisujemy o północy czasu polskiego."""
+    return pytz.timezone("Europe/Warsaw").localize(datetime.combine(date_obj, time(0, 0)))
+
+
+def _merge_dates_into_ranges(dates, max_gap_days=0):
+    """
+    Skleja posortowane daty w przedziały (start, koniec). Daty oddzielone
+    co najwyżej `max_gap_days` dniami już zapisanymi trafiają do jednego
+    przedziału - jedno dłuższe zapytanie jest tańsze niż kilka krótkich.
+    """
+    ranges = []
+    for date_obj in dates:
+        if ranges and (date_obj - ranges[-1][1]).days <= max_gap_days + 1:
+            ranges[-1][1] = date_obj
+        else:
+            ranges.append([date_obj, date_obj])
+    return [(range_start, range_end) for range_start, range_end in ranges]
+
+
+def missing_history_ranges(cities, start_date, end_date):
+    """
+    Dla każdego miasta zwraca listę przedziałów dat (start, koniec), których
+    brakuje w bazie lub które są nieostateczne i trzeba je pobrać ponownie.
+
+    Zapisane dni dla wszystkich miast odczytywane są jednym zapytaniem.
+    Ostatnie HISTORY_REFRESH_DAYS dni okna zawsze uznajemy za nieaktualne,
+    bo archiwum ERA5 uzupełnia je z opóźnieniem.
+    """
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    timestamps = {_history_timestamp(day): day for day in days}
+    refresh_from = end_date - timedelta(days=HISTORY_REFRESH_DAYS - 1)
+
+    stored = {city.pk: set() for city in cities}
+    existing = WeatherData.objects.filter(
+        city__in=cities,
+        timestamp__in=list(timestamps),
+        source=WeatherData.Source.HISTORY,
+    ).values_list("city_id", "timestamp").order_by()
+    for city_id, timestamp in existing:
+        stored[city_id].add(timestamps[timestamp])
+
+    return {
+        city.pk: _merge_dates_into_ranges(
+            [day for day in days if day not in stored[city.pk] or day >= refresh_from],
+            max_gap_days=HISTORY_MERGE_GAP_DAYS,
+        )
+        for city in cities
+    }
+
+
+def _parse_daily_history(data):
+    """
+    Zamienia odpowiedź archiwum (JSON) na listę krotek
+    (timestamp, temperatura, opady, wiatr, wilgotność).
+    """
+    daily = data.get("daily", {})
+
+    dates = daily.get("time", [])
+    temps = daily.get("temperature_2m_mean", [])
+    precip = daily.get("precipitation_sum", [])
+    winds = daily.get("wind_speed_10m_max", [])
+    humid = daily.get("relative_humidity_2m_mean", [])  # Wilgotność
+
+    rows = []
+
+    for i, date_str in enumerate(dates):
+
+        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+
+
+        aware_datetime = _history_timestamp(date_obj)
+
+
+        t = temps[i] if i < len(temps) and temps[i] is not None else 0.0
+        p = precip[i] if i < len(precip) and precip[i] is not None else 0.0
+        w = winds[i] if i < len(winds) and winds[i] is not None else 0.0
+        h = humid[i] if i < len(humid) and humid[i] is not None else 50.0
+
+        rows.append((aware_datetime, t, p, w, h))
+
+    return rows
+
+
+def save_history_rows(city, rows):
+    """
+    Zapisuje sparsowane dni historii do tabeli WeatherData jednym upsertem.
+    Zwraca UpsertResult (liczba nowych i zaktualizowanych dni).
+    """
+    return WeatherData.objects.upsert([
+        WeatherData(
+            city=city,
+            timestamp=aware_datetime,
+            temperature=t,
+            precipitation=p,
+            wind_speed=w,
+            relative_humidity=h,
+            source=WeatherData.Source.HISTORY,
+        )
+        for aware_datetime, t, p, w, h in rows
+    ])
+
+
+def fetch_history_ranges(session, city, ranges):
+    """Pobiera i parsuje historię miasta dla podanych przedziałów dat."""
+    rows = []
+    for range_start, range_end in ranges:
+        r = session.get(HISTORY_ARCHIVE_URL, params=_history_params(city, range_start, range_end), timeout=30)
         r.raise_for_status()
-        data = r.json()
-        daily = data.get("daily", {})
+        rows.extend(_parse_daily_history(r.json()))
+    return rows
 
-        dates = daily.get("time", [])
-        temps = daily.get("temperature_2m_mean", [])
-        precip = daily.get("precipitation_sum", [])
-        winds = daily.get("wind_speed_10m_max", [])
-        humid = daily.get("relative_humidity_2m_mean", [])  # Wilgotność
 
-        if not dates:
-            logger.warning(f"Brak danych historycznych dla {city.name}")
-            return False
+def fetch_and_save_last_30_days(city):
+    """
+    Pobiera dane dzienne z ostatnich 30 dni i zapisuje je do tabeli WeatherData.
+    Ponieważ WeatherData wymaga czasu, ustawiamy godzinę na 12:00 dla każdego dnia.
+    Z archiwum pobierane są tylko brakujące (lub nieaktualne) dni.
+    Zwraca UpsertResult (nowe / zaktualizowane dni) lub False, gdy brak danych.
+    """
+    start_date, end_date = last_30_days_range()
+    ranges = missing_history_ranges([city], start_date, end_date)[city.pk]
 
+    if not ranges:
+        logger.info(f"⏳ Historia 30 dni dla {city.name} jest kompletna. Pomijam zewnętrzne API.")
+        return UpsertResult(0, 0)
 
-        tz = pytz.timezone("Europe/Warsaw")
+    try:
+        rows = fetch_history_ranges(openmeteo_clients.session(), city, ranges)
 
-        for i, date_str in enumerate(dates):
+        if not rows:
+            logger.warning(f"Brak danych historycznych dla {city.name}")
+            return False
 
-            date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+        result = save_history_rows(city, rows)
 
+        logger.info(
+            f"✅ Zaktualizowano historię (WeatherData) 30 dni dla: {city.name} "
+            f"(nowe: {result.inserted}, zaktualizowane: {result.updated})"
+        )
+        return result
 
-            naive_datetime = datetime.combine(date_obj, time(0, 0))
-            aware_datetime = tz.localize(naive_datetime)
+    except Exception as e:
+        logger.error(f"❌ Błąd pobierania historii 30 dni dla {city.name}: {e}")
+        raise e
 
 
-            t = temps[i] if i < len(temps) and temps[i] is not None else 0.0
-            p = precip[i] if i < len(precip) and precip[i] is not None else 0.0
-            w = winds[i] if i < len(winds) and winds[i] is not None else 0.0
-            h = humid[i] if i < len(humid) and humid[i] is not None else 50.0
+async def afetch_and_save_last_30_days(city):
+    """
+    Asynchroniczny odpowiednik fetch_and_save_last_30_days (widoki ASGI):
+    zapytania do archiwum idą przez asynchroniczną sesję, a zapytania do bazy
+    (w tym upsert w transakcji) przez sync_to_async.
+    """
+    start_date, end_date = last_30_days_range()
+    ranges = (await sync_to_async(missing_history_ranges)([city], start_date, end_date))[city.pk]
 
+    if not ranges:
+        logger.info(f"⏳ Historia 30 dni dla {city.name} jest kompletna. Pomijam zewnętrzne API.")
+        return UpsertResult(0, 0)
 
-            WeatherData.objects.update_or_create(
-                city=city,
-                timestamp=aware_datetime,
-                defaults={
-                    "temperature": t,
-                    "precipitation": p,
-                    "wind_speed": w,
-                    "relative_humidity": h
-                }
-            )
+    try:
+        session = openmeteo_clients.async_session()
+        rows = []
+        for range_start, range_end in ranges:
+            r = await session.get(HISTORY_ARCHIVE_URL, params=_history_params(city, range_start, range_end), timeout=30)
+            r.raise_for_status()
+            rows.extend(_parse_daily_history(r.json()))
+
+        if not rows:
+            logger.warning(f"Brak danych historycznych dla {city.name}")
+            return False
+
+        result = await sync_to_async(save_history_rows)(city, rows)
 
-        logger.info(f"✅ Zaktualizowano historię (WeatherData) 30 dni dla: {city.name}")
-        return True
+        logger.info(
+            f"✅ Zaktualizowano historię (WeatherData) 30 dni dla: {city.name} "
+            f"(nowe: {result.inserted}, zaktualizowane: {result.updated})"
+        )
+        return result
 
     except Exception as e:
         logger.error(f"❌ Błąd pobierania historii 30 dni dla {city.name}: {e}")
         raise e
 
 
-def fetch_history_for_all_cities():
+def fetch_history_for_all_cities(concurrency=HISTORY_FETCH_CONCURRENCY):
     """
     Uruchamia pobieranie historii (30 dni) dla KAŻDEGO miasta w bazie.
     Zwraca raport (listę komunikatów).
+
+    Zapytania do archiwum to blokujące wywołania wspólnej sesji `requests`
+    (clients.py), więc wykonuje je zwykła pula wątków - najwyżej
+    `concurrency` miast naraz, na już otwartych połączeniach z puli.
+    Wyniki zapisuje do bazy jeden "writer" - bieżący wątek - w kolejności
+    ukończenia pobierania.
     """
-    cities = City.objects.all()
-    report = []
+    cities = list(City.objects.all())
+    report_by_city = {}
 
     logger.info("--- START: Pobieranie historii dla wszystkich miast ---")
 
-    for city in cities:
-        try:
-            success = fetch_and_save_last_30_days(city)
-            status = "OK" if success else "Brak danych"
-            report.append(f"{city.name}: {status}")
-        except Exception as e:
-            logger.error(f"Błąd przy masowym pobieraniu dla {city.name}: {e}")
-            report.append(f"{city.name}: BŁĄD ({str(e)})")
+    start_date, end_date = last_30_days_range()
+    ranges_by_city = missing_history_ranges(cities, start_date, end_date)
 
+    for city in cities:
+        if not ranges_by_city[city.pk]:
+            report_by_city[city.name] = f"{city.name}: OK (historia kompletna)"
+    cities_to_fetch = [city for city in cities if city.name not in report_by_city]
+
+    session = openmeteo_clients.session()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(fetch_history_ranges, session, city, ranges_by_city[city.pk]): city
+            for city in cities_to_fetch
+        }
+        for future in as_completed(futures):
+            city = futures[future]
+            try:
+                rows = future.result()
+                if rows:
+                    result = save_history_rows(city, rows)
+                    logger.info(
+                        f"✅ Zaktualizowano historię (WeatherData) 30 dni dla: {city.name} "
+                        f"(nowe: {result.inserted}, zaktualizowane: {result.updated})"
+                    )
+                    status = f"OK (nowe: {result.inserted}, zaktualizowane: {result.updated})"
+                else:
+                    logger.warning(f"Brak danych historycznych dla {city.name}")
+                    status = "Brak danych"
+                report_by_city[city.name] = f"{city.name}: {status}"
+            except Exception as e:
+                logger.error(f"Błąd przy masowym pobieraniu dla {city.name}: {e}")
+                report_by_city[city.name] = f"{city.name}: BŁĄD ({str(e)})"
+
+    openmeteo_clients.log_stats()
     logger.info("--- KONIEC: Pobieranie historii zakończone ---")
-    return report
\ No newline at end of file
+    return [report_by_city[city.name] for city in cities]
+
+
+# Retencja: surowe odczyty starsze niż RAW_RETENTION_DAYS dni są usuwane
+# (zostają po nich agregaty godzinowe i dzienne), agregaty godzinowe - po
+# HOURLY_ROLLUP_RETENTION_DAYS dniach. Usuwamy paczkami po RETENTION_BATCH_SIZE
+# wierszy, żeby nie trzymać długo blokady zapisu.
+RAW_RETENTION_DAYS = 90
+HOURLY_ROLLUP_RETENTION_DAYS = 365
+RETENTION_BATCH_SIZE = 1000
+
+# Agregaty dnia są przeliczane z surowych odczytów przy każdym zapisie, więc
+# nie wolno usuwać odczytów z okresu, który nadal może być nadpisany
+# (okno pobierania historii to 30 dni).
+RAW_RETENTION_MIN_DAYS = 31
+
+
+def _delete_in_batches(queryset, batch_size, pause):
+    """
+    Usuwa wiersze querysetu (z polem `city`) paczkami, każda paczka w osobnej
+    transakcji. W tej samej transakcji podbija City.data_version miast, których
+    dane zniknęły - ETagi historii i statystyk nie mogą wskazywać usuniętych wierszy.
+    """
+    deleted = 0
+    while True:
+        rows = list(queryset.order_by().values_list("pk", "city_id")[:batch_size])
+        if not rows:
+            return deleted
+        with transaction.atomic():
+            queryset.model.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+            City.objects.filter(
+                pk__in={city_id for _, city_id in rows}
+            ).update(data_version=F("data_version") + 1, data_updated_at=timezone.now())
+        deleted += len(rows)
+        if pause:
+            sleep(pause)
+
+
+def compact_old_readings(
+    days=RAW_RETENTION_DAYS,
+    hourly_days=HOURLY_ROLLUP_RETENTION_DAYS,
+    batch_size=RETENTION_BATCH_SIZE,
+    pause=0.0,
+):
+    """
+    Usuwa surowe odczyty starsze niż `days` dni (ich dane zostają w agregatach
+    HourlyWeatherRollup / DailyWeatherRollup) oraz agregaty godzinowe starsze
+    niż `hourly_days` dni. Najnowszy odczyt każdego miasta nigdy nie jest usuwany.
+    Dzienne podsumowania z archiwum (jeden wiersz na dzień) zostają - nie ma ich
+    w agregatach.
+    Zwraca słownik z liczbą usuniętych wierszy.
+    """
+    if days < RAW_RETENTION_MIN_DAYS:
+        raise ValueError(f"Retencja surowych odczytów musi wynosić co najmniej {RAW_RETENTION_MIN_DAYS} dni.")
+
+    # Granica zaokrąglona do północy (czas polski) - nie rozcinamy agregatu dnia.
+    today = datetime.now(pytz.timezone("Europe/Warsaw")).date()
+    raw_cutoff = _history_timestamp(today - timedelta(days=days))
+    hourly_cutoff = _history_timestamp(today - timedelta(days=hourly_days))
+
+    logger.info(f"--- START: Kompaktowanie odczytów starszych niż {raw_cutoff:%Y-%m-%d} ---")
+
+    old_readings = WeatherData.objects.filter(
+        timestamp__lt=raw_cutoff, source=WeatherData.Source.CURRENT
+    ).exclude(
+        pk__in=City.objects.filter(latest_reading__isnull=False).values("latest_reading")
+    )
+    report = {
+        "readings": _delete_in_batches(old_readings, batch_size, pause),
+        "hourly_rollups": _delete_in_batches(
+            HourlyWeatherRollup.objects.filter(bucket_start__lt=hourly_cutoff), batch_size, pause
+        ),
+    }
+
+    logger.info(
+        f"--- KONIEC: Usunięto {report['readings']} odczytów i "
+        f"{report['hourly_rollups']} agregatów godzinowych ---"
+    )
+    return report
@@ -1,64 +1,115 @@
 from rest_framework import views, generics, status
 from rest_framework.response import Response
-from django.db.models import OuterRef, Subquery
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
 import logging
 
-from .models import WeatherData, City
-from .serializers import CurrentWeatherSerializer, CityHistorySerializer
-from .utils import fetch_and_save_weather_data, fetch_hourly_forecast, generate_weather_recommendation, \
-    fetch_and_save_last_30_days, fetch_history_for_all_cities
+from .conditional import conditional_get, latest_list_etag, latest_list_last_modified, city_history_etag, \
+    city_history_last_modified, city_window_validators, forecast_etag, forecast_last_modified, seconds_to_next_hour, \
+    WEATHER_MAX_AGE
+from .fastpath import FastPathMixin, fast_path_enabled, to_float, CURRENT_WEATHER_VALUES, WEATHER_DETAIL_VALUES
+from .jobs import enqueue_history_fetch, history_job_progress, process_history_tasks_in_background
+from .models import WeatherData, City, HourlyWeatherRollup, DailyWeatherRollup, HistoryFetchJob
+from .pagination import InvalidHistoryParam, paginate_history, parse_time_bound
+from .renderers import ColumnarFormatMixin, wants_columnar
+from .serializers import CurrentWeatherSerializer, CityHistorySerializer, HourlyRollupSerializer, \
+    DailyRollupSerializer, HistoryFetchTaskSerializer
+from .utils import fetch_hourly_forecast, generate_weather_recommendation, \
+    fetch_and_save_last_30_days, latest_weather_age, refresh_weather_in_background, cities_due_for_refresh, \
+    perceived_temperature_expression, WEATHER_FRESHNESS_SECONDS
 
 logger = logging.getLogger(__name__)
 
 def get_latest_weather_queryset():
-
-    latest_timestamp = WeatherData.objects.filter(
-        city=OuterRef("city")
-    ).order_by("-timestamp").values("timestamp")[:1]
+    """
+    Najnowszy odczyt dla każdego miasta - czytany przez wskaźnik
+    City.latest_reading, więc koszt zależy od liczby miast, a nie od historii.
+    """
+    latest_ids = City.objects.filter(
+        latest_reading__isnull=False
+    ).values("latest_reading")
 
     return WeatherData.objects.filter(
-        timestamp=Subquery(latest_timestamp)
-    ).select_related("city").order_by("city__name")
+        pk__in=latest_ids
+    ).select_related("city").annotate(
+        annotated_perceived_temperature=perceived_temperature_expression()
+    ).order_by("city__name")
 
 
-class LatestWeatherListAPI(generics.ListAPIView):
+def serialize_latest_weather(cities=None):
+    """
+    Dane najnowszych odczytów - szybką ścieżką (fastpath) lub przez
+    CurrentWeatherSerializer. `cities` ogranicza wynik do podanych miast.
+    """
+    latest_weather_data = get_latest_weather_queryset()
+    if cities is not None:
+        latest_weather_data = latest_weather_data.filter(city__in=cities)
+    if fast_path_enabled():
+        return CURRENT_WEATHER_VALUES.serialize(latest_weather_data)
+    return CurrentWeatherSerializer(latest_weather_data, many=True).data
+
+
+class LatestWeatherListAPI(FastPathMixin, generics.ListAPIView):
     """
     Zwraca najnowsze dane pogodowe BEZ odświeżania z zewnętrznego API.
+    Obsługuje zapytania warunkowe (ETag / Last-Modified -> 304), a gotowe
+    odpowiedzi (także gzip / brotli) trzyma w cache do zmiany danych.
     """
     serializer_class = CurrentWeatherSerializer
 
+    @conditional_get(latest_list_etag, latest_list_last_modified, max_age=WEATHER_MAX_AGE, precompress=True)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return Response(serialize_latest_weather())
+
     def get_queryset(self):
         return get_latest_weather_queryset()
 
 
 
-class RefreshWeatherAPI(views.APIView):
+class RefreshWeatherAPI(FastPathMixin, views.APIView):
     """
-    Pobiera, zapisuje i zwraca najnowsze odczyty dla każdego miasta.
+    Zwraca najnowsze odczyty dla każdego miasta (stale-while-revalidate).
+
+    Odpowiedź zawsze zawiera dane zapisane w bazie, bez czekania na zewnętrzne
+    API. Jeśli są starsze niż WEATHER_FRESHNESS_SECONDS (i jakieś miasto nie
+    czeka na ponowienie po błędzie), w tle startuje jedno odświeżanie,
+    a kolejne zapytania dostaną już nowe dane.
+    Nagłówki `X-Data-Age` (sekundy) i `X-Data-Stale` opisują świeżość danych.
     """
 
     def get(self, request):
-        try:
-            fetch_and_save_weather_data()
-        except Exception as e:
-            logger.error("Błąd krytyczny podczas pobierania danych z zewnętrznego API: %s", e)
-            return Response(
-                {"error": "Wystąpił błąd serwera podczas odświeżania danych pogodowych."},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        age = latest_weather_age()
+        stale = age is None or age >= WEATHER_FRESHNESS_SECONDS
 
-        latest_weather_data = get_latest_weather_queryset()
+        if stale and cities_due_for_refresh().exists():
+            try:
+                refresh_weather_in_background()
+            except Exception as e:
+                logger.error("Nie udało się uruchomić odświeżania pogody w tle: %s", e)
 
-        serializer = CurrentWeatherSerializer(latest_weather_data, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        response = Response(serialize_latest_weather(), status=status.HTTP_200_OK)
+        if age is not None:
+            response["X-Data-Age"] = str(int(age))
+        response["X-Data-Stale"] = "true" if stale else "false"
+        return response
 
 
 
-class CityDetailAPI(generics.RetrieveAPIView):
+class CityDetailAPI(ColumnarFormatMixin, FastPathMixin, generics.RetrieveAPIView):
     """
     Zwraca dane historyczne konkretnego miasta (JSON).
     Wyszukuje miasto bez uwzględniania wielkości liter (iexact).
+
+    Historia jest stronicowana kursorem: parametry `from`, `to`, `limit`
+    oraz `cursor` (wartość `next_cursor` z poprzedniej odpowiedzi).
+    `?format=columnar` / `?format=msgpack` zwraca historię kolumnowo.
+    Obsługuje zapytania warunkowe (ETag / Last-Modified -> 304), a gotowe
+    odpowiedzi (także gzip / brotli) trzyma w cache do zmiany danych.
     """
     serializer_class = CityHistorySerializer
     queryset = City.objects.all()
@@ -76,29 +127,149 @@ class CityDetailAPI(generics.RetrieveAPIView):
         )
         return obj
 
+    @conditional_get(city_history_etag, city_history_last_modified, max_age=WEATHER_MAX_AGE, precompress=True)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        city = self.get_object()
+
+        fast = fast_path_enabled()
+        columnar = wants_columnar(request)
+        try:
+            page, next_cursor = paginate_history(
+                city.weather_readings.annotate(perceived_temperature=perceived_temperature_expression()),
+                request.query_params,
+                values=WEATHER_DETAIL_VALUES.lookups if fast or columnar else None
+            )
+        except InvalidHistoryParam as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if columnar:
+            return Response({
+                "city_name": city.name,
+                "latitude": city.latitude,
+                "longitude": city.longitude,
+                "history": WEATHER_DETAIL_VALUES.serialize_columns(page),
+                "next_cursor": next_cursor,
+            })
+
+        if fast:
+            return Response({
+                "city_name": city.name,
+                "latitude": to_float(city.latitude),
+                "longitude": to_float(city.longitude),
+                "history": WEATHER_DETAIL_VALUES.serialize_rows(page),
+                "next_cursor": next_cursor,
+            })
+
+        city.history_page = page
+        data = self.get_serializer(city).data
+        data["next_cursor"] = next_cursor
+        return Response(data)
+
+
+def stats_window(request):
+    """
+    Parametry CityStatsAPI jako (bucket, from, to) - wspólne dla widoku i ETagu,
+    zapamiętane na obiekcie zapytania. Bez `to` okno kończy się na bieżącym
+    przedziale (stałym w obrębie godziny / dnia), bez `from` zaczyna się
+    STATS_DEFAULT_WINDOW przed `to`. Niepoprawne parametry: InvalidHistoryParam.
+    """
+    if not hasattr(request, "_stats_window"):
+        bucket = request.GET.get("bucket", "day")
+        if bucket not in CityStatsAPI.BUCKETS:
+            raise InvalidHistoryParam(f"Niepoprawny parametr 'bucket': {bucket}. Dozwolone: hour, day.")
+
+        model, _ = CityStatsAPI.BUCKETS[bucket]
+        time_to = parse_time_bound("to", request.GET.get("to")) or model.bucket_for(timezone.now())
+        time_from = parse_time_bound("from", request.GET.get("from")) \
+            or time_to - CityStatsAPI.STATS_DEFAULT_WINDOW[bucket]
+        request._stats_window = (bucket, time_from, time_to)
+    return request._stats_window
+
+
+city_stats_etag, city_stats_last_modified = city_window_validators(stats_window)
+
+
+class CityStatsAPI(views.APIView):
+    """
+    Zwraca agregaty (min / średnia / max) odczytów miasta w przedziałach
+    godzinowych lub dziennych, czytane z tabel agregatów.
+
+    Parametry: `bucket` (hour / day, domyślnie day), `from`, `to`.
+    Bez `to` zwracany jest okres do bieżącego przedziału, bez `from` -
+    STATS_DEFAULT_WINDOW wstecz od `to`.
+    """
+
+    BUCKETS = {
+        "hour": (HourlyWeatherRollup, HourlyRollupSerializer),
+        "day": (DailyWeatherRollup, DailyRollupSerializer),
+    }
+    STATS_DEFAULT_WINDOW = {
+        "hour": timedelta(days=7),
+        "day": timedelta(days=365),
+    }
+
+    @conditional_get(city_stats_etag, city_stats_last_modified, max_age=WEATHER_MAX_AGE, precompress=True)
+    def get(self, request, city_name):
+        city = get_object_or_404(City, name__iexact=city_name)
+
+        try:
+            bucket, time_from, time_to = stats_window(request)
+        except InvalidHistoryParam as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        model, serializer_class = self.BUCKETS[bucket]
+        rollups = model.objects.filter(
+            city=city,
+            bucket_start__gte=time_from,
+            bucket_start__lte=time_to,
+        ).order_by("bucket_start")
+
+        return Response(
+            {
+                "city": city.name,
+                "bucket": bucket,
+                "from": time_from,
+                "to": time_to,
+                "stats": serializer_class(rollups, many=True).data,
+            },
+            status=status.HTTP_200_OK
+        )
+
 
-class HourlyForecastAPI(views.APIView):
+def parse_forecast_hours(value):
+    """Parsuje parametr 'hours' prognozy (liczba dodatnia). Zwraca None, gdy niepoprawny."""
+    try:
+        hours = int(value)
+    except (TypeError, ValueError):
+        return None
+    return hours if hours > 0 else None
+
+
+class HourlyForecastAPI(ColumnarFormatMixin, views.APIView):
     """
     Zwraca prognozę godzinową dla danego miasta (domyślnie 48 godzin).
     Oraz REKOMENDACJĘ (AI/Algorytm).
+    `?format=columnar` / `?format=msgpack` zwraca godziny kolumnowo.
+    Odpowiedź jest ważna do końca bieżącej godziny (ETag / Cache-Control).
     """
 
+    @conditional_get(forecast_etag, forecast_last_modified, max_age=seconds_to_next_hour, precompress=True)
     def get(self, request, city_name):
         city = get_object_or_404(City, name__iexact=city_name)
 
         hours_param = request.query_params.get("hours", 48)
-        try:
-            hours = int(hours_param)
-            if hours <= 0:
-                raise ValueError
-        except ValueError:
+        hours = parse_forecast_hours(hours_param)
+        if hours is None:
             return Response(
                 {"error": f"Niepoprawny parametr 'hours': {hours_param}."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         try:
-            # 1. Pobieramy prognozę (lista słowników)
+            # 1. Pobieramy prognozę (kolumny NumPy)
             forecast = fetch_hourly_forecast(city, hours=hours)
 
             # 2. Generujemy rekomendację na podstawie tej prognozy
@@ -109,7 +280,8 @@ class HourlyForecastAPI(views.APIView):
                 {
                     "city": city.name,
                     "hours": hours,
-                    "hourly": forecast,
+                    # Słowniki / listy powstają dopiero tutaj, przy renderowaniu
+                    "hourly": forecast.columns() if wants_columnar(request) else forecast.rows(),
                     "recommendation": recommendation_text
                 },
                 status=status.HTTP_200_OK
@@ -132,9 +304,13 @@ class FetchCityHistoryAPI(views.APIView):
         city = get_object_or_404(City, name__iexact=city_name)
 
         try:
-            fetch_and_save_last_30_days(city)
+            result = fetch_and_save_last_30_days(city)
             return Response(
-                {"message": f"Pomyślnie pobrano historię (30 dni) dla miasta: {city.name}"},
+                {
+                    "message": f"Pomyślnie pobrano historię (30 dni) dla miasta: {city.name}",
+                    "inserted": result.inserted if result else 0,
+                    "updated": result.updated if result else 0,
+                },
                 status=status.HTTP_200_OK
             )
         except Exception as e:
@@ -147,23 +323,66 @@ class FetchCityHistoryAPI(views.APIView):
 class FetchAllHistoryAPI(views.APIView):
     """
     Endpoint: /api/pogoda/fetch-history-all/
-    Pobiera dane historyczne (30 dni) dla WSZYSTKICH miast w bazie naraz.
+    Zleca pobranie danych historycznych (30 dni) dla WSZYSTKICH miast w bazie.
+
+    Nie czeka na Open-Meteo: tworzy zlecenie (pogoda_app/jobs.py), uruchamia
+    jego wykonanie w tle i od razu odpowiada 202 z identyfikatorem. Postęp
+    i wyniki dla miast zwraca /fetch-history-all/<job_id>/. Jeśli
+    poprzednie zlecenie jeszcze trwa, zwracane jest ono zamiast nowego.
+
+    GET niczego nie zleca - zwraca stan ostatniego zlecenia (404, gdy go nie ma).
     """
 
-    def get(self, request):
+    def post(self, request):
         try:
-            # Uruchamiamy pętlę dla wszystkich miast
-            report = fetch_history_for_all_cities()
-
-            return Response(
-                {
-                    "message": "Zakończono pobieranie historii dla wszystkich miast.",
-                    "details": report
-                },
-                status=status.HTTP_200_OK
-            )
+            job, created = enqueue_history_fetch()
+            process_history_tasks_in_background()
         except Exception as e:
             return Response(
                 {"error": f"Wystąpił błąd krytyczny: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+        status_url = request.build_absolute_uri(reverse('fetch-history-job', args=[job.pk]))
+        return Response(
+            {
+                "message": "Zlecono pobieranie historii dla wszystkich miast." if created
+                else "Pobieranie historii dla wszystkich miast już trwa.",
+                "job_id": str(job.pk),
+                "status": job.status,
+                "total": job.total,
+                "status_url": status_url,
+            },
+            status=status.HTTP_202_ACCEPTED,
+            headers={"Location": status_url},
+        )
+
+    def get(self, request):
+        job = HistoryFetchJob.objects.order_by('-created_at').first()
+        if job is None:
+            return Response(
+                {"error": "Nie zlecono jeszcze pobierania historii - użyj POST."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        status_url = request.build_absolute_uri(reverse('fetch-history-job', args=[job.pk]))
+        return Response(
+            {**history_job_progress(job), "status_url": status_url},
+            headers={"Cache-Control": "no-store"},
+        )
+
+
+class HistoryFetchJobAPI(views.APIView):
+    """
+    Endpoint: /fetch-history-all/<job_id>/
+    Stan zlecenia pobierania historii: postęp, szacowany czas do końca
+    i wynik dla każdego miasta.
+    """
+
+    def get(self, request, job_id):
+        job = get_object_or_404(HistoryFetchJob, pk=job_id)
+        tasks = job.tasks.order_by('city_id')
+        return Response(
+            {**history_job_progress(job), "results": HistoryFetchTaskSerializer(tasks, many=True).data},
+            headers={"Cache-Control": "no-store"},
+        )
\ No newline at end of file